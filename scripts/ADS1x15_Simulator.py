@@ -0,0 +1,430 @@
+#!/usr/bin/python
+
+import os
+import math
+import time
+import errno
+import random
+import threading
+from Adafruit_I2C import Adafruit_I2C
+from Monotonic_Clock import monotonic
+
+# ===========================================================================
+# SimulatedADS1x15 Class
+#
+# Register model of an ADS1015/ADS1115 for running the ADS1x15 driver without
+# the hardware. The conversions are timed from the data rate of the config
+# register (scaled by an oscillator error, the real parts are within +/-10%),
+# the OS bit reads 0 while a single-shot conversion runs, the continuous mode
+# keeps converting, and the comparator drives a modelled ALERT/RDY pin.
+# Inputs are per channel functions of the time returning mV.
+# ===========================================================================
+
+class SimulatedADS1x15(object):
+
+  # Data rates of the DR field, by IC (0x00 ADS1015, 0x01 ADS1115)
+  rates = {
+    0x00: (128, 250, 490, 920, 1600, 2400, 3300, 3300),
+    0x01: (8, 16, 32, 64, 128, 250, 475, 860)
+  }
+  # Full scale range of the PGA field in mV
+  fullScale = (6144, 4096, 2048, 1024, 512, 256, 256, 256)
+  # Inputs of the MUX field, (positive, negative), None being GND
+  inputPairs = ((0, 1), (0, 3), (1, 3), (2, 3), (0, None), (1, None), (2, None), (3, None))
+  # Conversions the comparator must see out of limits, by CQUE field
+  queueLengths = (1, 2, 4)
+
+  # Conversions older than this are not replayed through the comparator
+  # when the continuous mode wasn't looked at for a while
+  maxBacklog = 16
+
+  def __init__(self, ic=0x00, drift=0.0, noise=0.0, clock=monotonic):
+    "ic is 0x00 for an ADS1015 and 0x01 for an ADS1115. drift is the relative \
+    error of the internal oscillator (0.05 converts 5% faster than nominal), \
+    noise the RMS noise in mV at the fastest data rate (the digital filter \
+    of the chip averages it down at the slower rates) and clock the time \
+    source in seconds."
+    self.ic = ic
+    self.drift = drift
+    self.noise = noise
+    self.clock = clock
+    self.inputs = [0.0]*4
+    # Conversions done, config writes and conversion register reads
+    self.conversions = 0
+    self.configWrites = 0
+    self.reads = 0
+    # ALERT/RDY pulses in continuous conversion ready mode
+    self.rdyPulses = 0
+    self.reset()
+
+  def reset(self):
+    "Power-on state of the registers"
+    self.config = 0x0583
+    self.loThresh = 0x8000
+    self.hiThresh = 0x7FFF
+    self.conversion = 0
+    self.pointer = 0
+    self.__start = None
+    self.__done = 0
+    self.__queue = 0
+    self.__alert = False
+
+  def setInput(self, channel, source):
+    "Sets the input of AIN0-AIN3: a constant in mV or a function of the \
+    time (in seconds, from the clock) returning mV. See sine() and ramp()."
+    self.inputs[channel] = source
+
+  def voltage(self, channel, t):
+    "Returns the mV on the channel at time t"
+    source = self.inputs[channel]
+    return source(t) if callable(source) else source
+
+  def period(self):
+    "Returns the real conversion time of the current data rate"
+    return 1.0/(self.rates[self.ic][(self.config >> 5) & 0x07]*(1.0 + self.drift))
+
+  def continuous(self):
+    return not (self.config & 0x0100)
+
+  def busy(self):
+    "Returns True while a conversion is running"
+    self.__update()
+    return self.__start is not None
+
+  def __update(self):
+    # Completes the conversions that have ended since the last access
+    if self.__start is None:
+      return
+    period = self.period()
+    ended = int((self.clock() - self.__start)/period)
+    if not self.continuous():
+      ended = min(ended, 1)
+    if ended - self.__done > self.maxBacklog:
+      self.__done = ended - self.maxBacklog
+    while self.__done < ended:
+      self.__done += 1
+      self.__convert(self.__start + self.__done*period)
+    if not self.continuous() and ended:
+      # Single-shot: powers down after the conversion
+      self.__start = None
+
+  def __convert(self, t):
+    pair = self.inputPairs[(self.config >> 12) & 0x07]
+    mV = self.voltage(pair[0], t)
+    if pair[1] is not None:
+      mV -= self.voltage(pair[1], t)
+    if self.noise:
+      rates = self.rates[self.ic]
+      mV += random.gauss(0.0, self.noise*math.sqrt(float(rates[(self.config >> 5) & 0x07])/rates[-1]))
+    fs = self.fullScale[(self.config >> 9) & 0x07]
+    if self.ic == 0x00:
+      # 12-bit result, left justified in the 16-bit register
+      code = max(-2048, min(2047, int(round(mV*2048.0/fs)))) << 4
+    else:
+      code = max(-32768, min(32767, int(round(mV*32768.0/fs))))
+    self.conversion = code & 0xFFFF
+    self.conversions += 1
+    self.__compare(code)
+
+  def __signed(self, value):
+    return value - 0x10000 if value & 0x8000 else value
+
+  def conversionReadyMode(self):
+    "True when the thresholds make ALERT/RDY a conversion ready signal"
+    return (self.hiThresh & 0x8000) and not (self.loThresh & 0x8000)
+
+  def __compare(self, code):
+    cque = self.config & 0x03
+    if cque == 0x03:
+      return
+    if self.conversionReadyMode():
+      # Asserted at the end of each conversion, a short pulse in continuous mode
+      self.rdyPulses += 1
+      self.__alert = not self.continuous()
+      return
+    high = self.__signed(self.hiThresh)
+    low = self.__signed(self.loThresh)
+    latching = self.config & 0x04
+    if self.config & 0x10:
+      # Window comparator
+      outside = (code > high) or (code < low)
+    else:
+      # Traditional comparator, with hysteresis between the thresholds
+      outside = code > high
+      if (code < low) and not latching:
+        self.__alert = False
+    if outside:
+      self.__queue += 1
+      if self.__queue >= self.queueLengths[cque]:
+        self.__alert = True
+    else:
+      self.__queue = 0
+      if (self.config & 0x10) and not latching:
+        self.__alert = False
+
+  def alert(self):
+    "Returns True while the comparator asserts ALERT/RDY"
+    self.__update()
+    return self.__alert and ((self.config & 0x03) != 0x03)
+
+  def alertLevel(self):
+    "Returns the logic level of the open drain ALERT/RDY pin (pulled up)"
+    active = self.alert()
+    if self.config & 0x08:
+      return 1 if active else 0
+    return 0 if active else 1
+
+  def __register(self, pointer):
+    if pointer == 0x00:
+      self.__update()
+      self.reads += 1
+      # Reading the conversion register clears a latched alert
+      if self.config & 0x04:
+        self.__alert = False
+      return self.conversion
+    if pointer == 0x01:
+      # OS bit: 0 while converting, always the case in continuous mode
+      return (self.config & 0x7FFF) | (0x0000 if self.busy() else 0x8000)
+    if pointer == 0x02:
+      return self.loThresh
+    return self.hiThresh
+
+  def write(self, data):
+    "Bytes written by the master: the pointer and the register MSB/LSB"
+    if len(data) == 0:
+      return
+    self.pointer = data[0] & 0x03
+    if len(data) < 3:
+      return
+    value = ((data[1] << 8) | data[2]) & 0xFFFF
+    if self.pointer == 0x01:
+      self.__writeConfig(value)
+    elif self.pointer == 0x02:
+      self.loThresh = value
+    elif self.pointer == 0x03:
+      self.hiThresh = value
+
+  def __writeConfig(self, value):
+    self.__update()
+    self.configWrites += 1
+    wasContinuous = self.continuous()
+    wasBusy = self.__start is not None
+    self.config = value & 0x7FFF
+    self.__queue = 0
+    if self.continuous() or (value & 0x8000) and (wasContinuous or not wasBusy):
+      # Writing the config restarts the continuous conversions, OS=1
+      # starts a single-shot one unless one is already running
+      self.__start = self.clock()
+      self.__done = 0
+      if self.conversionReadyMode():
+        self.__alert = False
+    elif wasContinuous:
+      # Back to single-shot: powers down
+      self.__start = None
+
+  def read(self, length):
+    "Bytes read by the master from the register the pointer addresses"
+    value = self.__register(self.pointer)
+    data = []
+    while len(data) < length:
+      data.extend([(value >> 8) & 0xFF, value & 0xFF])
+    return data[:length]
+
+
+# ===========================================================================
+# SimulatedSMBus Class
+#
+# Stands in for smbus.SMBus, see install(). Every message takes the time its
+# bytes need on the wire at busSpeed, and errorRate randomly fails messages
+# with the EREMOTEIO an absent or disturbed device gives. It also serves the
+# plain reads and I2C_RDWR transfers of Adafruit_I2C (i2c_transfer()).
+# ===========================================================================
+
+class SimulatedSMBus(object):
+
+  def __init__(self, devices=None, busSpeed=100000, errorRate=0.0):
+    "devices maps addresses to simulated devices (write(data)/read(length))"
+    self.devices = dict(devices or {})
+    self.busSpeed = busSpeed
+    self.errorRate = errorRate
+    # Messages and bytes transferred, failed messages and time on the wire
+    self.messages = 0
+    self.bytes = 0
+    self.errors = 0
+    self.busTime = 0.0
+    self.__lock = threading.Lock()
+
+  def attach(self, address, device):
+    self.devices[address] = device
+    return device
+
+  def __device(self, address, count, combined=False):
+    # One message of 'count' data bytes, the address byte and the ACK bits
+    # make it (count + 1)*9 clocks long. The time of the messages of a
+    # combined transfer is handled by i2c_transfer().
+    with self.__lock:
+      self.messages += 1
+      duration = self.__duration(count)
+      self.busTime += duration
+      if duration and not combined:
+        time.sleep(duration)
+      device = self.devices.get(address)
+      if (device is None) or (self.errorRate and random.random() < self.errorRate):
+        self.errors += 1
+        raise IOError(errno.EREMOTEIO, os.strerror(errno.EREMOTEIO))
+      self.bytes += count
+      return device
+
+  def __duration(self, count):
+    return (count + 1)*9.0/self.busSpeed if self.busSpeed else 0.0
+
+  def __write(self, address, data, combined=False):
+    self.__device(address, len(data), combined).write(data)
+
+  def __read(self, address, length, combined=False):
+    return self.__device(address, length, combined).read(length)
+
+  def write_byte(self, address, value):
+    self.__write(address, [value])
+
+  def read_byte(self, address):
+    return self.__read(address, 1)[0]
+
+  def write_byte_data(self, address, reg, value):
+    self.__write(address, [reg, value])
+
+  def read_byte_data(self, address, reg):
+    self.__write(address, [reg])
+    return self.__read(address, 1)[0]
+
+  def write_word_data(self, address, reg, value):
+    # SMBus words go LSB first
+    self.__write(address, [reg, value & 0xFF, (value >> 8) & 0xFF])
+
+  def read_word_data(self, address, reg):
+    self.__write(address, [reg])
+    data = self.__read(address, 2)
+    return data[0] | (data[1] << 8)
+
+  def write_i2c_block_data(self, address, reg, data):
+    self.__write(address, [reg] + list(data))
+
+  def read_i2c_block_data(self, address, reg, length=32):
+    self.__write(address, [reg])
+    return self.__read(address, length)
+
+  def i2c_transfer(self, address, messages):
+    "Combined transfer: lists of bytes are writes, ints read lengths. \
+    Returns the read results. The kernel sends the messages back to back, \
+    so the clock of the device is held at the time each message ends on the \
+    wire instead of sleeping in between, which could overshoot by \
+    milliseconds and let a conversion end in the middle of the transfer."
+    device = self.devices.get(address)
+    clock = getattr(device, 'clock', None)
+    wire = [clock() if clock else 0.0]
+    if clock:
+      device.clock = lambda: wire[0]
+    results = []
+    try:
+      for message in messages:
+        if isinstance(message, (int, long)):
+          wire[0] += self.__duration(message)
+          results.append(self.__read(address, message, True))
+        else:
+          wire[0] += self.__duration(len(message))
+          self.__write(address, list(message), True)
+    finally:
+      if clock:
+        device.clock = clock
+    if clock and wire[0] > clock():
+      time.sleep(wire[0] - clock())
+    return results
+
+  def close(self):
+    pass
+
+  def stats(self):
+    "Returns the bus counters as a dictionary"
+    return {'messages': self.messages,
+            'bytes': self.bytes,
+            'errors': self.errors,
+            'busTime': self.busTime}
+
+
+def install(devices, busnum=None, **kwargs):
+  "Attaches a SimulatedSMBus with the devices ({address: device}) to the \
+  bus number (the default bus of the board if None), so the Adafruit_I2C \
+  devices created afterwards on it talk to the simulation. The keyword \
+  arguments go to SimulatedSMBus. Returns the SimulatedSMBus."
+  if busnum is None:
+    busnum = Adafruit_I2C.getPiI2CBusNumber()
+  bus = SimulatedSMBus(devices, **kwargs)
+  Adafruit_I2C.attachBus(busnum, bus)
+  return bus
+
+
+# Input waveforms for SimulatedADS1x15.setInput()
+
+def sine(amplitude, frequency, offset=0.0, phase=0.0):
+  "Sine of 'amplitude' mV and 'frequency' Hz around 'offset' mV"
+  return lambda t: offset + amplitude*math.sin(2*math.pi*frequency*t + phase)
+
+def ramp(slope, offset=0.0, low=-6144.0, high=6144.0):
+  "Ramp of 'slope' mV per second, clipped to [low, high]"
+  return lambda t: max(low, min(high, offset + slope*t))
+
+
+if __name__ == '__main__':
+  # Benchmarks the ADS1x15 read paths on the simulation
+  from Adafruit_ADS1x15 import ADS1x15
+  ads1115 = SimulatedADS1x15(ic=0x01, drift=-0.05, noise=0.1)
+  ads1015 = SimulatedADS1x15(ic=0x00, drift=0.08)
+  for ch in range(4):
+    ads1115.setInput(ch, sine(1000.0, 1.0 + ch, 1500.0))
+    ads1015.setInput(ch, 500.0*(ch + 1))
+  bus = install({0x48: ads1115, 0x49: ads1015})
+
+  def bench(name, function, count):
+    messages = bus.messages
+    start = monotonic()
+    for i in range(count):
+      function()
+    elapsed = monotonic() - start
+    print "%-36s %8.1f reads/s %6.2f ms/read %5.1f messages/read" % \
+      (name, count/elapsed, 1000.0*elapsed/count, float(bus.messages - messages)/count)
+
+  adc = ADS1x15(address=0x48, ic=0x01)
+  bench("ADS1115 single-ended, 860 SPS", lambda: adc.readADCSingleEnded(0, 4096, 860), 200)
+  adc.enableConversionReady()
+  bench("ADS1115 single-ended, OS polling", lambda: adc.readADCSingleEnded(0, 4096, 860), 200)
+  scan = adc.compileScan([0, 1, 2, 3], 4096, 860)
+  bench("ADS1115 4 channel scan (per scan)", lambda: scan.run(), 50)
+  adc = ADS1x15(address=0x49, ic=0x00, rdwr=True)
+  adc.enableConversionReady()
+  bench("ADS1015 single-ended, I2C_RDWR", lambda: adc.readADCSingleEnded(1, 4096, 3300), 500)
+  print "ADS1015 channel 0 reads %.1f mV, 500.0 mV applied" % \
+    adc.readADCSingleEnded(0, 4096, 3300)
+  stream = adc.startStream(0, 4096, 1600)
+  time.sleep(1.0)
+  stream.stop()
+  print "ADS1015 stream at 1600 SPS: %d samples in 1 s, %d late" % (stream.written, stream.late)
+  print "Bus: %(messages)d messages, %(bytes)d bytes, %(busTime).3f s on the wire" % bus.stats()
+
+  # Every row of a scan has to hold the value of its own channel, whatever
+  # the oscillator error and whether the conversions are overlapped
+  check = bus.attach(0x4A, SimulatedADS1x15(ic=0x01))
+  for ch in range(4):
+    check.setInput(ch, 100.0*(ch + 1))
+  for rdwr in (False, True):
+    adc = ADS1x15(address=0x4A, ic=0x01, rdwr=rdwr)
+    for sps in (860, 475):
+      scan = adc.compileScan([0, 1, 2, 3], 4096, sps)
+      for drift in (-0.09, 0.09):
+        check.drift = drift
+        wrong = 0
+        for i in range(200):
+          row = scan.run()[0]
+          if max([abs(row[ch] - 100.0*(ch + 1)) for ch in range(4)]) > 1.0:
+            wrong += 1
+        print "ADS1115 scan, %3d SPS, %+d%% clock, %-9s %d of 200 scans with a wrong channel" % \
+          (sps, int(round(100*drift)), "I2C_RDWR:" if rdwr else "SMBus:", wrong)
@@ -1,8 +1,12 @@
 #!/usr/bin/python
 
 import time
-import smbus
-from Adafruit_I2C import Adafruit_I2C
+import threading
+import traceback
+import collections
+import numpy as np
+from Adafruit_I2C import Adafruit_I2C, I2CReturn
+from Monotonic_Clock import monotonic
 
 # ===========================================================================
 # ADS1x15 Class
@@ -14,7 +18,7 @@ from Adafruit_I2C import Adafruit_I2C
 # should be 
 #              __ADS1015_REG_CONFIG_DR_920SPS    = 0x0060     
 #
-# NOT IMPLEMENTED: Conversion ready pin, page 15 datasheet.
+# Conversion ready pin (page 15 datasheet): see enableConversionReady().
 # ===========================================================================
 
 class ADS1x15:
@@ -126,16 +130,38 @@ class ADS1x15:
     512:__ADS1015_REG_CONFIG_PGA_0_512V,
     256:__ADS1015_REG_CONFIG_PGA_0_256V
   }    
+  # Dictionary with the input multiplexer settings, single-ended inputs are
+  # keyed by channel number and differential inputs by (chP, chN)
+  muxADS1x15 = {
+    0:__ADS1015_REG_CONFIG_MUX_SINGLE_0,
+    1:__ADS1015_REG_CONFIG_MUX_SINGLE_1,
+    2:__ADS1015_REG_CONFIG_MUX_SINGLE_2,
+    3:__ADS1015_REG_CONFIG_MUX_SINGLE_3,
+    (0, 1):__ADS1015_REG_CONFIG_MUX_DIFF_0_1,
+    (0, 3):__ADS1015_REG_CONFIG_MUX_DIFF_0_3,
+    (1, 3):__ADS1015_REG_CONFIG_MUX_DIFF_1_3,
+    (2, 3):__ADS1015_REG_CONFIG_MUX_DIFF_2_3
+  }
+  # Config register bytes already computed by __config(), shared by all the
+  # instances since the key includes the IC type
+  __configCache = {}
+
+  # Auto-ranging picks the smallest range where the largest of the last
+  # autoRangeHistory readings of the channel uses at most autoRangeHeadroom
+  # of the full scale, see readADCAutoRanged()
+  autoRangeHistory = 8
+  autoRangeHeadroom = 0.8
   
 
   # Constructor
-  def __init__(self, address=0x48, ic=__IC_ADS1015, debug=False):
+  def __init__(self, address=0x48, ic=__IC_ADS1015, debug=False, busnum=-1, rdwr=False):
     # Depending on if you have an old or a new Raspberry Pi, you
     # may need to change the I2C bus.  Older Pis use SMBus 0,
     # whereas new Pis use SMBus 1.  If you see an error like:
     # 'Error accessing 0x48: Check your I2C address '
-    # change the SMBus number in the initializer below!
-    self.i2c = Adafruit_I2C(address)
+    # pass the SMBus number as busnum.
+    # rdwr=True uses I2C_RDWR combined transfers when available.
+    self.i2c = Adafruit_I2C(address, busnum, rdwr=rdwr)
     self.address = address
     self.debug = debug
 
@@ -150,8 +176,185 @@ class ADS1x15:
     # Set pga value, so that getLastConversionResult() can use it,
     # any function that accepts a pga value must update this.
     self.pga = 6144    
+
+    # Conversion ready handling, see enableConversionReady()
+    # The comparator queue stays disabled unless ALERT/RDY is used
+    self.__cque = self.__ADS1015_REG_CONFIG_CQUE_NONE
+    self.rdyPin = None
+    self.rdyPoll = False
+    self.__rdyEvent = threading.Event()
+    self.__conversionStart = 0
+    # Seconds between the config write and the result being available,
+    # updated by every read method
+    self.lastLatency = None
+    # Auto-ranging state of each mux setting, see readADCAutoRanged()
+    self.autoRange = {}
   
     
+  def enableConversionReady(self, pin=None):
+    "Uses the ALERT/RDY pin as a conversion ready signal, see datasheet page 15. \
+    The threshold registers are set to Hi_thresh=0x8000 and Lo_thresh=0x0000 and \
+    the comparator queue is enabled, so the pin goes low when a conversion ends. \
+    pin is the BCM GPIO wired to ALERT/RDY (open drain, the internal pull-up is \
+    enabled). Reads then wait for the falling edge instead of sleeping. \
+    Without a pin, or if the edge doesn't show up in time, the OS bit of the \
+    config register is polled instead."
+    self.i2c.writeListCached(self.__ADS1015_REG_POINTER_HITHRESH, [0x80, 0x00])
+    self.i2c.writeListCached(self.__ADS1015_REG_POINTER_LOWTHRESH, [0x00, 0x00])
+    self.__cque = self.__ADS1015_REG_CONFIG_CQUE_1CONV
+    if (self.rdyPin is not None) and (pin != self.rdyPin):
+      import RPi.GPIO as GPIO
+      GPIO.remove_event_detect(self.rdyPin)
+    if (pin is not None) and (pin != self.rdyPin):
+      import RPi.GPIO as GPIO
+      GPIO.setmode(GPIO.BCM)
+      GPIO.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+      GPIO.add_event_detect(pin, GPIO.FALLING, callback=self.__onConversionReady)
+    self.rdyPin = pin
+    self.rdyPoll = True
+
+  def disableConversionReady(self):
+    "Goes back to fixed 1/sps sleeps and releases the ALERT/RDY pin. \
+    The comparator functions call this since they reuse the threshold registers."
+    if self.rdyPin is not None:
+      import RPi.GPIO as GPIO
+      GPIO.remove_event_detect(self.rdyPin)
+    self.__cque = self.__ADS1015_REG_CONFIG_CQUE_NONE
+    self.rdyPin = None
+    self.rdyPoll = False
+
+  def __onConversionReady(self, channel):
+    self.__rdyEvent.set()
+
+  def waitForConversionReady(self, timeout):
+    "Blocks until the ALERT/RDY pin signals the end of a conversion. \
+    Returns False on timeout or when no ready pin is configured. \
+    In continuous mode the pin pulses once per conversion."
+    if self.rdyPin is None:
+      return False
+    ready = self.__rdyEvent.wait(timeout)
+    self.__rdyEvent.clear()
+    return ready
+
+  def __startConversion(self, bytes, cached=False):
+    # Clear any stale ready edge before the conversion starts
+    self.__rdyEvent.clear()
+    if cached:
+      # Rewriting the running continuous mode config would only restart it,
+      # returns False when the register shadow already holds these bytes
+      written = self.i2c.writeListCached(self.__ADS1015_REG_POINTER_CONFIG, bytes)
+    else:
+      self.i2c.writeList(self.__ADS1015_REG_POINTER_CONFIG, bytes)
+      written = True
+    # The conversion starts at the end of the config write, not when it is
+    # queued: the bytes take about 0.4ms on a 100kHz bus
+    self.__conversionStart = monotonic()
+    return written
+
+  def __restartAndRead(self, bytes):
+    # Starts the next conversion and reads the result of the previous one,
+    # which stays in the conversion register until the new one ends.
+    # The config write, pointer write and read share one I2C_RDWR syscall,
+    # runScan() only overlaps conversions when the bus has it.
+    assert self.i2c.rdwr, "overlapped scans need I2C_RDWR"
+    self.__rdyEvent.clear()
+    result = self.i2c.transfer([[self.__ADS1015_REG_POINTER_CONFIG] + bytes,
+                                [self.__ADS1015_REG_POINTER_CONVERT], 2])
+    # The conversion started within the transfer, timing it from the end
+    # only makes the wait longer
+    self.__conversionStart = monotonic()
+    return self.__toCode(result[0])
+
+  def __pollConversion(self, timeout):
+    # The OS bit reads 1 once the single-shot conversion has finished
+    deadline = monotonic() + timeout
+    while monotonic() < deadline:
+      result = self.i2c.readList(self.__ADS1015_REG_POINTER_CONFIG, 2)
+      if result[0] & 0x80:
+        return True
+      # Leave the bus to the other devices between reads, 0.2ms is about
+      # the length of a read at 100kHz
+      time.sleep(0.0002)
+    return False
+
+  def __conversionTimes(self, sps, margin=0.0001):
+    # The internal oscillator is only accurate to +/-10%, so the nominal
+    # 1/sps is both too long and too short. Returns the seconds from the
+    # start to the end of the fastest possible conversion, and the fixed
+    # wait covering the slowest one (10% under the nominal rate)
+    period = 1.0/sps
+    return 0.9*period, period/0.9 + margin
+
+  def __waitForConversion(self, sps, margin=0.0001, continuous=False):
+    # Waits for the real end of the conversion when it can be seen
+    period = 1.0/sps
+    fastest, slowest = self.__conversionTimes(sps, margin)
+    done = False
+    if self.rdyPin is not None:
+      done = self.waitForConversionReady(2*period + 0.01)
+    if not done and self.rdyPoll and not continuous:
+      # Sleep through the fastest possible conversion before polling
+      elapsed = monotonic() - self.__conversionStart
+      if elapsed < fastest:
+        time.sleep(fastest - elapsed)
+      done = self.__pollConversion(2*period + 0.01)
+    if not done:
+      # A fixed sleep has to cover the slowest oscillator
+      elapsed = monotonic() - self.__conversionStart
+      if elapsed < slowest:
+        time.sleep(slowest - elapsed)
+    self.lastLatency = monotonic() - self.__conversionStart
+
+  def __config(self, mux, pga, sps, continuous=False):
+    # Returns (config bytes, pga, sps) for a conversion on the given mux
+    # setting, with invalid pga/sps values replaced by the defaults, or None
+    # for an invalid mux. Each config word is only computed once per
+    # (ic, mux, pga, sps, mode, comparator queue) combination.
+    key = (self.ic, mux, pga, sps, continuous, self.__cque)
+    entry = self.__configCache.get(key)
+    if entry is not None:
+      return entry
+    if mux not in self.muxADS1x15:
+      if (self.debug):
+        print "ADS1x15: Invalid channels specified: %s" % str(mux)
+      return None
+
+    # Set sample per seconds, defaults to 1600sps (ADS1015) or 250sps (ADS1115)
+    if (self.ic == self.__IC_ADS1015):
+      rates, defaultSps = self.spsADS1015, 1600
+    else:
+      rates, defaultSps = self.spsADS1115, 250
+    if sps not in rates:
+      if (self.debug):
+        print "ADS1x15: Invalid sps specified: %d, using %dsps" % (sps, defaultSps)
+      sps = defaultSps
+
+    # Set PGA/voltage range, defaults to +-6.144V
+    if pga not in self.pgaADS1x15:
+      if (self.debug):
+        print "ADS1x15: Invalid pga specified: %d, using 6144mV" % pga
+      pga = 6144
+
+    # Disable comparator (unless ALERT/RDY is used as conversion ready),
+    # Non-latching, Alert/Rdy active low, traditional comparator,
+    # 'start single-conversion' bit set
+    config = self.__cque                            | \
+             self.__ADS1015_REG_CONFIG_CLAT_NONLAT  | \
+             self.__ADS1015_REG_CONFIG_CPOL_ACTVLOW | \
+             self.__ADS1015_REG_CONFIG_CMODE_TRAD   | \
+             self.__ADS1015_REG_CONFIG_OS_SINGLE    | \
+             self.muxADS1x15[mux]                   | \
+             self.pgaADS1x15[pga]                   | \
+             rates[sps]
+    if continuous:
+      config |= self.__ADS1015_REG_CONFIG_MODE_CONTIN
+    else:
+      config |= self.__ADS1015_REG_CONFIG_MODE_SINGLE
+
+    entry = ([(config >> 8) & 0xFF, config & 0xFF], pga, sps)
+    self.__configCache[key] = entry
+    return entry
+
   def readADCSingleEnded(self, channel=0, pga=6144, sps=250):
     "Gets a single-ended ADC reading from the specified channel in mV. \
     The sample rate for this mode (single-shot) can be used to lower the noise \
@@ -160,72 +363,23 @@ class ADS1x15:
     The pga must be given in mV, see page 13 for the supported values."
     
     # With invalid channel return -1
-    if (channel > 3):
+    if (channel not in (0, 1, 2, 3)):
       if (self.debug):
         print "ADS1x15: Invalid channel specified: %d" % channel
       return -1
-    
-    # Disable comparator, Non-latching, Alert/Rdy active low
-    # traditional comparator, single-shot mode
-    config = self.__ADS1015_REG_CONFIG_CQUE_NONE    | \
-             self.__ADS1015_REG_CONFIG_CLAT_NONLAT  | \
-             self.__ADS1015_REG_CONFIG_CPOL_ACTVLOW | \
-             self.__ADS1015_REG_CONFIG_CMODE_TRAD   | \
-             self.__ADS1015_REG_CONFIG_MODE_SINGLE    
 
-    # Set sample per seconds, defaults to 250sps
-    # If sps is in the dictionary (defined in init) it returns the value of the constant
-    # othewise it returns the value for 250sps. This saves a lot of if/elif/else code!
-    if (self.ic == self.__IC_ADS1015):
-      config |= self.spsADS1015.setdefault(sps, self.__ADS1015_REG_CONFIG_DR_1600SPS)
-    else:
-      if ( (sps not in self.spsADS1115) & self.debug):	  
-	print "ADS1x15: Invalid pga specified: %d, using 6144mV" % sps     
-      config |= self.spsADS1115.setdefault(sps, self.__ADS1115_REG_CONFIG_DR_250SPS)
-
-    # Set PGA/voltage range, defaults to +-6.144V
-    if ( (pga not in self.pgaADS1x15) & self.debug):	  
-      print "ADS1x15: Invalid pga specified: %d, using 6144mV" % sps     
-    config |= self.pgaADS1x15.setdefault(pga, self.__ADS1015_REG_CONFIG_PGA_6_144V)
+    bytes, pga, sps = self.__config(channel, pga, sps)
     self.pga = pga
 
-    # Set the channel to be converted
-    if channel == 3:
-      config |= self.__ADS1015_REG_CONFIG_MUX_SINGLE_3
-    elif channel == 2:
-      config |= self.__ADS1015_REG_CONFIG_MUX_SINGLE_2
-    elif channel == 1:
-      config |= self.__ADS1015_REG_CONFIG_MUX_SINGLE_1
-    else:
-      config |= self.__ADS1015_REG_CONFIG_MUX_SINGLE_0
-
-    # Set 'start single-conversion' bit
-    config |= self.__ADS1015_REG_CONFIG_OS_SINGLE
-
     # Write config register to the ADC
-    bytes = [(config >> 8) & 0xFF, config & 0xFF]
-    self.i2c.writeList(self.__ADS1015_REG_POINTER_CONFIG, bytes)
+    self.__startConversion(bytes)
 
-    # Wait for the ADC conversion to complete
-    # The minimum delay depends on the sps: delay >= 1/sps
-    # We add 0.1ms to be sure
-    delay = 1.0/sps+0.0001
-    time.sleep(delay)
+    # Wait for the ADC conversion to complete, on the ALERT/RDY pin or the
+    # OS bit when enabled, otherwise sleeping 1/sps plus a 0.1ms margin
+    self.__waitForConversion(sps)
 
     # Read the conversion results
-    result = self.i2c.readList(self.__ADS1015_REG_POINTER_CONVERT, 2)
-    if (self.ic == self.__IC_ADS1015):
-    	# Shift right 4 bits for the 12-bit ADS1015 and convert to mV
-    	return ( ((result[0] << 8) | (result[1] & 0xFF)) >> 4 )*pga/2048.0
-    else:
-	# Return a mV value for the ADS1115
-	# (Take signed values into account as well)
-	val = (result[0] << 8) | (result[1])
-	if val > 0x7FFF:
-	  return (val - 0xFFFF)*pga/32768.0
-	else:
-	  return ( (result[0] << 8) | (result[1]) )*pga/32768.0
-	
+    return self.getLastConversionRaw()*self.getScale(pga)
 
   def readADCDifferential(self, chP=0, chN=1, pga=6144, sps=250):
     "Gets a differential ADC reading from channels chP and chN in mV. \
@@ -234,75 +388,123 @@ class ADS1x15:
     see data sheet page 14 for more info. \
     The pga must be given in mV, see page 13 for the supported values."
     
-    # Disable comparator, Non-latching, Alert/Rdy active low
-    # traditional comparator, single-shot mode    
-    config = self.__ADS1015_REG_CONFIG_CQUE_NONE    | \
-             self.__ADS1015_REG_CONFIG_CLAT_NONLAT  | \
-             self.__ADS1015_REG_CONFIG_CPOL_ACTVLOW | \
-             self.__ADS1015_REG_CONFIG_CMODE_TRAD   | \
-             self.__ADS1015_REG_CONFIG_MODE_SINGLE  
-    
-    # Set channels
-    if ( (chP == 0) & (chN == 1) ):
-      config |= self.__ADS1015_REG_CONFIG_MUX_DIFF_0_1
-    elif ( (chP == 0) & (chN == 3) ):
-      config |= self.__ADS1015_REG_CONFIG_MUX_DIFF_0_3
-    elif ( (chP == 2) & (chN == 3) ):
-      config |= self.__ADS1015_REG_CONFIG_MUX_DIFF_2_3
-    elif ( (chP == 1) & (chN == 3) ):
-      config |= self.__ADS1015_REG_CONFIG_MUX_DIFF_1_3  
-    else:
-      if (self.debug):
-	print "ADS1x15: Invalid channels specified: %d, %d" % (chP, chN)
-	return -1
-         
-    # Set sample per seconds, defaults to 250sps
-    # If sps is in the dictionary (defined in init()) it returns the value of the constant
-    # othewise it returns the value for 250sps. This saves a lot of if/elif/else code!
-    if (self.ic == self.__IC_ADS1015):
-      config |= self.spsADS1015.setdefault(sps, self.__ADS1015_REG_CONFIG_DR_1600SPS)
-    else:
-      if ( (sps not in self.spsADS1115) & self.debug):	  
-	print "ADS1x15: Invalid pga specified: %d, using 6144mV" % sps     
-      config |= self.spsADS1115.setdefault(sps, self.__ADS1115_REG_CONFIG_DR_250SPS)
-  
-    # Set PGA/voltage range, defaults to +-6.144V
-    if ( (pga not in self.pgaADS1x15) & self.debug):	  
-      print "ADS1x15: Invalid pga specified: %d, using 6144mV" % sps     
-    config |= self.pgaADS1x15.setdefault(pga, self.__ADS1015_REG_CONFIG_PGA_6_144V)
+    # Valid channels are 0-1, 0-3, 1-3 and 2-3, return -1 otherwise
+    entry = self.__config((chP, chN), pga, sps)
+    if entry is None:
+      return -1
+    bytes, pga, sps = entry
     self.pga = pga
 
-    # Set 'start single-conversion' bit
-    config |= self.__ADS1015_REG_CONFIG_OS_SINGLE
-
     # Write config register to the ADC
-    bytes = [(config >> 8) & 0xFF, config & 0xFF]
-    self.i2c.writeList(self.__ADS1015_REG_POINTER_CONFIG, bytes)
+    self.__startConversion(bytes)
 
-    # Wait for the ADC conversion to complete
-    # The minimum delay depends on the sps: delay >= 1/sps
-    # We add 0.1ms to be sure
-    delay = 1.0/sps+0.0001
-    time.sleep(delay)
+    # Wait for the ADC conversion to complete, on the ALERT/RDY pin or the
+    # OS bit when enabled, otherwise sleeping 1/sps plus a 0.1ms margin
+    self.__waitForConversion(sps)
 
     # Read the conversion results
-    result = self.i2c.readList(self.__ADS1015_REG_POINTER_CONVERT, 2)
-    if (self.ic == self.__IC_ADS1015):
-    	# Shift right 4 bits for the 12-bit ADS1015 and convert to mV
-	val = ((result[0] << 8) | (result[1] & 0xFF)) >> 4
-	# (Take signed values into account as well)
-	if val >> 11:
-		val = val - 0xfff
-    	return val*pga/2048.0
-    else:
-	# Return a mV value for the ADS1115
-	# (Take signed values into account as well)
-	val = (result[0] << 8) | (result[1])
-	if val > 0x7FFF:
-	  return (val - 0xFFFF)*pga/32768.0
-	else:
-	  return ( (result[0] << 8) | (result[1]) )*pga/32768.0
+    return self.getLastConversionRaw()*self.getScale(pga)
+
+
+  def readADCAutoRanged(self, channel=0, sps=250):
+    "Gets a reading in mV choosing the pga by itself. channel is a channel \
+    number (single-ended) or a (chP, chN) tuple (differential). The gain of \
+    each channel follows its recent readings (see autoRangeHistory); a \
+    saturated conversion is done again once on the +/-6.144V range. \
+    See autoRangeStats() for the chosen gains and the re-read counts."
+    if isinstance(channel, list):
+      channel = tuple(channel)
+    if channel not in self.muxADS1x15:
+      if (self.debug):
+        print "ADS1x15: Invalid channels specified: %s" % str(channel)
+      return -1
+    bytes, pga, sps = self.__config(channel, self.__autoState(channel)['pga'], sps)
+    self.__startConversion(bytes)
+    self.__waitForConversion(sps)
+    value, pga = self.__autoFinish(channel, self.getLastConversionRaw(), pga, sps)
+    return value
+
+  def autoRangeStats(self):
+    "Returns the auto-ranging state of each channel: the pga for the next \
+    conversion, the number of readings, of saturated readings converted \
+    again and of gain changes"
+    return dict((mux, {'pga': state['pga'], 'reads': state['reads'], \
+                       'rereads': state['rereads'], 'changes': state['changes']}) \
+                for mux, state in self.autoRange.items())
+
+  def __autoState(self, mux):
+    state = self.autoRange.get(mux)
+    if state is None:
+      state = {'pga': 6144, 'history': collections.deque(maxlen=self.autoRangeHistory),
+               'reads': 0, 'rereads': 0, 'changes': 0}
+      self.autoRange[mux] = state
+    return state
+
+  def __autoFinish(self, mux, code, pga, sps):
+    # Takes an auto-ranged conversion result, converting it again on the
+    # widest range if it saturated, and picks the pga of the next one.
+    # Returns (mV, pga of the result).
+    state = self.__autoState(mux)
+    state['reads'] += 1
+    limit = 2047 if (self.ic == self.__IC_ADS1015) else 32767
+    if ((code >= limit) or (code < -limit)) and (pga != 6144):
+      state['rereads'] += 1
+      bytes, pga, sps = self.__config(mux, 6144, sps)
+      self.__startConversion(bytes)
+      self.__waitForConversion(sps)
+      code = self.getLastConversionRaw()
+    value = code*self.getScale(pga)
+    self.pga = pga
+    state['history'].append(abs(value))
+    peak = max(state['history'])
+    chosen = 6144
+    for gain in sorted(self.pgaADS1x15):
+      if peak <= self.autoRangeHeadroom*gain:
+        chosen = gain
+        break
+    if chosen != state['pga']:
+      state['changes'] += 1
+      state['pga'] = chosen
+    return value, pga
+
+  def readADCSingleEndedAsync(self, channel=0, pga=6144, sps=250):
+    "Non-blocking readADCSingleEnded(): returns an I2CFuture with the value \
+    in mV. The conversion wait doesn't hold the bus executor, so reads on \
+    other ADCs of the bus proceed meanwhile. Reads of this ADC are queued."
+    if (channel not in (0, 1, 2, 3)):
+      return self.i2c.submit(lambda: -1)
+    return self.i2c.i2cbus.executor().submit(self.__readJob(channel, pga, sps), self.i2c.address)
 
+  def readADCDifferentialAsync(self, chP=0, chN=1, pga=6144, sps=250):
+    "Non-blocking readADCDifferential(), see readADCSingleEndedAsync()"
+    if ((chP, chN) not in self.muxADS1x15):
+      return self.i2c.submit(lambda: -1)
+    return self.i2c.i2cbus.executor().submit(self.__readJob((chP, chN), pga, sps), self.i2c.address)
+
+  def __readJob(self, mux, pga, sps):
+    # Generator run by the bus executor: yields the seconds to wait for the
+    # conversion and finally the result
+    entry = self.__config(mux, pga, sps)
+    if entry is None:
+      yield I2CReturn(-1)
+      return
+    bytes, pga, sps = entry
+    self.pga = pga
+    self.__startConversion(bytes)
+    period = 1.0/sps
+    fastest, slowest = self.__conversionTimes(sps)
+    if self.rdyPoll:
+      # Poll the OS bit once the fastest possible conversion is over
+      yield max(fastest - (monotonic() - self.__conversionStart), 0)
+      deadline = monotonic() + 2*period + 0.01
+      while not (self.i2c.readList(self.__ADS1015_REG_POINTER_CONFIG, 2)[0] & 0x80):
+        if monotonic() > deadline:
+          break
+        yield 0.0001
+    else:
+      yield max(slowest - (monotonic() - self.__conversionStart), 0)
+    self.lastLatency = monotonic() - self.__conversionStart
+    yield I2CReturn(self.getLastConversionRaw()*self.getScale(pga))
 
   def readADCDifferential01(self, pga=6144, sps=250):
     "Gets a differential ADC reading from channels 0 and 1 in mV\
@@ -328,7 +530,7 @@ class ADS1x15:
     (low sps) or to lower the power consumption (high sps) by duty cycling, \
     see data sheet page 14 for more info. \
     The pga must be given in mV, see page 13 for the supported values."
-    return self.__readADCDifferential(1, 3, pga, sps)  
+    return self.readADCDifferential(1, 3, pga, sps)  
 
 
   def readADCDifferential23(self, pga=6144, sps=250):
@@ -349,75 +551,11 @@ class ADS1x15:
     stopContinuousConversion() to stop converting."
     
     # Default to channel 0 with invalid channel, or return -1?
-    if (channel > 3):
+    if (channel not in (0, 1, 2, 3)):
       if (self.debug):
-	print "ADS1x15: Invalid channel specified: %d" % channel
+        print "ADS1x15: Invalid channel specified: %d" % channel
       return -1
-    
-    # Disable comparator, Non-latching, Alert/Rdy active low
-    # traditional comparator, continuous mode
-    # The last flag is the only change we need, page 11 datasheet
-    config = self.__ADS1015_REG_CONFIG_CQUE_NONE    | \
-             self.__ADS1015_REG_CONFIG_CLAT_NONLAT  | \
-             self.__ADS1015_REG_CONFIG_CPOL_ACTVLOW | \
-             self.__ADS1015_REG_CONFIG_CMODE_TRAD   | \
-             self.__ADS1015_REG_CONFIG_MODE_CONTIN    
-
-    # Set sample per seconds, defaults to 250sps
-    # If sps is in the dictionary (defined in init()) it returns the value of the constant
-    # othewise it returns the value for 250sps. This saves a lot of if/elif/else code!
-    if (self.ic == self.__IC_ADS1015):
-      config |= self.spsADS1015.setdefault(sps, self.__ADS1015_REG_CONFIG_DR_1600SPS)
-    else:
-      if ( (sps not in self.spsADS1115) & self.debug):	  
-	print "ADS1x15: Invalid pga specified: %d, using 6144mV" % sps     
-      config |= self.spsADS1115.setdefault(sps, self.__ADS1115_REG_CONFIG_DR_250SPS)
-  
-    # Set PGA/voltage range, defaults to +-6.144V
-    if ( (pga not in self.pgaADS1x15) & self.debug):	  
-      print "ADS1x15: Invalid pga specified: %d, using 6144mV" % sps     
-    config |= self.pgaADS1x15.setdefault(pga, self.__ADS1015_REG_CONFIG_PGA_6_144V)
-    self.pga = pga 
-    
-    # Set the channel to be converted
-    if channel == 3:
-      config |= self.__ADS1015_REG_CONFIG_MUX_SINGLE_3
-    elif channel == 2:
-      config |= self.__ADS1015_REG_CONFIG_MUX_SINGLE_2
-    elif channel == 1:
-      config |= self.__ADS1015_REG_CONFIG_MUX_SINGLE_1
-    else:
-      config |= self.__ADS1015_REG_CONFIG_MUX_SINGLE_0    
-  
-    # Set 'start single-conversion' bit to begin conversions
-    # No need to change this for continuous mode!
-    config |= self.__ADS1015_REG_CONFIG_OS_SINGLE
-
-    # Write config register to the ADC
-    # Once we write the ADC will convert continously
-    # we can read the next values using getLastConversionResult
-    bytes = [(config >> 8) & 0xFF, config & 0xFF]
-    self.i2c.writeList(self.__ADS1015_REG_POINTER_CONFIG, bytes)
-
-    # Wait for the ADC conversion to complete
-    # The minimum delay depends on the sps: delay >= 1/sps
-    # We add 0.5ms to be sure
-    delay = 1.0/sps+0.0005
-    time.sleep(delay)
-  
-    # Read the conversion results
-    result = self.i2c.readList(self.__ADS1015_REG_POINTER_CONVERT, 2)
-    if (self.ic == self.__IC_ADS1015):
-    	# Shift right 4 bits for the 12-bit ADS1015 and convert to mV
-    	return ( ((result[0] << 8) | (result[1] & 0xFF)) >> 4 )*pga/2048.0
-    else:
-	# Return a mV value for the ADS1115
-	# (Take signed values into account as well)
-	val = (result[0] << 8) | (result[1])
-	if val > 0x7FFF:
-	  return (val - 0xFFFF)*pga/32768.0
-	else:
-	  return ( (result[0] << 8) | (result[1]) )*pga/32768.0  
+    return self.__startContinuous(channel, pga, sps)
 
   def startContinuousDifferentialConversion(self, chP=0, chN=1, pga=6144, sps=250): 
     "Starts the continuous differential conversion mode and returns the first ADC reading \
@@ -426,77 +564,26 @@ class ADS1x15:
     The pga must be given in mV, see datasheet page 13 for the supported values. \
     Use getLastConversionResults() to read the next values and \
     stopContinuousConversion() to stop converting."
-    
-    # Disable comparator, Non-latching, Alert/Rdy active low
-    # traditional comparator, continuous mode
-    # The last flag is the only change we need, page 11 datasheet
-    config = self.__ADS1015_REG_CONFIG_CQUE_NONE    | \
-             self.__ADS1015_REG_CONFIG_CLAT_NONLAT  | \
-             self.__ADS1015_REG_CONFIG_CPOL_ACTVLOW | \
-             self.__ADS1015_REG_CONFIG_CMODE_TRAD   | \
-             self.__ADS1015_REG_CONFIG_MODE_CONTIN    
-  
-    # Set sample per seconds, defaults to 250sps
-    # If sps is in the dictionary (defined in init()) it returns the value of the constant
-    # othewise it returns the value for 250sps. This saves a lot of if/elif/else code!
-    if (self.ic == self.__IC_ADS1015):
-      config |= self.spsADS1015.setdefault(sps, self.__ADS1015_REG_CONFIG_DR_1600SPS)
-    else:
-      if ( (sps not in self.spsADS1115) & self.debug):	  
-	print "ADS1x15: Invalid pga specified: %d, using 6144mV" % sps     
-      config |= self.spsADS1115.setdefault(sps, self.__ADS1115_REG_CONFIG_DR_250SPS)
-  
-    # Set PGA/voltage range, defaults to +-6.144V
-    if ( (pga not in self.pgaADS1x15) & self.debug):	  
-      print "ADS1x15: Invalid pga specified: %d, using 6144mV" % sps     
-    config |= self.pgaADS1x15.setdefault(pga, self.__ADS1015_REG_CONFIG_PGA_6_144V)
-    self.pga = pga 
-    
-    # Set channels
-    if ( (chP == 0) & (chN == 1) ):
-      config |= self.__ADS1015_REG_CONFIG_MUX_DIFF_0_1
-    elif ( (chP == 0) & (chN == 3) ):
-      config |= self.__ADS1015_REG_CONFIG_MUX_DIFF_0_3
-    elif ( (chP == 2) & (chN == 3) ):
-      config |= self.__ADS1015_REG_CONFIG_MUX_DIFF_2_3
-    elif ( (chP == 1) & (chN == 3) ):
-      config |= self.__ADS1015_REG_CONFIG_MUX_DIFF_1_3  
-    else:
-      if (self.debug):
-	print "ADS1x15: Invalid channels specified: %d, %d" % (chP, chN)
-	return -1  
-    
-    # Set 'start single-conversion' bit to begin conversions
-    # No need to change this for continuous mode!
-    config |= self.__ADS1015_REG_CONFIG_OS_SINGLE
-  
+    return self.__startContinuous((chP, chN), pga, sps)
+
+  def __startContinuous(self, mux, pga, sps):
+    entry = self.__config(mux, pga, sps, continuous=True)
+    if entry is None:
+      return -1
+    bytes, pga, sps = entry
+    self.pga = pga
+
     # Write config register to the ADC
     # Once we write the ADC will convert continously
     # we can read the next values using getLastConversionResult
-    bytes = [(config >> 8) & 0xFF, config & 0xFF]
-    self.i2c.writeList(self.__ADS1015_REG_POINTER_CONFIG, bytes)
-  
-    # Wait for the ADC conversion to complete
-    # The minimum delay depends on the sps: delay >= 1/sps
-    # We add 0.5ms to be sure
-    delay = 1.0/sps+0.0005
-    time.sleep(delay)
-  
+    # If it is already converting with this config nothing is written
+    if self.__startConversion(bytes, cached=True):
+      # Wait for the first conversion to complete
+      self.__waitForConversion(sps, 0.0005, continuous=True)
+
     # Read the conversion results
-    result = self.i2c.readList(self.__ADS1015_REG_POINTER_CONVERT, 2)
-    if (self.ic == self.__IC_ADS1015):
-	# Shift right 4 bits for the 12-bit ADS1015 and convert to mV
-	return ( ((result[0] << 8) | (result[1] & 0xFF)) >> 4 )*pga/2048.0
-    else:
-	# Return a mV value for the ADS1115
-	# (Take signed values into account as well)
-	val = (result[0] << 8) | (result[1])
-	if val > 0x7FFF:
-	  return (val - 0xFFFF)*pga/32768.0
-	else:
-	  return ( (result[0] << 8) | (result[1]) )*pga/32768.0  
-
-	  
+    return self.getLastConversionRaw()*self.getScale(pga)
+
   def stopContinuousConversion(self):
     "Stops the ADC's conversions when in continuous mode \
     and resets the configuration to its default value."
@@ -511,20 +598,189 @@ class ADS1x15:
   def getLastConversionResults(self):
     "Returns the last ADC conversion result in mV"
     # Read the conversion results
-    result = self.i2c.readList(self.__ADS1015_REG_POINTER_CONVERT, 2)
+    return self.getLastConversionRaw()*self.getScale()
+
+
+  def getLastConversionRaw(self):
+    "Returns the last ADC conversion result as a signed integer code, \
+    12-bit for the ADS1015 and 16-bit for the ADS1115. \
+    Multiply by getScale() to get the value in mV."
+    # Repeated reads skip the pointer write, see Adafruit_I2C.readListCached()
+    result = self.i2c.readListCached(self.__ADS1015_REG_POINTER_CONVERT, 2)
+    return self.__toCode(result)
+
+  def __toCode(self, result):
+    val = (result[0] << 8) | (result[1] & 0xFF)
+    if val > 0x7FFF:
+      val -= 0x10000
     if (self.ic == self.__IC_ADS1015):
-    	# Shift right 4 bits for the 12-bit ADS1015 and convert to mV
-    	return ( ((result[0] << 8) | (result[1] & 0xFF)) >> 4 )*self.pga/2048.0
-    else:
-	# Return a mV value for the ADS1115
-	# (Take signed values into account as well)
-	val = (result[0] << 8) | (result[1])
-	if val > 0x7FFF:
-	  return (val - 0xFFFF)*self.pga/32768.0
-	else:
-	  return ( (result[0] << 8) | (result[1]) )*self.pga/32768.0  
-	
-	
+      # Arithmetic shift keeps the sign of the 12-bit result
+      val >>= 4
+    return val
+
+  def getScale(self, pga=None):
+    "Returns the mV value of one code step for the given pga \
+    (defaults to the last pga used)."
+    if pga is None:
+      pga = self.pga
+    if (self.ic == self.__IC_ADS1015):
+      return pga/2048.0
+    return pga/32768.0
+
+  def startStream(self, channel=0, pga=6144, sps=None, size=8192):
+    "Starts the continuous conversion mode on the specified channel and returns \
+    an ADS1x15Stream which samples the conversion register from a background \
+    thread into a preallocated ring buffer of 'size' samples. \
+    sps defaults to the fastest rate of the IC (3300 for the ADS1015, 860 for \
+    the ADS1115). Call stop() on the returned stream to end the acquisition, \
+    the ADC must not be used for anything else while the stream runs."
+    if (channel not in (0, 1, 2, 3)):
+      if (self.debug):
+        print "ADS1x15: Invalid channel specified: %d" % channel
+      return -1
+    if sps is None:
+      sps = 3300 if (self.ic == self.__IC_ADS1015) else 860
+    # Invalid pga/sps values are replaced by the defaults before starting,
+    # the stream must time and scale the samples with the ones used
+    entry = self.__config(channel, pga, sps, continuous=True)
+    if entry is None:
+      return -1
+    bytes, pga, sps = entry
+    self.startContinuousConversion(channel, pga, sps)
+    stream = ADS1x15Stream(self, sps, self.getScale(pga), size)
+    stream.start()
+    return stream
+
+  def readADCOversampled(self, channel=0, pga=6144, ratio=16, count=1, order=1, \
+                         sps=None, timeout=None):
+    "Gets 'count' low noise single-ended readings by running the continuous \
+    mode at 'sps' (the fastest rate by default) and decimating 'ratio' samples \
+    into each value with an ADS1x15Decimator of the given order (1 is a plain \
+    average, higher orders a CIC-like filter with better aliasing rejection). \
+    Returns a (values in mV, effective bits) tuple of NumPy arrays. White \
+    noise goes down by sqrt(ratio), so about half a bit is gained each time \
+    the ratio doubles, as long as there is at least an LSB of noise."
+    decimator = ADS1x15Decimator(ratio, order, 12 if (self.ic == self.__IC_ADS1015) else 16)
+    needed = (count - 1)*ratio + len(decimator.taps)
+    stream = self.startStream(channel, pga, sps, size=needed)
+    if stream == -1:
+      return -1
+    try:
+      timestamps, codes = stream.readRaw(needed, timeout)
+    finally:
+      stream.stop()
+    values, bits = decimator.process(codes)
+    return values*stream.scale, bits
+
+  def compileScan(self, steps, pga=6144, sps=250):
+    "Precompiles a scan program and returns it as an ADS1x15Scan. \
+    Each step is a channel number (single-ended), a (chP, chN) tuple \
+    (differential: 0-1, 0-3, 1-3 or 2-3) or a dict with either a 'channel' \
+    or 'chP'/'chN' keys and optional 'pga'/'sps' values overriding the defaults. \
+    A pga of 'auto' auto-ranges the step like readADCAutoRanged(). \
+    Use runScan() or the run() method of the result to execute it."
+    muxes = []
+    pgas = []
+    rates = []
+    configs = []
+    auto = []
+    for step in steps:
+      stepPga = pga
+      stepSps = sps
+      if isinstance(step, dict):
+        stepPga = step.get('pga', pga)
+        stepSps = step.get('sps', sps)
+        if 'channel' in step:
+          step = step['channel']
+        else:
+          step = (step.get('chP'), step.get('chN'))
+      if isinstance(step, list):
+        step = tuple(step)
+      # Auto-ranged steps are compiled for the widest range, their config
+      # is picked when they start
+      auto.append(stepPga == 'auto')
+      entry = self.__config(step, 6144 if auto[-1] else stepPga, stepSps)
+      if entry is None:
+        return -1
+      bytes, stepPga, stepSps = entry
+      muxes.append(step)
+      configs.append(bytes)
+      pgas.append(stepPga)
+      rates.append(stepSps)
+    scales = np.array([self.getScale(p) for p in pgas])
+    return ADS1x15Scan(self, muxes, configs, pgas, rates, scales, self.__cque, auto)
+
+  def runScan(self, scan, count=1):
+    "Runs a program made by compileScan() 'count' times and returns a NumPy \
+    array with one row of mV values per scan, the start time of each scan \
+    is stored in scan.timestamps. The next conversion is started right \
+    after the previous one ends and, with I2C_RDWR (rdwr=True) and when it \
+    takes longer than reading the conversion register, before the previous \
+    result is read, in the same combined transfer."
+    steps = len(scan)
+    self.__checkScan(scan)
+    # Separate transactions leave gaps of any length between the restart and
+    # the read, only a combined transfer keeps the read inside the conversion
+    overlap = scan.overlap if self.i2c.rdwr else [False]*steps
+    # Auto-ranged results are stored in codes of the compiled range
+    codes = np.zeros((count, steps), dtype=np.float64 if any(scan.auto) else np.int32)
+    scan.timestamps = np.zeros(count)
+    self.__startConversion(self.__stepConfig(scan, 0))
+    for row in range(count):
+      scan.timestamps[row] = self.__conversionStart
+      for step in range(steps):
+        self.__waitForConversion(scan.sps[step])
+        following = (step + 1) % steps
+        last = (row == count - 1) and (step == steps - 1)
+        if not last and overlap[following] and not scan.auto[step]:
+          # The conversion register keeps this result until the next
+          # conversion ends, so read it while the next one runs
+          codes[row, step] = self.__restartAndRead(self.__stepConfig(scan, following))
+        else:
+          codes[row, step] = self.__stepResult(scan, step)
+          if not last:
+            self.__startConversion(self.__stepConfig(scan, following))
+    self.pga = scan.used[-1]
+    return codes*scan.scales
+
+  def __stepConfig(self, scan, step):
+    # Config bytes of a scan step, an auto-ranged one gets the current pga
+    # of its channel, which is remembered in scan.used
+    if not scan.auto[step]:
+      return scan.configs[step]
+    bytes, scan.used[step], sps = self.__config(scan.muxes[step], \
+      self.__autoState(scan.muxes[step])['pga'], scan.sps[step])
+    return bytes
+
+  def __stepResult(self, scan, step):
+    # Reads the result of a scan step, in codes of its compiled range
+    code = self.getLastConversionRaw()
+    if not scan.auto[step]:
+      return code
+    value, scan.used[step] = self.__autoFinish(scan.muxes[step], code, scan.used[step], scan.sps[step])
+    return value/scan.scales[step]
+
+  def __checkScan(self, scan):
+    if scan.cque != self.__cque:
+      # Conversion ready was switched since the program was compiled
+      scan.configs = [self.__config(mux, pga, sps)[0] for mux, pga, sps in \
+                      zip(scan.muxes, scan.pga, scan.sps)]
+      scan.cque = self.__cque
+
+  def startScanStep(self, scan, step):
+    "Starts the conversion of one step of a compiled scan without waiting, \
+    use finishScanStep() to get its result. See ADS1x15Group."
+    if step == 0:
+      self.__checkScan(scan)
+    self.__startConversion(self.__stepConfig(scan, step))
+
+  def finishScanStep(self, scan, step):
+    "Waits for the conversion started by startScanStep() and returns its code, \
+    a fractional one in units of the compiled range for auto-ranged steps"
+    self.__waitForConversion(scan.sps[step])
+    self.pga = scan.used[step]
+    return self.__stepResult(scan, step)
+
   def startSingleEndedComparator(self, channel, thresholdHigh, thresholdLow, \
                                  pga=6144, sps=250, \
                                  activeLow=True, traditionalMode=True, latching=False, \
@@ -542,7 +798,7 @@ class ADS1x15:
     the sample rate and the pga the gain, see datasheet page 13. "
     
     # With invalid channel return -1
-    if (channel > 3):
+    if (channel not in (0, 1, 2, 3)):
       if (self.debug):
 	print "ADS1x15: Invalid channel specified: %d" % channel
       return -1
@@ -578,16 +834,16 @@ class ADS1x15:
     if (self.ic == self.__IC_ADS1015):
       if ( (sps not in self.spsADS1015) & self.debug):	  
 	print "ADS1x15: Invalid sps specified: %d, using 1600sps" % sps       
-      config |= self.spsADS1015.setdefault(sps, self.__ADS1015_REG_CONFIG_DR_1600SPS)
+      config |= self.spsADS1015.get(sps, self.__ADS1015_REG_CONFIG_DR_1600SPS)
     else:
       if ( (sps not in self.spsADS1115) & self.debug):	  
 	print "ADS1x15: Invalid sps specified: %d, using 250sps" % sps     
-      config |= self.spsADS1115.setdefault(sps, self.__ADS1115_REG_CONFIG_DR_250SPS)
+      config |= self.spsADS1115.get(sps, self.__ADS1115_REG_CONFIG_DR_250SPS)
 
     # Set PGA/voltage range, defaults to +-6.144V
     if ( (pga not in self.pgaADS1x15) & self.debug):	  
       print "ADS1x15: Invalid pga specified: %d, using 6144mV" % pga     
-    config |= self.pgaADS1x15.setdefault(pga, self.__ADS1015_REG_CONFIG_PGA_6_144V)
+    config |= self.pgaADS1x15.get(pga, self.__ADS1015_REG_CONFIG_PGA_6_144V)
     self.pga = pga
     
     # Set the channel to be converted
@@ -604,20 +860,24 @@ class ADS1x15:
     config |= self.__ADS1015_REG_CONFIG_OS_SINGLE
     
     # Write threshold high and low registers to the ADC
+    # This overrides the conversion ready thresholds
     # V_digital = (2^(n-1)-1)/pga*V_analog
+    self.disableConversionReady()
     if (self.ic == self.__IC_ADS1015):
-      thresholdHighWORD = int(thresholdHigh*(2048.0/pga))
+      # 12-bit value, left justified like the conversion register
+      thresholdHighWORD = int(thresholdHigh*(2048.0/pga)) << 4
     else:
       thresholdHighWORD = int(thresholdHigh*(32767.0/pga))
     bytes = [(thresholdHighWORD >> 8) & 0xFF, thresholdHighWORD & 0xFF]
-    self.i2c.writeList(self.__ADS1015_REG_POINTER_HITHRESH, bytes) 
+    self.i2c.writeListCached(self.__ADS1015_REG_POINTER_HITHRESH, bytes) 
   
     if (self.ic == self.__IC_ADS1015):
-      thresholdLowWORD = int(thresholdLow*(2048.0/pga))
+      # 12-bit value, left justified like the conversion register
+      thresholdLowWORD = int(thresholdLow*(2048.0/pga)) << 4
     else:
       thresholdLowWORD = int(thresholdLow*(32767.0/pga))    
     bytes = [(thresholdLowWORD >> 8) & 0xFF, thresholdLowWORD & 0xFF]
-    self.i2c.writeList(self.__ADS1015_REG_POINTER_LOWTHRESH, bytes)     
+    self.i2c.writeListCached(self.__ADS1015_REG_POINTER_LOWTHRESH, bytes)     
 
     # Write config register to the ADC
     # Once we write the ADC will convert continously and alert when things happen,
@@ -673,16 +933,16 @@ class ADS1x15:
     if (self.ic == self.__IC_ADS1015):
       if ( (sps not in self.spsADS1015) & self.debug):	  
 	print "ADS1x15: Invalid sps specified: %d, using 1600sps" % sps       
-      config |= self.spsADS1015.setdefault(sps, self.__ADS1015_REG_CONFIG_DR_1600SPS)
+      config |= self.spsADS1015.get(sps, self.__ADS1015_REG_CONFIG_DR_1600SPS)
     else:
       if ( (sps not in self.spsADS1115) & self.debug):	  
 	print "ADS1x15: Invalid sps specified: %d, using 250sps" % sps     
-      config |= self.spsADS1115.setdefault(sps, self.__ADS1115_REG_CONFIG_DR_250SPS)
+      config |= self.spsADS1115.get(sps, self.__ADS1115_REG_CONFIG_DR_250SPS)
 
     # Set PGA/voltage range, defaults to +-6.144V
     if ( (pga not in self.pgaADS1x15) & self.debug):	  
       print "ADS1x15: Invalid pga specified: %d, using 6144mV" % pga     
-    config |= self.pgaADS1x15.setdefault(pga, self.__ADS1015_REG_CONFIG_PGA_6_144V)
+    config |= self.pgaADS1x15.get(pga, self.__ADS1015_REG_CONFIG_PGA_6_144V)
     self.pga = pga
     
     # Set channels
@@ -703,24 +963,487 @@ class ADS1x15:
     config |= self.__ADS1015_REG_CONFIG_OS_SINGLE
     
     # Write threshold high and low registers to the ADC
+    # This overrides the conversion ready thresholds
     # V_digital = (2^(n-1)-1)/pga*V_analog
+    self.disableConversionReady()
     if (self.ic == self.__IC_ADS1015):
-      thresholdHighWORD = int(thresholdHigh*(2048.0/pga))
+      # 12-bit value, left justified like the conversion register
+      thresholdHighWORD = int(thresholdHigh*(2048.0/pga)) << 4
     else:
       thresholdHighWORD = int(thresholdHigh*(32767.0/pga))
     bytes = [(thresholdHighWORD >> 8) & 0xFF, thresholdHighWORD & 0xFF]
-    self.i2c.writeList(self.__ADS1015_REG_POINTER_HITHRESH, bytes) 
+    self.i2c.writeListCached(self.__ADS1015_REG_POINTER_HITHRESH, bytes) 
   
     if (self.ic == self.__IC_ADS1015):
-      thresholdLowWORD = int(thresholdLow*(2048.0/pga))
+      # 12-bit value, left justified like the conversion register
+      thresholdLowWORD = int(thresholdLow*(2048.0/pga)) << 4
     else:
       thresholdLowWORD = int(thresholdLow*(32767.0/pga))    
     bytes = [(thresholdLowWORD >> 8) & 0xFF, thresholdLowWORD & 0xFF]
-    self.i2c.writeList(self.__ADS1015_REG_POINTER_LOWTHRESH, bytes)     
+    self.i2c.writeListCached(self.__ADS1015_REG_POINTER_LOWTHRESH, bytes)     
 
     # Write config register to the ADC
     # Once we write the ADC will convert continously and alert when things happen,
     # we can read the converted values using getLastConversionResult
     bytes = [(config >> 8) & 0xFF, config & 0xFF]
-    self.i2c.writeList(self.__ADS1015_REG_POINTER_CONFIG, bytes)    
+    self.i2c.writeList(self.__ADS1015_REG_POINTER_CONFIG, bytes)
+
+  def watch(self, channels, thresholdLow, thresholdHigh, callback, pin=None, \
+            pga=6144, sps=250, window=True, numReadings=1, dwell=1.0):
+    "Watches the channels with the hardware comparator and returns the running \
+    ADS1x15Watch. channels is a list of channel numbers, (chP, chN) tuples or \
+    dicts with 'channel' or 'chP'/'chN' keys and optional 'low'/'high' values \
+    overriding the thresholds (in mV). In window mode a channel is active while \
+    outside [thresholdLow, thresholdHigh], otherwise (traditional mode) it \
+    becomes active above thresholdHigh and inactive below thresholdLow. \
+    callback(channel, value, active, timestamp) is called from the watch thread \
+    each time a channel changes state, value being the mV that were read. \
+    pin is the BCM GPIO wired to ALERT/RDY: the thread sleeps until it changes, \
+    so nothing moves on the bus while the values stay in range. Several channels \
+    are watched in turn for 'dwell' seconds each. Without a pin the conversion \
+    register is read once per conversion and compared in software. The \
+    conversion ready mode (enableConversionReady()) is suspended while watching, \
+    pin can be its ALERT/RDY pin."
+    entries = []
+    for entry in channels:
+      low = thresholdLow
+      high = thresholdHigh
+      if isinstance(entry, dict):
+        low = entry.get('low', low)
+        high = entry.get('high', high)
+        if 'channel' in entry:
+          entry = entry['channel']
+        else:
+          entry = (entry.get('chP'), entry.get('chN'))
+      if isinstance(entry, list):
+        entry = tuple(entry)
+      if entry not in self.muxADS1x15:
+        if (self.debug):
+          print "ADS1x15: Invalid channel specified: %s" % (entry,)
+        return -1
+      entries.append((entry, low, high))
+    watcher = ADS1x15Watch(self, entries, callback, pin, pga, sps, window, \
+                           numReadings, dwell)
+    watcher.start()
+    return watcher
+
+
+# ===========================================================================
+# ADS1x15Stream Class
+#
+# Background sampler for the continuous conversion mode. Samples are stored
+# as int16 codes together with their timestamps in preallocated NumPy ring
+# buffers, so the acquisition thread never allocates while running.
+# ===========================================================================
+
+class ADS1x15Stream(threading.Thread):
+
+  def __init__(self, adc, sps, scale, size=8192):
+    threading.Thread.__init__(self)
+    self.daemon = True
+    self.adc = adc
+    self.sps = sps
+    # mV per code step
+    self.scale = scale
+    self.size = size
+    self.samples = np.zeros(size, dtype=np.int16)
+    self.timestamps = np.zeros(size, dtype=np.float64)
+    # Total number of samples written and read since the stream started
+    self.written = 0
+    self.consumed = 0
+    # Samples lost because the consumer fell more than 'size' samples behind
+    self.overruns = 0
+    # Periods where the sampler woke up too late and skipped conversions
+    self.late = 0
+    # Samples lost to I2C errors
+    self.errors = 0
+    self.__cond = threading.Condition()
+    self.__stopEvent = threading.Event()
+
+  def run(self):
+    period = 1.0/self.sps
+    nextTime = monotonic()
+    while not self.__stopEvent.is_set():
+      if self.adc.rdyPin is not None:
+        # ALERT/RDY pulses once per conversion, follow the ADC's own clock
+        if not self.adc.waitForConversionReady(2*period + 0.01):
+          self.late += 1
+          continue
+      else:
+        # Pace on an absolute schedule so sleep jitter doesn't accumulate
+        nextTime += period
+        delay = nextTime - monotonic()
+        if delay > 0:
+          time.sleep(delay)
+        elif delay < -period:
+          self.late += 1
+          nextTime = monotonic()
+      try:
+        code = self.adc.getLastConversionRaw()
+      except IOError, err:
+        # The bus failed even after the retries: lose this sample only
+        self.errors += 1
+        continue
+      now = monotonic()
+      with self.__cond:
+        index = self.written % self.size
+        self.samples[index] = code
+        self.timestamps[index] = now
+        self.written += 1
+        self.__cond.notify_all()
+    with self.__cond:
+      self.__cond.notify_all()
+
+  def stop(self):
+    "Stops the sampler thread and the continuous conversion mode of the ADC"
+    self.__stopEvent.set()
+    if self.is_alive():
+      self.join()
+    self.adc.stopContinuousConversion()
+
+  def available(self):
+    "Returns the number of samples that can be read without blocking"
+    with self.__cond:
+      return min(self.written - self.consumed, self.size)
+
+  def readRaw(self, count, timeout=None):
+    "Returns a (timestamps, codes) tuple of NumPy arrays with the next 'count' \
+    samples, blocking until they are available. Fewer samples are returned \
+    if the timeout (in seconds) expires or the stream is stopped."
+    if count > self.size:
+      count = self.size
+    deadline = None if timeout is None else monotonic() + timeout
+    with self.__cond:
+      while (self.written - self.consumed < count) and not self.__stopEvent.is_set():
+        if deadline is None:
+          self.__cond.wait(0.1)
+        else:
+          remaining = deadline - monotonic()
+          if remaining <= 0:
+            break
+          self.__cond.wait(remaining)
+      # Skip what the sampler has already overwritten
+      if self.written - self.consumed > self.size:
+        self.overruns += self.written - self.consumed - self.size
+        self.consumed = self.written - self.size
+      count = min(count, self.written - self.consumed)
+      indexes = np.arange(self.consumed, self.consumed + count) % self.size
+      self.consumed += count
+      return self.timestamps[indexes], self.samples[indexes]
+
+  def read(self, count, timeout=None):
+    "Same as readRaw() but returns the values in mV"
+    timestamps, codes = self.readRaw(count, timeout)
+    return timestamps, codes*self.scale
+
+  def chunks(self, count):
+    "Iterates over (timestamps, mV values) chunks of 'count' samples \
+    until the stream is stopped."
+    while True:
+      timestamps, values = self.read(count)
+      if len(values) == 0:
+        return
+      yield timestamps, values
+
+  def __iter__(self):
+    return self.chunks(256)
+
+
+# ===========================================================================
+# ADS1x15Decimator Class
+#
+# Oversampling filter: averages blocks of 'ratio' codes into one value, with
+# 'order' cascaded averages (a CIC filter) when order > 1. It keeps the tail
+# of the input, so it can be fed chunk by chunk from an ADS1x15Stream.
+# ===========================================================================
+
+class ADS1x15Decimator(object):
+
+  def __init__(self, ratio, order=1, bits=16):
+    "bits is the resolution of the codes (12 for the ADS1015, 16 for the ADS1115)"
+    self.ratio = ratio
+    self.order = order
+    self.bits = bits
+    taps = np.ones(ratio)
+    for i in range(order - 1):
+      taps = np.convolve(taps, np.ones(ratio))
+    self.taps = taps/taps.sum()
+    # RMS of the output for white noise of RMS 1 on the input
+    self.noiseGain = np.sqrt(np.sum(self.taps**2))
+    self.__history = np.zeros(0)
+
+  def reset(self):
+    self.__history = np.zeros(0)
+
+  def process(self, codes):
+    "Returns (values, effective bits) NumPy arrays for the complete output \
+    samples available. The values are in codes (fractional). The effective \
+    bits come from the noise of the last 'ratio' input codes of each output, \
+    input without an LSB of noise doesn't gain resolution from averaging."
+    x = np.concatenate((self.__history, np.asarray(codes, dtype=np.float64)))
+    length = len(self.taps)
+    if len(x) < length:
+      self.__history = x
+      return np.zeros(0), np.zeros(0)
+    count = (len(x) - length)//self.ratio + 1
+    values = np.convolve(x, self.taps, 'valid')[::self.ratio][:count]
+    blocks = x[length - self.ratio:length - self.ratio + count*self.ratio]
+    noise = blocks.reshape(count, self.ratio).std(axis=1, ddof=1) if self.ratio > 1 \
+            else np.zeros(count)
+    # Quantization noise of one code is 1/sqrt(12)
+    quantization = 1.0/np.sqrt(12.0)
+    sigma = np.where(noise >= 0.5, noise*self.noiseGain, quantization)
+    bits = np.log2(2**self.bits/(np.sqrt(12.0)*sigma))
+    self.__history = x[count*self.ratio:]
+    return values, bits
+
+
+# ===========================================================================
+# ADS1x15Scan Class
+#
+# Precompiled scan program, see ADS1x15.compileScan()
+# ===========================================================================
+
+class ADS1x15Scan(object):
+
+  # After the config write, the rest of the combined transfer (pointer write
+  # and 2 byte read) takes about 0.45ms on a 100kHz bus. The next conversion
+  # is only overlapped with it when even the fastest one lasts longer than
+  # this, which leaves room for the bus and the driver latency.
+  overlapTime = 0.0015
+
+  def __init__(self, adc, muxes, configs, pga, sps, scales, cque, auto=None):
+    self.adc = adc
+    self.muxes = muxes
+    # Auto-ranged steps and the pga each step was last started with
+    self.auto = auto or [False]*len(muxes)
+    self.used = list(pga)
+    # Config register bytes of each step and the comparator queue bits
+    # they were compiled with
+    self.configs = configs
+    self.cque = cque
+    self.pga = pga
+    self.sps = sps
+    # mV per code step of each scan step
+    self.scales = scales
+    # Fastest possible conversion time is 0.9/sps (oscillator +/-10%)
+    self.overlap = [0.9/rate > self.overlapTime for rate in sps]
+    self.timestamps = None
+
+  def __len__(self):
+    return len(self.configs)
+
+  def run(self, count=1):
+    "Runs the scan 'count' times, see ADS1x15.runScan()"
+    return self.adc.runScan(self, count)
+
+
+# ===========================================================================
+# ADS1x15Group Class
+#
+# Interleaved acquisition on several ADS1x15 sharing one I2C bus (addresses
+# 0x48-0x4B). The conversions of all the chips run at the same time, the bus
+# is only used to start them and to collect the results.
+# ===========================================================================
+
+class ADS1x15Group(object):
+
+  def __init__(self, devices, pga=6144, sps=250):
+    "devices is a list of (adc, steps) pairs, steps being a scan program in \
+    the format of ADS1x15.compileScan(), with pga and sps as defaults."
+    self.members = []
+    self.labels = []
+    scales = []
+    for adc, steps in devices:
+      scan = adc.compileScan(steps, pga, sps)
+      if scan == -1:
+        raise ValueError("ADS1x15Group: Invalid scan for device 0x%02X" % adc.address)
+      self.members.append((adc, scan))
+      self.labels.extend([(adc.address, mux) for mux in scan.muxes])
+      scales.extend(scan.scales)
+    self.scales = np.array(scales)
+    self.steps = max([len(scan) for adc, scan in self.members])
+    # Offset of the first value of each device in a frame
+    self.offsets = np.cumsum([0] + [len(scan) for adc, scan in self.members])[:-1]
+    self.__codes = np.zeros(len(self.labels), dtype=np.float64)
+
+  def __len__(self):
+    return len(self.labels)
+
+  def sweep(self):
+    "Reads every step of every device once and returns a (timestamp, frame) \
+    tuple, frame being a NumPy array of mV values ordered as self.labels."
+    timestamp = monotonic()
+    for adc, scan in self.members:
+      adc.startScanStep(scan, 0)
+    for step in range(self.steps):
+      for (adc, scan), offset in zip(self.members, self.offsets):
+        if step >= len(scan):
+          continue
+        self.__codes[offset + step] = adc.finishScanStep(scan, step)
+        # Restart this chip right away, the others are still converting
+        if step + 1 < len(scan):
+          adc.startScanStep(scan, step + 1)
+    return timestamp, self.__codes*self.scales
+
+  def run(self, count):
+    "Runs 'count' sweeps and returns (timestamps, frames) NumPy arrays, \
+    with one frame per row."
+    timestamps = np.zeros(count)
+    frames = np.zeros((count, len(self.labels)))
+    for row in range(count):
+      timestamps[row], frames[row] = self.sweep()
+    return timestamps, frames
+
+
+# ===========================================================================
+# ADS1x15Watch Class
+#
+# Threshold monitoring with the comparator, see ADS1x15.watch(). The ADC
+# converts continuously and compares on its own, the thread only wakes up
+# when the ALERT/RDY pin changes (or to move the mux to the next channel).
+# ===========================================================================
+
+class ADS1x15Watch(threading.Thread):
+
+  def __init__(self, adc, entries, callback, pin, pga, sps, window, numReadings, dwell):
+    threading.Thread.__init__(self)
+    self.daemon = True
+    self.adc = adc
+    # (mux, low, high) of each channel and whether it is active
+    self.entries = entries
+    self.active = dict((mux, False) for mux, low, high in entries)
+    self.callback = callback
+    self.pin = pin
+    self.pga = pga
+    self.sps = sps
+    self.window = window
+    self.numReadings = numReadings
+    self.dwell = dwell
+    # Thread wakeups, state changes reported, mux switches, failed reads or
+    # callbacks and seconds from the last pin edge to its callback
+    self.wakeups = 0
+    self.events = 0
+    self.switches = 0
+    self.errors = 0
+    self.lastLatency = None
+    self.__edge = threading.Event()
+    self.__edgeTime = None
+    self.__stopEvent = threading.Event()
+    # ALERT/RDY pin of the conversion ready mode of the ADC, given back when
+    # the watch stops
+    self.__rdyPin = None
+    self.__rdyPoll = False
+
+  def __onEdge(self, channel):
+    self.__edgeTime = monotonic()
+    self.__edge.set()
+
+  def __program(self, mux, low, high):
+    # Continuous conversions with the comparator on this channel,
+    # the thresholds are only rewritten when they change
+    if isinstance(mux, tuple):
+      self.adc.startDifferentialComparator(mux[0], mux[1], high, low, self.pga, self.sps, \
+        traditionalMode=not self.window, numReadings=self.numReadings)
+    else:
+      self.adc.startSingleEndedComparator(mux, high, low, self.pga, self.sps, \
+        traditionalMode=not self.window, numReadings=self.numReadings)
+    self.switches += 1
+
+  def __check(self, mux, low, high):
+    # Reports the channel if its state changed, the pin (active low) gives
+    # the state, or the value itself when there is no pin
+    if self.pin is not None:
+      import RPi.GPIO as GPIO
+      active = GPIO.input(self.pin) == 0
+      if active == self.active[mux]:
+        return
+      value = self.adc.getLastConversionResults()
+    else:
+      value = self.adc.getLastConversionResults()
+      if self.window:
+        active = (value > high) or (value < low)
+      elif value > high:
+        active = True
+      elif value < low:
+        active = False
+      else:
+        active = self.active[mux]
+      if active == self.active[mux]:
+        return
+    timestamp = monotonic()
+    if self.__edgeTime is not None:
+      self.lastLatency = timestamp - self.__edgeTime
+      self.__edgeTime = None
+    self.active[mux] = active
+    self.events += 1
+    try:
+      self.callback(mux, value, active, timestamp)
+    except Exception:
+      # A failing callback must not end the watch
+      self.errors += 1
+      print "ADS1x15Watch: callback failed for %s" % str(mux)
+      traceback.print_exc()
+
+  def run(self):
+    period = 1.0/self.sps
+    # The comparator takes over the ALERT/RDY pin and its threshold registers:
+    # release the conversion ready mode now, before the pin is watched, so its
+    # teardown in the comparator functions doesn't remove the edge detection
+    # of the watch when both use the same GPIO
+    self.__rdyPin = self.adc.rdyPin
+    self.__rdyPoll = self.adc.rdyPoll
+    self.adc.disableConversionReady()
+    if self.pin is not None:
+      import RPi.GPIO as GPIO
+      GPIO.setmode(GPIO.BCM)
+      GPIO.setup(self.pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+      GPIO.add_event_detect(self.pin, GPIO.BOTH, callback=self.__onEdge)
+    rotate = len(self.entries) > 1
+    first = True
+    while not self.__stopEvent.is_set():
+      for mux, low, high in self.entries:
+        if self.__stopEvent.is_set():
+          break
+        try:
+          if rotate or first:
+            self.__program(mux, low, high)
+            first = False
+            # The comparator needs numReadings conversions on the new channel
+            self.__stopEvent.wait((self.numReadings + 1)*period)
+            self.__edge.clear()
+            self.__check(mux, low, high)
+          deadline = monotonic() + self.dwell
+          while not self.__stopEvent.is_set():
+            remaining = deadline - monotonic()
+            if rotate and remaining <= 0:
+              break
+            if self.pin is not None:
+              # Sleep until the pin changes (stop() sets the event too)
+              if not self.__edge.wait(remaining if rotate else None):
+                continue
+              self.__edge.clear()
+              if self.__stopEvent.is_set():
+                break
+            else:
+              self.__stopEvent.wait(min(period, max(remaining, 0)) if rotate else period)
+            self.wakeups += 1
+            self.__check(mux, low, high)
+        except IOError, err:
+          # The bus failed even after the retries, try again later
+          self.errors += 1
+          first = True
+          self.__stopEvent.wait(period)
+    if self.pin is not None:
+      import RPi.GPIO as GPIO
+      GPIO.remove_event_detect(self.pin)
 
+  def stop(self):
+    "Stops the watch thread and the continuous conversion mode of the ADC"
+    self.__stopEvent.set()
+    self.__edge.set()
+    if self.is_alive():
+      self.join()
+    self.adc.stopContinuousConversion()
+    if self.__rdyPoll:
+      self.adc.enableConversionReady(self.__rdyPin)
@@ -1,6 +1,269 @@
 #!/usr/bin/python
+import os
 import re
-import smbus
+import time
+import fcntl
+import ctypes
+import heapq
+import itertools
+import warnings
+import traceback
+import threading
+import collections
+from Monotonic_Clock import monotonic
+try:
+  import smbus
+except ImportError:
+  # Only needed for the real buses, see Adafruit_I2C.attachBus
+  smbus = None
+
+# Structures of the Linux I2C_RDWR ioctl, see linux/i2c.h and linux/i2c-dev.h
+class i2c_msg(ctypes.Structure):
+  _fields_ = [('addr', ctypes.c_uint16),
+              ('flags', ctypes.c_uint16),
+              ('len', ctypes.c_uint16),
+              ('buf', ctypes.POINTER(ctypes.c_uint8))]
+
+class i2c_rdwr_ioctl_data(ctypes.Structure):
+  _fields_ = [('msgs', ctypes.POINTER(i2c_msg)),
+              ('nmsgs', ctypes.c_uint32)]
+
+# ===========================================================================
+# I2CError Class
+#
+# Raised when a transaction still fails after the retries. It is an IOError,
+# so code catching IOError keeps working.
+# ===========================================================================
+
+class I2CError(IOError):
+
+  def __init__(self, address, busnum, attempts, cause):
+    IOError.__init__(self, getattr(cause, 'errno', None),
+                     "Error accessing 0x%02X on I2C bus %d after %d attempts: %s" %
+                     (address, busnum, attempts, cause))
+    self.address = address
+    self.busnum = busnum
+    self.attempts = attempts
+    self.cause = cause
+
+# ===========================================================================
+# I2CFuture and I2CExecutor Classes
+#
+# Non-blocking bus access. Python 2 has no asyncio, so requests are queued
+# on the executor thread of their bus and return an I2CFuture. A job is
+# either a callable or a generator that yields the number of seconds it
+# wants to wait (e.g. for an ADC conversion) and finally yields an
+# I2CReturn with its result. Waiting jobs are parked on a timer heap rather
+# than sleeping, so a single thread keeps many conversions in flight.
+# ===========================================================================
+
+class I2CReturn(object):
+
+  def __init__(self, value):
+    self.value = value
+
+class I2CFuture(object):
+
+  def __init__(self):
+    self.__event = threading.Event()
+    self.__lock = threading.Lock()
+    self.__callbacks = []
+    self.__value = None
+    self.__error = None
+
+  def done(self):
+    "Returns True once the job has finished"
+    return self.__event.is_set()
+
+  def result(self, timeout=None):
+    "Waits for the job and returns its result, or raises its exception. \
+    Returns None if the timeout (in seconds) expires."
+    self.__event.wait(timeout)
+    if self.__error is not None:
+      raise self.__error
+    return self.__value
+
+  def exception(self, timeout=None):
+    "Waits for the job and returns the exception it raised, if any"
+    self.__event.wait(timeout)
+    return self.__error
+
+  def addDoneCallback(self, callback):
+    "Calls callback(future) when the job finishes, right away if it has. \
+    Callbacks run on the executor thread and must not block."
+    with self.__lock:
+      if not self.__event.is_set():
+        self.__callbacks.append(callback)
+        return
+    callback(self)
+
+  def setResult(self, value, error=None):
+    with self.__lock:
+      self.__value = value
+      self.__error = error
+      self.__event.set()
+      callbacks, self.__callbacks = self.__callbacks, []
+    for callback in callbacks:
+      # A failing callback must not take down the executor thread, the
+      # jobs queued after this one would never finish
+      try:
+        callback(self)
+      except Exception:
+        print "I2C: Done callback %r raised:" % callback
+        traceback.print_exc()
+
+class I2CExecutor(threading.Thread):
+
+  def __init__(self, name):
+    threading.Thread.__init__(self, name=name)
+    self.daemon = True
+    self.__cond = threading.Condition()
+    # Heap of (due time, sequence, job) and the jobs waiting for their key
+    self.__heap = []
+    self.__sequence = itertools.count()
+    self.__waiting = {}
+
+  def submit(self, job, key=None, *args):
+    "Queues a job (callable or generator, see above) and returns its \
+    I2CFuture. Jobs with the same key, e.g. the address of a device, run one \
+    after the other. Extra args are passed to a callable job."
+    if not hasattr(job, 'next'):
+      job = self.__callJob(job, args)
+    entry = [job, I2CFuture(), key]
+    with self.__cond:
+      if key is not None:
+        if key in self.__waiting:
+          self.__waiting[key].append(entry)
+          return entry[1]
+        self.__waiting[key] = collections.deque()
+      self.__schedule(0, entry)
+    return entry[1]
+
+  def __callJob(self, function, args):
+    yield I2CReturn(function(*args))
+
+  def __schedule(self, delay, entry):
+    # Called with the condition held
+    heapq.heappush(self.__heap, (monotonic() + delay, next(self.__sequence), entry))
+    self.__cond.notify()
+
+  def __finish(self, entry, value, error=None):
+    job, future, key = entry
+    with self.__cond:
+      if key is not None:
+        queue = self.__waiting[key]
+        if queue:
+          self.__schedule(0, queue.popleft())
+        else:
+          del self.__waiting[key]
+    future.setResult(value, error)
+
+  def run(self):
+    while True:
+      with self.__cond:
+        while True:
+          if self.__heap:
+            delay = self.__heap[0][0] - monotonic()
+            if delay <= 0:
+              break
+            self.__cond.wait(delay)
+          else:
+            self.__cond.wait()
+        due, sequence, entry = heapq.heappop(self.__heap)
+      try:
+        step = entry[0].next()
+      except StopIteration:
+        self.__finish(entry, None)
+        continue
+      except Exception, err:
+        self.__finish(entry, None, err)
+        continue
+      if isinstance(step, I2CReturn):
+        entry[0].close()
+        self.__finish(entry, step.value)
+      else:
+        with self.__cond:
+          self.__schedule(step, entry)
+
+# ===========================================================================
+# I2CBus Class
+#
+# One SMBus handle and one lock per bus number, shared by all the
+# Adafruit_I2C instances of the process (see Adafruit_I2C.getBus()).
+# Each transaction holds the lock, so drivers in different threads can
+# share the bus. The lock is reentrant: hold it with "with bus:" to keep
+# a sequence of transactions together.
+# ===========================================================================
+
+class I2CBus(object):
+
+  def __init__(self, busnum, factory=None):
+    self.busnum = busnum
+    # Opens the handle from the bus number, smbus.SMBus unless another
+    # backend (like a simulator) is attached
+    self.factory = factory or I2CBus.openSMBus
+    self.handle = self.factory(busnum)
+    self.__lock = threading.RLock()
+    # Lock statistics: acquisitions, how many had to wait and for how long
+    self.acquisitions = 0
+    self.contended = 0
+    self.waitTime = 0.0
+    self.maxWait = 0.0
+    # Times the handle was reopened after repeated errors
+    self.reopens = 0
+    self.__executor = None
+
+  @staticmethod
+  def openSMBus(busnum):
+    if smbus is None:
+      raise IOError("python-smbus is not installed, can't open I2C bus %d" % busnum)
+    return smbus.SMBus(busnum)
+
+  def reopen(self):
+    "Closes and reopens the SMBus handle, e.g. after a bus glitch"
+    with self.__lock:
+      try:
+        self.handle.close()
+      except (IOError, OSError, AttributeError), err:
+        pass
+      self.handle = self.factory(self.busnum)
+      self.reopens += 1
+
+  def executor(self):
+    "Returns the I2CExecutor of the bus, starting it on first use"
+    with self.__lock:
+      if self.__executor is None:
+        self.__executor = I2CExecutor('i2c-%d' % self.busnum)
+        self.__executor.start()
+      return self.__executor
+
+  def acquire(self):
+    if not self.__lock.acquire(False):
+      start = monotonic()
+      self.__lock.acquire()
+      wait = monotonic() - start
+      self.contended += 1
+      self.waitTime += wait
+      if wait > self.maxWait:
+        self.maxWait = wait
+    self.acquisitions += 1
+
+  def release(self):
+    self.__lock.release()
+
+  def __enter__(self):
+    self.acquire()
+    return self
+
+  def __exit__(self, type, value, traceback):
+    self.release()
+
+  def stats(self):
+    "Returns the lock statistics of the bus as a dictionary"
+    return {'acquisitions': self.acquisitions,
+            'contended': self.contended,
+            'waitTime': self.waitTime,
+            'maxWait': self.maxWait}
 
 # ===========================================================================
 # Adafruit_I2C Class
@@ -8,9 +271,42 @@ import smbus
 
 class Adafruit_I2C(object):
 
+  # Process wide registry of the open buses, by bus number
+  __buses = {}
+  __busesLock = threading.Lock()
+  # Board revision, /proc/cpuinfo is only parsed once
+  __piRevision = None
+
+  @staticmethod
+  def getBus(busnum):
+    "Returns the shared I2CBus for the bus number, opening it on first use"
+    with Adafruit_I2C.__busesLock:
+      bus = Adafruit_I2C.__buses.get(busnum)
+      if bus is None:
+        bus = I2CBus(busnum)
+        Adafruit_I2C.__buses[busnum] = bus
+      return bus
+
+  @staticmethod
+  def attachBus(busnum, handle):
+    "Makes the devices created afterwards on the bus number use handle \
+    instead of smbus.SMBus. The handle needs the SMBus methods; if it also \
+    has i2c_transfer(address, messages) it serves the plain reads and the \
+    I2C_RDWR transfers too (see ADS1x15_Simulator). Returns the I2CBus."
+    with Adafruit_I2C.__busesLock:
+      bus = I2CBus(busnum, lambda busnum: handle)
+      Adafruit_I2C.__buses[busnum] = bus
+      return bus
+
   @staticmethod
   def getPiRevision():
     "Gets the version number of the Raspberry Pi board"
+    if Adafruit_I2C.__piRevision is None:
+      Adafruit_I2C.__piRevision = Adafruit_I2C.__readPiRevision()
+    return Adafruit_I2C.__piRevision
+
+  @staticmethod
+  def __readPiRevision():
     # Revision list available at: http://elinux.org/RPi_HardwareHistory#Board_Revision_History
     try:
       with open('/proc/cpuinfo', 'r') as infile:
@@ -34,14 +330,216 @@ class Adafruit_I2C(object):
     # Gets the I2C bus number /dev/i2c#
     return 1 if Adafruit_I2C.getPiRevision() > 1 else 0
 
-  def __init__(self, address, busnum=-1, debug=False):
+  # i2c-dev ioctls and flags
+  I2C_SLAVE    = 0x0703  # Select the slave address of the file descriptor
+  I2C_FUNCS    = 0x0705  # Get the adapter functionality mask
+  I2C_RDWR     = 0x0707  # Combined read/write transfer, one STOP at the end
+  I2C_FUNC_I2C = 0x0001  # Adapter supports plain I2C messages
+  I2C_M_RD     = 0x0001  # Read message
+
+  def __init__(self, address, busnum=-1, debug=False, rdwr=False,
+               retries=2, backoff=0.001, reopenAfter=3):
     self.address = address
     # By default, the correct I2C bus is auto-detected using /proc/cpuinfo
     # Alternatively, you can hard-code the bus version below:
     # self.bus = smbus.SMBus(0); # Force I2C0 (early 256MB Pi's)
     # self.bus = smbus.SMBus(1); # Force I2C1 (512MB Pi's)
-    self.bus = smbus.SMBus(busnum if busnum >= 0 else Adafruit_I2C.getPiI2CBusNumber())
+    self.busnum = busnum if busnum >= 0 else Adafruit_I2C.getPiI2CBusNumber()
+    # The SMBus handle and its lock are shared with the other devices on the bus
+    self.i2cbus = Adafruit_I2C.getBus(self.busnum)
     self.debug = debug
+    # Register shadow: last bytes written to each register and the register
+    # the device pointer is known to address (None when unknown)
+    self.registers = {}
+    self.pointer = None
+    # Number of I2C messages on the bus (a register read is a pointer write
+    # plus a read) and number of messages the register shadow avoided
+    self.transactions = 0
+    self.skipped = 0
+    # A failed transaction is retried 'retries' times, waiting 'backoff'
+    # seconds doubled on each attempt, and the bus is reopened after
+    # 'reopenAfter' consecutive errors. I2CError is raised if all fail.
+    self.retries = retries
+    self.backoff = backoff
+    self.reopenAfter = reopenAfter
+    # Error accounting: failed attempts, retries, transactions given up
+    self.errors = 0
+    self.retried = 0
+    self.failures = 0
+    self.consecutiveErrors = 0
+    # /dev/i2c-N file descriptor for plain reads and I2C_RDWR transfers,
+    # and whether the slave address could be bound to it for plain reads
+    self.__fd = None
+    self.__slaveBound = None
+    # With rdwr=True the register accesses use I2C_RDWR combined transfers
+    # (repeated start, one syscall) if the adapter supports them
+    self.rdwr = rdwr and self.__openRdwr()
+
+  @property
+  def bus(self):
+    # The handle changes when the bus is reopened
+    return self.i2cbus.handle
+
+  def __openDevice(self):
+    if self.__fd is None:
+      self.__fd = os.open('/dev/i2c-%d' % self.busnum, os.O_RDWR)
+    return self.__fd
+
+  def __closeDevice(self):
+    if self.__fd is not None:
+      try:
+        os.close(self.__fd)
+      except OSError, err:
+        pass
+    self.__fd = None
+    self.__slaveBound = None
+
+  def __emulated(self):
+    # Attached handles that do the raw transfers themselves
+    return hasattr(self.i2cbus.handle, 'i2c_transfer')
+
+  def __openRdwr(self):
+    if self.__emulated():
+      return True
+    try:
+      funcs = ctypes.c_ulong()
+      fcntl.ioctl(self.__openDevice(), Adafruit_I2C.I2C_FUNCS, funcs)
+      if funcs.value & Adafruit_I2C.I2C_FUNC_I2C:
+        return True
+    except (IOError, OSError), err:
+      pass
+    # The caller asked for combined transfers, e.g. to keep a register
+    # write and a read together, and gets separate transactions
+    warnings.warn("I2C: I2C_RDWR not supported on bus %d, using SMBus calls" % self.busnum)
+    return False
+
+  def __bindSlave(self):
+    if self.__emulated():
+      return True
+    if self.__slaveBound is None:
+      try:
+        fcntl.ioctl(self.__openDevice(), Adafruit_I2C.I2C_SLAVE, self.address)
+        self.__slaveBound = True
+      except (IOError, OSError), err:
+        # Not available (or the address is claimed by a kernel driver)
+        self.__slaveBound = False
+    return self.__slaveBound
+
+  def __retry(self, function, *args):
+    # Runs one transaction, retrying it with exponential backoff
+    delay = self.backoff
+    attempt = 0
+    while True:
+      try:
+        result = function(*args)
+        self.consecutiveErrors = 0
+        return result
+      except (IOError, OSError), err:
+        self.errors += 1
+        self.consecutiveErrors += 1
+        # The device state is unknown after an error
+        self.resetShadow()
+        if self.debug:
+          print "I2C: Error accessing 0x%02X (attempt %d): %s" % (self.address, attempt + 1, err)
+        if self.consecutiveErrors >= self.reopenAfter:
+          self.reopen()
+        if attempt >= self.retries:
+          self.failures += 1
+          raise I2CError(self.address, self.busnum, attempt + 1, err)
+        attempt += 1
+        self.retried += 1
+        time.sleep(delay)
+        delay *= 2
+
+  def __smbus(self, messages, name, *args):
+    # One SMBus call on the shared handle, 'messages' I2C messages long
+    def call():
+      with self.i2cbus:
+        result = getattr(self.i2cbus.handle, name)(self.address, *args)
+      self.transactions += messages
+      return result
+    return self.__retry(call)
+
+  def reopen(self):
+    "Reopens the bus handle and the device file descriptor, called \
+    automatically after 'reopenAfter' consecutive errors"
+    self.consecutiveErrors = 0
+    self.i2cbus.reopen()
+    self.__closeDevice()
+    if self.rdwr and not self.__emulated():
+      self.__openDevice()
+
+  def __rdwr(self, messages):
+    # Sends all the messages in one I2C_RDWR ioctl, a list of bytes is a
+    # write and an int the length of a read. Returns the read results.
+    count = len(messages)
+    msgs = (i2c_msg * count)()
+    buffers = []
+    for i, message in enumerate(messages):
+      if isinstance(message, (int, long)):
+        buf = (ctypes.c_uint8 * message)()
+        msgs[i].flags = Adafruit_I2C.I2C_M_RD
+        msgs[i].len = message
+      else:
+        buf = (ctypes.c_uint8 * len(message))(*message)
+        msgs[i].flags = 0
+        msgs[i].len = len(message)
+      msgs[i].addr = self.address
+      msgs[i].buf = ctypes.cast(buf, ctypes.POINTER(ctypes.c_uint8))
+      buffers.append(buf)
+    def call():
+      with self.i2cbus:
+        if self.__emulated():
+          reads = iter(self.i2cbus.handle.i2c_transfer(self.address, messages))
+          for buf, msg in zip(buffers, msgs):
+            if msg.flags & Adafruit_I2C.I2C_M_RD:
+              buf[:] = next(reads)
+        else:
+          fcntl.ioctl(self.__openDevice(), Adafruit_I2C.I2C_RDWR, i2c_rdwr_ioctl_data(msgs, count))
+      self.transactions += count
+    self.__retry(call)
+    # First byte of a write is the register pointer
+    for message in messages:
+      if not isinstance(message, (int, long)):
+        if len(message) > 0:
+          self.pointer = message[0]
+        if len(message) > 1:
+          self.registers[message[0]] = list(message[1:])
+    return [list(buf) for buf, msg in zip(buffers, msgs) if msg.flags & Adafruit_I2C.I2C_M_RD]
+
+  def transfer(self, messages):
+    "Submits a batch of messages to the device, in a single I2C_RDWR syscall \
+    with repeated starts when rdwr is enabled. Each message is either a list \
+    of bytes to write (the first one being the register) or the number of \
+    bytes to read. Returns the list of read results. Without I2C_RDWR the \
+    batch is emulated with the SMBus calls, where a one byte write followed \
+    by a read becomes a block read of that register."
+    if self.rdwr:
+      return self.__rdwr(messages)
+    results = []
+    # Register a read addresses: the last one written in the batch, or the
+    # one the device was left pointing to
+    pointer = self.pointer
+    i = 0
+    while i < len(messages):
+      message = messages[i]
+      if not isinstance(message, (int, long)) and len(message) > 0:
+        pointer = message[0]
+      if isinstance(message, (int, long)):
+        if pointer is None:
+          raise ValueError("I2C: read at the start of a batch to 0x%02X with an unknown register "
+                           "pointer, write the register first" % self.address)
+        results.append(self.readListCached(pointer, message))
+      elif (len(message) == 1) and (i + 1 < len(messages)) and \
+           isinstance(messages[i + 1], (int, long)):
+        results.append(self.readList(message[0], messages[i + 1]))
+        i += 1
+      elif len(message) == 1:
+        self.writeRaw8(message[0])
+      else:
+        self.writeList(message[0], message[1:])
+      i += 1
+    return results
 
   def reverseByteOrder(self, data):
     "Reverses the byte order of an int (16-bit) or long (32-bit) value"
@@ -53,105 +551,179 @@ class Adafruit_I2C(object):
       data >>= 8
     return val
 
-  def errMsg(self):
-    print "Error accessing 0x%02X: Check your I2C address" % self.address
-    return -1
+  def resetShadow(self):
+    "Forgets the register shadow, e.g. after the device was reset"
+    self.registers = {}
+    self.pointer = None
+
+  def errorStats(self):
+    "Returns the error counters of the device as a dictionary"
+    return {'transactions': self.transactions,
+            'errors': self.errors,
+            'retried': self.retried,
+            'failures': self.failures,
+            'reopens': self.i2cbus.reopens}
 
   def write8(self, reg, value):
     "Writes an 8-bit value to the specified register/address"
-    try:
-      self.bus.write_byte_data(self.address, reg, value)
-      if self.debug:
-        print "I2C: Wrote 0x%02X to register 0x%02X" % (value, reg)
-    except IOError, err:
-      return self.errMsg()
+    self.__smbus(1, 'write_byte_data', reg, value)
+    self.registers[reg] = [value]
+    self.pointer = reg
+    if self.debug:
+      print "I2C: Wrote 0x%02X to register 0x%02X" % (value, reg)
 
   def write16(self, reg, value):
     "Writes a 16-bit value to the specified register/address pair"
-    try:
-      self.bus.write_word_data(self.address, reg, value)
-      if self.debug:
-        print ("I2C: Wrote 0x%02X to register pair 0x%02X,0x%02X" %
-         (value, reg, reg+1))
-    except IOError, err:
-      return self.errMsg()
+    self.__smbus(1, 'write_word_data', reg, value)
+    self.registers[reg] = [value & 0xFF, (value >> 8) & 0xFF]
+    self.pointer = reg
+    if self.debug:
+      print ("I2C: Wrote 0x%02X to register pair 0x%02X,0x%02X" %
+       (value, reg, reg+1))
 
   def writeRaw8(self, value):
     "Writes an 8-bit value on the bus"
-    try:
-      self.bus.write_byte(self.address, value)
-      if self.debug:
-        print "I2C: Wrote 0x%02X" % value
-    except IOError, err:
-      return self.errMsg()
+    self.__smbus(1, 'write_byte', value)
+    self.pointer = value
+    if self.debug:
+      print "I2C: Wrote 0x%02X" % value
 
   def writeList(self, reg, list):
     "Writes an array of bytes using I2C format"
-    try:
-      if self.debug:
-        print "I2C: Writing list to register 0x%02X:" % reg
-        print list
-      self.bus.write_i2c_block_data(self.address, reg, list)
-    except IOError, err:
-      return self.errMsg()
+    if self.debug:
+      print "I2C: Writing list to register 0x%02X:" % reg
+      print list
+    if self.rdwr:
+      self.__rdwr([[reg] + list])
+    else:
+      self.__smbus(1, 'write_i2c_block_data', reg, list)
+      self.registers[reg] = list[:]
+      self.pointer = reg
+
+  def writeListCached(self, reg, list):
+    "Writes an array of bytes using I2C format unless the register shadow \
+    says the register already holds them. Returns True if it was written. \
+    Only use it for registers that don't change on their own."
+    if self.registers.get(reg) == list:
+      self.skipped += 1
+      return False
+    self.writeList(reg, list)
+    return True
 
   def readList(self, reg, length):
     "Read a list of bytes from the I2C device"
-    try:
-      results = self.bus.read_i2c_block_data(self.address, reg, length)
-      if self.debug:
-        print ("I2C: Device 0x%02X returned the following from reg 0x%02X" %
-         (self.address, reg))
-        print results
-      return results
-    except IOError, err:
-      return self.errMsg()
+    if self.rdwr:
+      results = self.__rdwr([[reg], length])[0]
+    else:
+      results = self.__smbus(2, 'read_i2c_block_data', reg, length)
+      self.pointer = reg
+    if self.debug:
+      print ("I2C: Device 0x%02X returned the following from reg 0x%02X" %
+       (self.address, reg))
+      print results
+    return results
+
+  def __readPlain(self, length):
+    # Plain read on a file descriptor bound to the slave address
+    with self.i2cbus:
+      if self.__emulated():
+        results = self.i2cbus.handle.i2c_transfer(self.address, [length])[0]
+      else:
+        results = list(bytearray(os.read(self.__openDevice(), length)))
+    self.transactions += 1
+    return results
+
+  def readListCached(self, reg, length):
+    "Read a list of bytes from the I2C device, skipping the pointer write \
+    when the device already points to reg. Only for devices whose pointer \
+    doesn't auto-increment on reads (like the ADS1x15)."
+    if (self.pointer != reg) or (reg is None):
+      return self.readList(reg, length)
+    if self.rdwr:
+      results = self.__rdwr([length])[0]
+    elif self.__bindSlave():
+      results = self.__retry(self.__readPlain, length)
+      if self.pointer is None:
+        # An error made the pointer unknown, the retry read the wrong register
+        return self.readList(reg, length)
+    else:
+      # No plain reads, always use the combined transaction
+      return self.readList(reg, length)
+    self.skipped += 1
+    if self.debug:
+      print ("I2C: Device 0x%02X returned the following from reg 0x%02X" %
+       (self.address, reg))
+      print results
+    return results
 
   def readU8(self, reg):
     "Read an unsigned byte from the I2C device"
-    try:
-      result = self.bus.read_byte_data(self.address, reg)
-      if self.debug:
-        print ("I2C: Device 0x%02X returned 0x%02X from reg 0x%02X" %
-         (self.address, result & 0xFF, reg))
-      return result
-    except IOError, err:
-      return self.errMsg()
+    result = self.__smbus(2, 'read_byte_data', reg)
+    self.pointer = reg
+    if self.debug:
+      print ("I2C: Device 0x%02X returned 0x%02X from reg 0x%02X" %
+       (self.address, result & 0xFF, reg))
+    return result
 
   def readS8(self, reg):
     "Reads a signed byte from the I2C device"
-    try:
-      result = self.bus.read_byte_data(self.address, reg)
-      if result > 127: result -= 256
-      if self.debug:
-        print ("I2C: Device 0x%02X returned 0x%02X from reg 0x%02X" %
-         (self.address, result & 0xFF, reg))
-      return result
-    except IOError, err:
-      return self.errMsg()
+    result = self.__smbus(2, 'read_byte_data', reg)
+    self.pointer = reg
+    if result > 127: result -= 256
+    if self.debug:
+      print ("I2C: Device 0x%02X returned 0x%02X from reg 0x%02X" %
+       (self.address, result & 0xFF, reg))
+    return result
 
   def readU16(self, reg, little_endian=True):
     "Reads an unsigned 16-bit value from the I2C device"
-    try:
-      result = self.bus.read_word_data(self.address,reg)
-      # Swap bytes if using big endian because read_word_data assumes little 
-      # endian on ARM (little endian) systems.
-      if not little_endian:
-        result = ((result << 8) & 0xFF00) + (result >> 8)
-      if (self.debug):
-        print "I2C: Device 0x%02X returned 0x%04X from reg 0x%02X" % (self.address, result & 0xFFFF, reg)
-      return result
-    except IOError, err:
-      return self.errMsg()
+    result = self.__smbus(2, 'read_word_data', reg)
+    self.pointer = reg
+    # Swap bytes if using big endian because read_word_data assumes little 
+    # endian on ARM (little endian) systems.
+    if not little_endian:
+      result = ((result << 8) & 0xFF00) + (result >> 8)
+    if (self.debug):
+      print "I2C: Device 0x%02X returned 0x%04X from reg 0x%02X" % (self.address, result & 0xFFFF, reg)
+    return result
 
   def readS16(self, reg, little_endian=True):
     "Reads a signed 16-bit value from the I2C device"
-    try:
-      result = self.readU16(reg,little_endian)
-      if result > 32767: result -= 65536
-      return result
-    except IOError, err:
-      return self.errMsg()
+    result = self.readU16(reg,little_endian)
+    if result > 32767: result -= 65536
+    return result
+
+  # Non-blocking versions of the accessors, they run on the bus executor
+  # and return an I2CFuture (see I2CExecutor)
+
+  def submit(self, function, *args):
+    "Runs function(*args) on the bus executor after the previous requests \
+    of this device and returns an I2CFuture with its result"
+    return self.i2cbus.executor().submit(function, self.address, *args)
+
+  def write8Async(self, reg, value):
+    return self.submit(self.write8, reg, value)
+
+  def write16Async(self, reg, value):
+    return self.submit(self.write16, reg, value)
+
+  def writeListAsync(self, reg, list):
+    return self.submit(self.writeList, reg, list)
+
+  def readListAsync(self, reg, length):
+    return self.submit(self.readList, reg, length)
+
+  def readU8Async(self, reg):
+    return self.submit(self.readU8, reg)
+
+  def readS8Async(self, reg):
+    return self.submit(self.readS8, reg)
+
+  def readU16Async(self, reg, little_endian=True):
+    return self.submit(self.readU16, reg, little_endian)
+
+  def readS16Async(self, reg, little_endian=True):
+    return self.submit(self.readS16, reg, little_endian)
 
 if __name__ == '__main__':
   try:
@@ -0,0 +1,246 @@
+#!/usr/bin/python
+# coding=utf-8
+import os
+import glob
+import time
+import threading
+from multiprocessing.pool import ThreadPool
+from Monotonic_Clock import monotonic
+
+# ===========================================================================
+# DS18B20Reader Class
+#
+# Reads all the 1-wire thermometers of the w1_therm kernel driver at once.
+# The devices are enumerated once and their w1_slave files stay open (a
+# sysfs attribute is read again from offset 0). A sweep writes "trigger" to
+# the therm_bulk_read attribute of every bus master, so all the probes
+# convert at the same time, then reads them from a thread pool, each one
+# retrying on its own when the CRC check fails. Without therm_bulk_read
+# (kernels before 5.10) the parallel reads convert concurrently instead.
+#
+# The resolution attribute sets 9 to 12 bits, the conversion time doubles
+# with each bit. By default it is chosen for each probe from its rate of
+# change over the last two reads: the finest resolution whose LSB is still
+# larger than the drift during its own conversion, so a probe moving quickly
+# is read at a low resolution and a stable one at 12 bits.
+# ===========================================================================
+
+class DS18B20Reader(object):
+
+    # Family codes of the w1_therm thermometers (DS18B20, DS18S20, DS1822,
+    # DS1825, DS28EA00)
+    families = ('28', '10', '22', '3b', '42')
+    # Longest conversion (12-bit) plus margin, in seconds
+    conversionTimeout = 1.5
+    # Power-on value of the scratchpad, read when a conversion didn't happen
+    resetValue = 85000
+    # Nominal conversion time of each resolution in seconds
+    conversionTimes = {9: 0.09375, 10: 0.1875, 11: 0.375, 12: 0.75}
+
+    def __init__(self, base='/sys/bus/w1/devices/', retries=2, threads=8, resolution=None):
+        "resolution fixes the bits of every probe, None chooses them dynamically"
+        self.base = base
+        self.resolution = resolution
+        self.retries = retries
+        self.threads = threads
+        # Sweeps, failed CRC checks, retried reads, devices given up and the
+        # duration of the last sweep in seconds
+        self.sweeps = 0
+        self.crcErrors = 0
+        self.retried = 0
+        self.failures = 0
+        self.lastSweepTime = None
+        self.__lock = threading.Lock()
+        self.__pool = None
+        self.__files = {}
+        # Resolution each probe was set to, last two temperatures and the
+        # monotonic() times they were read at, and duration of its last read
+        # (without the bulk conversion)
+        self.resolutions = {}
+        self.temperatures = {}
+        self.readAt = {}
+        self.readTimes = {}
+        self.devices = []
+        self.masters = {}
+        self.rescan()
+
+    def rescan(self):
+        "Enumerates the thermometers and their bus masters again"
+        self.close()
+        self.devices = sorted([os.path.basename(path) for family in self.families
+                               for path in glob.glob(os.path.join(self.base, family + '-*'))])
+        # Devices of each bus master (the device directory lives in it)
+        self.masters = {}
+        for device in self.devices:
+            master = os.path.dirname(os.path.realpath(os.path.join(self.base, device)))
+            self.masters.setdefault(master, []).append(device)
+        self.__pool = ThreadPool(max(1, min(self.threads, len(self.devices))))
+        return self.devices
+
+    def __readSlave(self, device):
+        # Contents of w1_slave, which converts unless a bulk read just did
+        fd = self.__files.get(device)
+        if fd is None:
+            fd = os.open(os.path.join(self.base, device, 'w1_slave'), os.O_RDONLY)
+            self.__files[device] = fd
+        os.lseek(fd, 0, os.SEEK_SET)
+        data = b''
+        while True:
+            chunk = os.read(fd, 256)
+            if not chunk:
+                break
+            data += chunk
+        return data.decode('ascii', 'replace').splitlines()
+
+    def __count(self, counter):
+        # The counters are updated from the pool threads
+        with self.__lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def setResolution(self, device, bits):
+        "Sets the resolution of a probe (9 to 12 bits) unless it already has it, \
+        returns False if the kernel doesn't support it"
+        if self.resolutions.get(device) == bits:
+            return True
+        try:
+            with open(os.path.join(self.base, device, 'resolution'), 'w') as f:
+                f.write('%d\n' % bits)
+        except (IOError, OSError):
+            return False
+        self.resolutions[device] = bits
+        return True
+
+    def chooseResolution(self, device, fast=False):
+        "Returns the bits for the next read of a probe: 9 for a fast sweep, \
+        otherwise the finest resolution whose LSB is larger than the change \
+        of the probe during the conversion, at its last rate of change"
+        if fast:
+            return 9
+        if self.resolution is not None:
+            return self.resolution
+        history = self.temperatures.get(device)
+        if history is None or history[0] is None or history[1] is None:
+            return 12
+        times = self.readAt[device]
+        elapsed = times[1] - times[0]
+        if elapsed <= 0:
+            return 12
+        rate = abs(history[1] - history[0])/elapsed
+        for bits in (12, 11, 10):
+            # 12 bits is 0.0625 C, each bit less doubles the step
+            if 0.0625*2**(12 - bits) >= rate*self.conversionTimes[bits]:
+                return bits
+        return 9
+
+    def read(self, device):
+        "Reads one thermometer, returns the temperature in degrees C or None \
+        if the CRC check still fails after the retries"
+        start = monotonic()
+        temperature = self.__read(device)
+        end = monotonic()
+        self.readTimes[device] = end - start
+        previous = self.temperatures.get(device, (None, None))[1]
+        self.temperatures[device] = (previous, temperature)
+        self.readAt[device] = (self.readAt.get(device, (None, None))[1], end)
+        return temperature
+
+    def __read(self, device):
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.__count('retried')
+            try:
+                lines = self.__readSlave(device)
+            except (IOError, OSError):
+                # Device gone from the bus or read error
+                lines = []
+            if len(lines) < 2 or not lines[0].strip().endswith('YES'):
+                self.__count('crcErrors')
+                continue
+            position = lines[1].find('t=')
+            if position == -1:
+                continue
+            value = int(lines[1][position + 2:])
+            if value == self.resetValue and attempt < self.retries:
+                continue
+            return value/1000.0
+        self.__count('failures')
+        return None
+
+    def __bulkPath(self, master):
+        return os.path.join(master, 'therm_bulk_read')
+
+    def trigger(self):
+        "Starts the conversion on every thermometer of the masters that support \
+        bulk reads, returns the masters triggered"
+        triggered = []
+        for master in self.masters:
+            path = self.__bulkPath(master)
+            if os.path.exists(path):
+                with open(path, 'w') as f:
+                    f.write('trigger\n')
+                triggered.append(master)
+        return triggered
+
+    def waitConversion(self, masters):
+        "Waits until the bulk conversions of the masters are done"
+        deadline = monotonic() + self.conversionTimeout
+        for master in masters:
+            while monotonic() < deadline:
+                with open(self.__bulkPath(master), 'r') as f:
+                    # -1 while converting, 1 when done and not yet read
+                    if f.read().strip() != '-1':
+                        break
+                time.sleep(0.01)
+
+    def sweep(self, fast=False):
+        "Reads every thermometer and returns a {device: degrees C} dictionary, \
+        None for the devices that failed. Takes about one conversion time of \
+        the highest resolution in use, fast=True reads all of them at 9 bits."
+        start = monotonic()
+        for device in self.devices:
+            self.setResolution(device, self.chooseResolution(device, fast))
+        self.waitConversion(self.trigger())
+        temperatures = dict(zip(self.devices, self.__pool.map(self.read, self.devices)))
+        self.sweeps += 1
+        self.lastSweepTime = monotonic() - start
+        return temperatures
+
+    def costs(self):
+        "Returns the cost of the last read of each probe: its resolution, the \
+        nominal conversion time and the time its own read took, in seconds"
+        return dict((device, {'resolution': self.resolutions.get(device),
+                              'conversion': self.conversionTimes.get(self.resolutions.get(device)),
+                              'read': self.readTimes.get(device)})
+                    for device in self.devices)
+
+    def stats(self):
+        return {'devices': len(self.devices),
+                'sweeps': self.sweeps,
+                'crcErrors': self.crcErrors,
+                'retried': self.retried,
+                'failures': self.failures,
+                'sweepTime': self.lastSweepTime}
+
+    def close(self):
+        for fd in self.__files.values():
+            os.close(fd)
+        self.__files = {}
+        if self.__pool is not None:
+            self.__pool.close()
+            self.__pool = None
+
+
+if __name__ == '__main__':
+    reader = DS18B20Reader()
+    print("%d thermometers: %s" % (len(reader.devices), ", ".join(reader.devices)))
+    try:
+        while True:
+            temperatures = reader.sweep()
+            costs = reader.costs()
+            for device in reader.devices:
+                print("%s: %s (%s bits, read in %.3f s)" % (device, temperatures[device],
+                      costs[device]['resolution'], costs[device]['read']))
+            print("Sweep took %.3f s" % reader.lastSweepTime)
+            time.sleep(1)
+    except KeyboardInterrupt:
+        reader.close()
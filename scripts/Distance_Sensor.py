@@ -1,51 +1,36 @@
 import RPi.GPIO as GPIO
 import time
-GPIO.setmode(GPIO.BCM)
+from Ultrasonic_Sensor import UltrasonicSensor
 
 GPIO_TRIGGER = 23
 GPIO_ECHO = 24
 
-#set GPIO direction (IN / OUT)
-GPIO.setup(GPIO_TRIGGER, GPIO.OUT)
-GPIO.setup(GPIO_ECHO, GPIO.IN)
+# The echo is timed from its edges (see Ultrasonic_Sensor), a missing echo
+# gives None after the round trip of the maximum range instead of hanging
+sensor = UltrasonicSensor(GPIO_TRIGGER, GPIO_ECHO)
 
 def distance():
-    # set Trigger to HIGH
-    GPIO.output(GPIO_TRIGGER, True)
-
-    # set Trigger after 0.01ms to LOW
-    time.sleep(0.00001)
-    GPIO.output(GPIO_TRIGGER, False)
-
-    StartTime = time.time()
-    StopTime = time.time()
-
-    # save StartTime
-    while GPIO.input(GPIO_ECHO) == 0:
-        StartTime = time.time()
-
-    # save time of arrival
-    while GPIO.input(GPIO_ECHO) == 1:
-        StopTime = time.time()
-
-    # time difference between start and arrival
-    TimeElapsed = StopTime - StartTime
-    # multiply with the sonic speed (34300 cm/s)
-    # and divide by 2, because there and back
-    distance = (TimeElapsed * 34300) / 2
-
-    return distance
+    # distance in cm (sonic speed 34300 cm/s, divided by 2 because there
+    # and back), None without a valid echo
+    return sensor.measure()
 
 if __name__ == '__main__':
     try:
         while True:
             dist = distance()
-            print ("Measured Distance = %.1f cm" % dist)
+            if dist is None:
+                print ("No echo in range")
+            else:
+                print ("Measured Distance = %.1f cm" % dist)
             time.sleep(1)
 
         # Reset by pressing CTRL + C
     except KeyboardInterrupt:
         print("Measurement stopped by User")
+        stats = sensor.stats()
+        if 'jitter' in stats:
+            print("Jitter = %.2f cm (%.0f us, %s timestamps)" % (stats['jitter'], stats['jitterUs'], stats['timestamps']))
+        sensor.close()
         GPIO.cleanup()
 
 #Test
@@ -4,6 +4,7 @@ import glob
 import time
 from time import sleep
 import RPi.GPIO as GPIO
+from DS18B20_Sensor import DS18B20Reader
 
 # here you can modify the break between the measurements
 sleeptime = 1
@@ -15,41 +16,20 @@ GPIO.setup(4, GPIO.IN, pull_up_down=GPIO.PUD_UP)
 # After the enabling of the pullup-resistor you have to wait till the communication with the DS18B20 sensor has started
 print 'wait for initialisation...'
 
-base_dir = '/sys/bus/w1/devices/'
-while True:
-    try:
-        device_folder = glob.glob(base_dir + '28*')[0]
-        break
-    except IndexError:
-        sleep(0.5)
-        continue
-device_file = device_folder + '/w1_slave'
+# All the thermometers on the bus are enumerated once and read together,
+# see DS18B20_Sensor
+reader = DS18B20Reader()
+while not reader.devices:
+    sleep(0.5)
+    reader.rescan()
 
+# To initialise, the sensors will be read "blind"
+reader.sweep()
 
-# The function to read currently measurement at the sensor will be defined.
-def TemperatureMeasure():
-    f = open(device_file, 'r')
-    lines = f.readlines()
-    f.close()
-    return lines
-
-# To initialise, the sensor will be read "blind"
-TemperatureMeasure()
-
-# Analysis of temperature: At the Raspberry Pi
-# noticed one-wire slaves at the directory /sys/bus/w1/devices/
-# will be assigned to a own subfolder.
-# In this folder is the file in which the data from the one-wire bus will be saved.<br /># In this function, the data will be analyzed, the temperature read and returned to the main program.<br />
+# The conversions of all the sensors are started at once, then each one is
+# read and, if its CRC check fails, read again on its own.
 def TemperatureAnalysis():
-    lines = TemperatureMeasure()
-    while lines[0].strip()[-3:] != 'YES':
-        time.sleep(0.2)
-        lines = TemperatureMeasure()
-    equals_pos = lines[1].find('t=')
-    if equals_pos != -1:
-        temp_string = lines[1][equals_pos+2:]
-        temp_c = float(temp_string) / 1000.0
-        return temp_c
+    return reader.sweep()
 
 # main program loop
 # The measured temperature will be displayed via console, between the measurements is a break.
@@ -57,8 +37,11 @@ def TemperatureAnalysis():
 try:
     while True:
         print '---------------------------------------'
-        print "Temperature:", TemperatureAnalysis(), "°C"
+        temperatures = TemperatureAnalysis()
+        for device in reader.devices:
+            print "Temperature", device + ":", temperatures[device], "°C"
         time.sleep(sleeptime)
 
 except KeyboardInterrupt:
+    reader.close()
     GPIO.cleanup()
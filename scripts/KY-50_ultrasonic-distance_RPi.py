@@ -2,6 +2,7 @@
 # Needed modules will be imported and configured
 import time
 import RPi.GPIO as GPIO
+from Ultrasonic_Sensor import UltrasonicSensor
 GPIO.setmode(GPIO.BCM)
  
 # You can pick the input and output pins here
@@ -11,40 +12,25 @@ Echo_EingangsPin    = 27
 # You can set the delay (in seconds) between the single measurements here
 sleeptime = 0.8
  
-# Here, the input and output pins will be configured
-GPIO.setup(Trigger_AusgangsPin, GPIO.OUT)
-GPIO.setup(Echo_EingangsPin, GPIO.IN)
-GPIO.output(Trigger_AusgangsPin, False)
+# Here, the sensor will be configured: the echo is timed from its edges
+# and a missing echo gives None instead of blocking forever
+sensor = UltrasonicSensor(Trigger_AusgangsPin, Echo_EingangsPin, maxRange=300)
  
 # Main program loop
 try:
     while True:
-        # Distance measurement will be started with a 10us long trigger signal
-        GPIO.output(Trigger_AusgangsPin, True)
-        time.sleep(0.00001)
-        GPIO.output(Trigger_AusgangsPin, False)
- 
-        # The stop watch will start here
-        EinschaltZeit = time.time()
-        while GPIO.input(Echo_EingangsPin) == 0:
-            EinschaltZeit = time.time() # The time will be saved till the signal is active
- 
-        while GPIO.input(Echo_EingangsPin) == 1:
-            AusschaltZeit = time.time() # The last time will be recorded in which the signal was active
- 
-        # The difference between the times gives the searched duration
-        Dauer = AusschaltZeit - EinschaltZeit
-        # With it you can calculate the distance 
-        Abstand = (Dauer * 34300) / 2
+        # A burst of 10us long trigger signals will be sent and the durations
+        # of the echo pulses measured, spurious echoes will be rejected
+        Abstand = sensor.burst(5)['distance']
  
         # Here you check if the measured value is in the permitted range
-        if Abstand < 2 or (round(Abstand) > 300):
+        if Abstand is None:
             # If not an error message will be shown
             print("Distance is not in the permitted range")
             print("------------------------------")
         else:
             # The value of the distance will be reduced to 2 numbers behind the comma
-            Abstand = format((Dauer * 34300) / 2, '.2f')
+            Abstand = format(Abstand, '.2f')
             # The calculated distance will be shown at the terminal
             print("The distance is:"), Abstand,("cm")
             print("------------------------------")
@@ -54,4 +40,5 @@ try:
  
 # Scavenging work after the end of the program
 except KeyboardInterrupt:
+    sensor.close()
     GPIO.cleanup()
\ No newline at end of file
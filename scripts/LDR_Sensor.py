@@ -0,0 +1,250 @@
+#!/usr/bin/python
+import time
+import math
+import threading
+import numpy as np
+from Monotonic_Clock import monotonic
+
+# ===========================================================================
+# Charge backends
+#
+# Both discharge the capacitor with the pin as an output and then release it
+# to an input with rising edge detection, returning the time the charge
+# started and the timestamp of the edge. GpiodLDRBackend uses the Linux GPIO
+# character device: the edge detection comes with the input configuration
+# and the kernel stamps the edge on CLOCK_MONOTONIC (Linux 5.7 and later for
+# the libgpiod v1 bindings), the clock of monotonic(). RPiGPIOLDRBackend
+# uses the edge detection of RPi.GPIO, which can only be armed on an input,
+# and stamps the edge in its callback thread. In both the pin is read once
+# the detection is armed: high without an edge means it charged before.
+# ===========================================================================
+
+class GpiodLDRBackend(object):
+
+    # Edges are stamped in the interrupt handler
+    timestamps = 'kernel'
+
+    def __init__(self, pin, chip='/dev/gpiochip0', consumer='ldr'):
+        import gpiod
+        self.gpiod = gpiod
+        self.pin = pin
+        self.consumer = consumer
+        if hasattr(gpiod, 'request_lines'):
+            # libgpiod v2: one request, reconfigured for each phase
+            from gpiod.line import Clock, Direction, Edge, Value
+            self.__output = {pin: gpiod.LineSettings(direction=Direction.OUTPUT,
+                                                     output_value=Value.INACTIVE)}
+            self.__input = {pin: gpiod.LineSettings(direction=Direction.INPUT,
+                                                    edge_detection=Edge.RISING,
+                                                    event_clock=Clock.MONOTONIC)}
+            self.__active = Value.ACTIVE
+            self.__request = gpiod.request_lines(chip, consumer=consumer, config=self.__output)
+            self.__v2 = True
+        else:
+            # libgpiod v1: the line is requested again for each phase
+            self.__chip = gpiod.Chip(chip)
+            self.__line = self.__chip.get_line(pin)
+            self.__line.request(consumer=consumer, type=gpiod.LINE_REQ_DIR_OUT, default_vals=[0])
+            self.__v2 = False
+
+    def discharge(self):
+        "Drives the pin low"
+        if self.__v2:
+            self.__request.reconfigure_lines(self.__output)
+            # Drop the edges left by a bouncing charge, the next one starts clean
+            while self.__request.wait_edge_events(0):
+                self.__request.read_edge_events()
+        else:
+            self.__line.release()
+            self.__line.request(consumer=self.consumer, type=self.gpiod.LINE_REQ_DIR_OUT, default_vals=[0])
+
+    def charge(self, timeout):
+        "Releases the pin and waits up to timeout seconds for it to read \
+        high. Returns (start, edge, saturated): edge is the monotonic() time \
+        of the rising edge, None without one, and saturated is True if the pin \
+        was already high when the detection was armed (edge is then the time \
+        it was read)."
+        start = monotonic()
+        if self.__v2:
+            self.__request.reconfigure_lines(self.__input)
+            high = self.__request.get_value(self.pin) == self.__active
+            checked = monotonic()
+            if self.__request.wait_edge_events(0 if high else timeout):
+                return start, self.__request.read_edge_events()[0].timestamp_ns*1e-9, False
+        else:
+            self.__line.release()
+            self.__line.request(consumer=self.consumer, type=self.gpiod.LINE_REQ_EV_RISING_EDGE)
+            high = self.__line.get_value()
+            checked = monotonic()
+            sec = 0 if high else int(timeout)
+            nsec = 0 if high else int((timeout - sec)*1e9)
+            if self.__line.event_wait(sec=sec, nsec=nsec):
+                event = self.__line.event_read()
+                edge = event.sec + event.nsec*1e-9
+                now = monotonic()
+                if not start <= edge <= now:
+                    # Kernels before 5.7 stamp on the wall clock, use the wake up
+                    edge = now
+                return start, edge, False
+        if high:
+            return start, checked, True
+        return start, None, False
+
+    def close(self):
+        if self.__v2:
+            self.__request.release()
+        else:
+            self.__line.release()
+            self.__chip.close()
+
+
+class RPiGPIOLDRBackend(object):
+
+    # Edges are stamped by the RPi.GPIO callback thread
+    timestamps = 'callback'
+
+    def __init__(self, pin):
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        self.pin = pin
+        self.__edge = threading.Event()
+        self.__edgeTime = None
+        GPIO.setmode(GPIO.BCM)
+        self.discharge()
+
+    def __onEdge(self, channel):
+        self.__edgeTime = monotonic()
+        self.__edge.set()
+
+    def discharge(self):
+        "Drives the pin low"
+        self.GPIO.setup(self.pin, self.GPIO.OUT)
+        self.GPIO.output(self.pin, self.GPIO.LOW)
+
+    def charge(self, timeout):
+        "See GpiodLDRBackend.charge()"
+        GPIO = self.GPIO
+        self.__edge.clear()
+        self.__edgeTime = None
+        GPIO.setup(self.pin, GPIO.IN)
+        start = monotonic()
+        GPIO.add_event_detect(self.pin, GPIO.RISING, callback=self.__onEdge)
+        try:
+            high = GPIO.input(self.pin)
+            checked = monotonic()
+            if self.__edge.wait(0 if high else timeout):
+                return start, self.__edgeTime, False
+        finally:
+            GPIO.remove_event_detect(self.pin)
+        if high:
+            return start, checked, True
+        return start, None, False
+
+    def close(self):
+        self.discharge()
+
+
+def openBackend(pin, chip='/dev/gpiochip0'):
+    "Returns the GPIO character device backend when the gpiod bindings and \
+    the chip are available, the RPi.GPIO one otherwise"
+    try:
+        return GpiodLDRBackend(pin, chip)
+    except (ImportError, AttributeError, IOError, OSError):
+        return RPiGPIOLDRBackend(pin)
+
+
+# ===========================================================================
+# LDRSensor Class
+#
+# Light dependent resistor charging a capacitor on one GPIO (RC circuit).
+# The pin discharges the capacitor as an output, then turns into an input and
+# the time until it reads high is measured with a timestamped rising edge on
+# the monotonic clock, so the result doesn't depend on the CPU speed or load.
+# The charge time is proportional to the resistance of the LDR, which goes
+# as lux^-gamma, so lux = 10*(time/time10)^(-1/gamma).
+# ===========================================================================
+
+class LDRSensor(object):
+
+    # Discharge time limits in seconds, between them it is dischargeRatio
+    # times the last charge time (the capacitor stops charging at the edge)
+    minDischarge = 0.001
+    maxDischarge = 0.1
+    dischargeRatio = 0.1
+
+    def __init__(self, pin, maxTime=1.0, time10=0.0078, gamma=0.7, backend=None):
+        "pin is the BCM GPIO of the RC circuit and maxTime the longest charge \
+        (darkness) waited for, in seconds. time10 is the charge time at 10 lux \
+        and gamma the slope of the LDR, the defaults are for a GL5528 (15k at \
+        10 lux) with 1uF, see calibrate(). backend drives the pin, see \
+        openBackend()."
+        self.backend = backend or openBackend(pin)
+        self.pin = pin
+        self.maxTime = maxTime
+        self.time10 = time10
+        self.gamma = gamma
+        # Measurements, charges longer than maxTime and charges that ended
+        # before the edge detection was armed (very bright light)
+        self.measurements = 0
+        self.timeouts = 0
+        self.saturated = 0
+        # Last charge time and the total time of the last measurement
+        self.lastTime = None
+        self.lastDuration = None
+        self.discharge = self.maxDischarge
+
+    def measure(self):
+        "Returns the charge time in seconds, None if it is longer than maxTime"
+        start = monotonic()
+        self.measurements += 1
+        self.backend.discharge()
+        time.sleep(self.discharge)
+        charge, edge, saturated = self.backend.charge(self.maxTime)
+        # Discharge right away, the capacitor stays near the threshold voltage
+        self.backend.discharge()
+        if saturated:
+            self.saturated += 1
+            self.lastTime = edge - charge
+            self.discharge = self.minDischarge
+        elif edge is None:
+            self.timeouts += 1
+            self.lastTime = None
+            self.discharge = self.maxDischarge
+        else:
+            self.lastTime = max(edge - charge, 0.0)
+            self.discharge = min(max(self.dischargeRatio*self.lastTime, self.minDischarge), self.maxDischarge)
+        self.lastDuration = monotonic() - start
+        return self.lastTime
+
+    def toLux(self, chargeTime):
+        "Converts a charge time in seconds to lux with the calibration"
+        if chargeTime is None:
+            return 0.0
+        return 10.0*(chargeTime/self.time10)**(-1.0/self.gamma)
+
+    def lux(self):
+        "Measures and returns the light in lux (0 in darkness)"
+        return self.toLux(self.measure())
+
+    def calibrate(self, points):
+        "Fits time10 and gamma to a list of (charge time, lux) pairs measured \
+        with a reference luxmeter (at least two light levels)"
+        times, luxes = np.array(points, dtype=np.float64).T
+        # log(t) = log(time10) - gamma*log(lux/10)
+        slope, intercept = np.polyfit(np.log(luxes/10.0), np.log(times), 1)
+        self.gamma = -slope
+        self.time10 = math.exp(intercept)
+        return self.time10, self.gamma
+
+    def stats(self):
+        "Returns the counters and the timings of the last measurement"
+        return {'measurements': self.measurements,
+                'timeouts': self.timeouts,
+                'saturated': self.saturated,
+                'chargeTime': self.lastTime,
+                'discharge': self.discharge,
+                'duration': self.lastDuration,
+                'timestamps': self.backend.timestamps}
+
+    def close(self):
+        self.backend.close()
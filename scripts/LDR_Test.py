@@ -10,33 +10,17 @@ from time import sleep
 
 import RPi.GPIO as GPIO
 
+from LDR_Sensor import LDRSensor
 
 
-GPIO.setmode(GPIO.BCM)
-
-
-
-def RCtime (RCpin):
-
-    reading = 0
-
-    GPIO.setup(RCpin, GPIO.OUT)
 
-    GPIO.output(RCpin, GPIO.LOW)
-
-    sleep(.1)
-
-
-
-    GPIO.setup(RCpin, GPIO.IN)
+GPIO.setmode(GPIO.BCM)
 
-    # This takes about 1 millisecond per loop cycle
 
-    while (GPIO.input(RCpin) == GPIO.LOW):
 
-        reading += 1
+# The charge time of the RC circuit is timed with an edge event, see LDR_Sensor
 
-    return reading
+ldr = LDRSensor(26)
 
 
 
@@ -44,9 +28,9 @@ while True:
 
     GetDateTime = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    LDRReading = RCtime(26)
+    LDRReading = ldr.lux()
 
-    print RCtime(26)
+    print GetDateTime, LDRReading
 
 
     sleep(1)
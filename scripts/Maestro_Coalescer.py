@@ -0,0 +1,406 @@
+#!/usr/bin/env python2.7
+
+
+## @file Maestro_Coalescer.py
+#  @brief Batches the servo commands of every channel of a Pololu Maestro board.
+#
+#  @section Coalescer_workflow
+#
+# All the servo_control objects of one board share a maestro_coalescer (see shared_coalescer()),
+# which owns the only maestro.Controller opened on the port. The targets requested within one
+# control tick are collected and every command of the tick is written to the port in a single
+# write, so the servos of a pose start moving at the same time. On the Mini Maestro 12, 18 and 24
+# a run of contiguous channels goes out as one "Set Multiple Targets" (0x1F) command; the Micro
+# Maestro doesn't support it (it flags a serial error and ignores it), so there every channel gets
+# its own "Set Target" (0x84, 0x04 in the Pololu protocol). Speed and acceleration are only sent
+# when they change.
+#
+# Each coalescer has a motion_monitor which reports when the servos reach the targets sent, so
+# the ROS callbacks return as soon as their command is queued. It makes one serial round trip per
+# tick, whatever the number of servos moving: a Mini Maestro is asked for its moving state, a
+# Micro Maestro (which lacks "Get Moving State") for the positions of the servos followed.
+#
+#  Set Multiple Targets, Pololu protocol:
+#  @code
+#  0xAA, device number, 0x1F, number of targets, first channel, target 1 low bits, target 1 high bits, ...
+#  @endcode
+#
+#  @date  November,2019
+
+
+import threading
+import time
+import rospy
+from mini_lowcost import maestro
+from Monotonic_Clock import monotonic
+
+
+## @var coalescers
+#  @brief Coalescer of each (port, device number), shared by the whole process
+coalescers      ={}
+coalescers_lock =threading.Lock()
+
+#------------------------------------------------------------#
+## @brief Returns the coalescer of a board, created and started the first time it is asked for.
+#  @param port:        Udev rule SYMLINK for the Pololu Maestro board.
+#  @param num_device:  Pololu Maestro board number.
+#  @param lock:        Lock serializing every serial transaction with the board.
+#  @param tick:        Time in seconds the requested targets are collected for.
+#  @param mini:        True for a Mini Maestro 12/18/24, False for a Micro Maestro.
+def shared_coalescer(port='/dev/ttyACM0',num_device=0x0c,lock=None,tick=0.02,mini=False):
+    with coalescers_lock:
+        key=(port,num_device)
+        if key not in coalescers:
+            coalescers[key]=maestro_coalescer(maestro.Controller(port,num_device),num_device,lock,tick,mini)
+            coalescers[key].start()
+            coalescers[key].monitor.start()
+        return coalescers[key]
+
+
+#------------------------------------------------------------#
+## @brief Command coalescer of one Maestro board.
+#  Thread which flushes the pending commands once per tick.
+#
+class maestro_coalescer(threading.Thread):
+
+    #------------------------------------------------------------#
+    ## @brief Constructor of the class
+    #  @param controller:  maestro.Controller of the board.
+    #  @param num_device:  Pololu Maestro board number.
+    #  @param lock:        Lock serializing every serial transaction with the board, a new one if None.
+    #  @param tick:        Time in seconds the requested targets are collected for.
+    #  @param mini:        True for a Mini Maestro 12/18/24, which has the Set Multiple Targets command.
+    def __init__(self,controller,num_device=0x0c,lock=None,tick=0.02,mini=False):
+        threading.Thread.__init__(self)
+        self.daemon         =True
+        ## @var controller
+        #  @brief Third parties object sending the serial commands
+        self.controller     =controller
+        ## @var lock
+        #  @brief Lock of the serial port
+        self.lock           =lock if lock is not None else threading.Lock()
+        ## @var tick
+        #  @brief Collecting window in seconds
+        self.tick           =tick
+        ## @var mini
+        #  @brief True for a Mini Maestro, the Micro Maestro lacks its commands
+        self.mini           =mini
+        self._prefix        =bytearray([0xAA,num_device])
+        self._pending_lock  =threading.Lock()
+        self._wakeup        =threading.Event()
+        self._targets       ={}
+        self._speeds        ={}
+        self._accels        ={}
+        self._callbacks     ={}
+        self._sent_speeds   ={}
+        self._sent_accels   ={}
+        ## @var commands
+        #  @brief Number of setTarget, setSpeed and setAccel requests received
+        self.commands       =0
+        ## @var flushes
+        #  @brief Number of writes to the serial port
+        self.flushes        =0
+        ## @var bytes_sent
+        #  @brief Serial bytes written
+        self.bytes_sent     =0
+        ## @var bytes_unbatched
+        #  @brief Serial bytes the same requests take as individual commands
+        self.bytes_unbatched=0
+        ## @var monitor
+        #  @brief Motion monitor of the board
+        self.monitor        =motion_monitor(self)
+
+    #------------------------------------------------------------#
+    ## @brief Clamps a target to the range set with setRange(), like maestro.Controller.setTarget
+    #  @return (target, True if it was inside the range)
+    def clamp(self,channel,target):
+        mins=getattr(self.controller,'Mins',None)
+        maxs=getattr(self.controller,'Maxs',None)
+        if target==0:
+            # 0 stops sending pulses to the servo
+            return target,True
+        if mins and mins[channel]>0 and target<mins[channel]:
+            return mins[channel],False
+        if maxs and maxs[channel]>0 and target>maxs[channel]:
+            return maxs[channel],False
+        return target,True
+
+    #------------------------------------------------------------#
+    ## @brief Queues the target of a channel, sent with the rest of the tick.
+    #  @param channel:  Physical channel of the servo.
+    #  @param target:   Target in quarter-microseconds, 0 to disable the servo.
+    #  @param speed:    Speed to set before moving, None to keep it.
+    #  @param accel:    Acceleration to set before moving, None to keep it.
+    #  @param sync:     Sends the pending commands right away instead of waiting for the tick.
+    #  @param on_complete: Function called with (channel, True) when the servo reaches the target,
+    #                      (channel, False) if another target for the channel is sent before.
+    #  @return True if the target is inside the range of the channel.
+    def set_target(self,channel,target,speed=None,accel=None,sync=False,on_complete=None):
+        return self.set_targets({channel:target},speed,accel,sync,on_complete)[channel]
+
+    #------------------------------------------------------------#
+    ## @brief Queues the targets of several channels (a pose), all sent in the same write.
+    #  @param targets:  Dictionary {channel: target in quarter-microseconds}.
+    #  @param speed:    Speed of all of them, a {channel: speed} dictionary or None to keep them.
+    #  @param accel:    Acceleration of all of them, a {channel: acceleration} dictionary or None.
+    #  @param sync:     Sends the pending commands right away instead of waiting for the tick.
+    #  @param on_complete: Function called with (channel, True) when each servo reaches its target,
+    #                      (channel, False) if another target for the channel is sent before.
+    #  @return Dictionary {channel: True if the target is inside the range}.
+    def set_targets(self,targets,speed=None,accel=None,sync=False,on_complete=None):
+        inside={}
+        superseded=[]
+        with self._pending_lock:
+            for channel,target in targets.items():
+                target,inside[channel]=self.clamp(channel,int(target))
+                self._targets[channel]=target
+                if channel in self._callbacks:
+                    superseded.append((channel,self._callbacks.pop(channel)))
+                if on_complete is not None:
+                    self._callbacks[channel]=on_complete
+                self.commands+=1
+                if speed is not None:
+                    self._speeds[channel]=int(speed[channel] if isinstance(speed,dict) else speed)
+                    self.commands+=1
+                if accel is not None:
+                    self._accels[channel]=int(accel[channel] if isinstance(accel,dict) else accel)
+                    self.commands+=1
+        for channel,callback in superseded:
+            callback(channel,False)
+        if sync:
+            self.flush()
+        else:
+            self._wakeup.set()
+        return inside
+
+    def _command(self,cmd,channel,value):
+        return bytearray([cmd,channel,value&0x7F,(value>>7)&0x7F])
+
+    #------------------------------------------------------------#
+    ## @brief Builds the commands pending: speeds and accelerations that changed, then a Set
+    #  Multiple Targets per run of contiguous channels on a Mini Maestro, a Set Target per channel
+    #  on a Micro Maestro.
+    #  @return List of commands without the protocol prefix, bytes the requests take unbatched, the
+    #  targets and their completion callbacks.
+    def _collect(self):
+        with self._pending_lock:
+            targets,self._targets=self._targets,{}
+            callbacks,self._callbacks=self._callbacks,{}
+            speeds,self._speeds=self._speeds,{}
+            accels,self._accels=self._accels,{}
+        commands=[]
+        unbatched=0
+        for cmd,pending,sent in ((0x09,accels,self._sent_accels),(0x07,speeds,self._sent_speeds)):
+            for channel in sorted(pending):
+                unbatched+=len(self._prefix)+4
+                if sent.get(channel)!=pending[channel]:
+                    commands.append(self._command(cmd,channel,pending[channel]))
+                    sent[channel]=pending[channel]
+        channels=sorted(targets)
+        unbatched+=len(channels)*(len(self._prefix)+4)
+        while channels:
+            run=1
+            while self.mini and run<len(channels) and channels[run]==channels[0]+run:
+                run+=1
+            if run==1:
+                commands.append(self._command(0x04,channels[0],targets[channels[0]]))
+            else:
+                command=bytearray([0x1F,run,channels[0]])
+                for channel in channels[:run]:
+                    command+=bytearray([targets[channel]&0x7F,(targets[channel]>>7)&0x7F])
+                commands.append(command)
+            channels=channels[run:]
+        targets_sent=getattr(self.controller,'Targets',None)
+        if targets_sent is not None:
+            # isMoving() of the controller compares the position with them
+            for channel,target in targets.items():
+                targets_sent[channel]=target
+        return commands,unbatched,targets,callbacks
+
+    #------------------------------------------------------------#
+    ## @brief Sends every pending command in a single write to the serial port.
+    #  @return Number of bytes written.
+    def flush(self):
+        with self.lock:
+            commands,unbatched,targets,callbacks=self._collect()
+            if not commands:
+                return 0
+            data=bytearray()
+            for command in commands:
+                data+=self._prefix+command
+            self.controller.usb.write(bytes(data))
+        self.monitor.track(targets,callbacks)
+        self.flushes        +=1
+        self.bytes_sent     +=len(data)
+        self.bytes_unbatched+=unbatched
+        return len(data)
+
+    #------------------------------------------------------------#
+    ## @brief Reads the position of several channels in one serial round trip: a "Get Position"
+    #  (0x10) per channel goes out in a single write and their replies are read together.
+    #  @param channels:  List of channels.
+    #  @return Dictionary {channel: position in quarter-microseconds}
+    def read_positions(self,channels):
+        data=bytearray()
+        for channel in channels:
+            data+=self._prefix+bytearray([0x10,channel])
+        with self.lock:
+            self.controller.usb.write(bytes(data))
+            reply=bytearray(self.controller.usb.read(2*len(channels)))
+        if len(reply)!=2*len(channels):
+            raise IOError("Maestro answered %d bytes of %d"%(len(reply),2*len(channels)))
+        return dict((channel,reply[2*index]|(reply[2*index+1]<<8)) for index,channel in enumerate(channels))
+
+    #------------------------------------------------------------#
+    ## @brief Reads the position of several channels in one serial round trip and whether they
+    #  still move. The moving state comes from the last targets sent, like isMoving() of the
+    #  controller, so it works on the Micro Maestro, which lacks "Get Moving State".
+    #  @param channels:  List of channels.
+    #  @return (dictionary {channel: position in quarter-microseconds}, dictionary {channel: True
+    #  while moving to its target})
+    def read_state(self,channels):
+        positions=self.read_positions(channels)
+        targets=getattr(self.controller,'Targets',None)
+        moving={}
+        for channel in channels:
+            # Like isMoving() of the controller: still away from the last target sent
+            moving[channel]=bool(targets and targets[channel]>0 and positions[channel]!=targets[channel])
+        return positions,moving
+
+    #------------------------------------------------------------#
+    ## @brief Thread loop: once a command arrives, waits the rest of the tick and flushes.
+    def run(self):
+        while True:
+            self._wakeup.wait()
+            time.sleep(self.tick)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # The board was unplugged, keep serving once it is back
+                rospy.logerr("Maestro coalescer: %s",str(e))
+
+    #------------------------------------------------------------#
+    ## @brief Counters of the coalescer.
+    def stats(self):
+        return {'commands':self.commands,
+                'flushes':self.flushes,
+                'bytes_sent':self.bytes_sent,
+                'bytes_unbatched':self.bytes_unbatched}
+
+
+#------------------------------------------------------------#
+## @brief Motion completion monitor of one Maestro board.
+#  Thread which follows the targets sent to every channel and calls their completion functions.
+#  On a Mini Maestro it sends one "Get Moving State" (0x13) each tick: when no servo moves, every
+#  target was reached. While some move, it also reads the position of one of the channels followed,
+#  in turn, so a servo which arrives before the rest is reported without polling each channel every
+#  tick. The Micro Maestro doesn't have that command, there the positions of all the channels
+#  followed are read in one round trip and compared with their targets.
+#
+class motion_monitor(threading.Thread):
+
+    #------------------------------------------------------------#
+    ## @brief Constructor of the class
+    #  @param coalescer:   maestro_coalescer of the board.
+    #  @param tick:        Time in seconds between polls.
+    #  @param settle:      Time in seconds after sending a target before the board reports it moving.
+    def __init__(self,coalescer,tick=0.05,settle=0.04):
+        threading.Thread.__init__(self)
+        self.daemon      =True
+        self.coalescer   =coalescer
+        self.controller  =coalescer.controller
+        self.lock        =coalescer.lock
+        self.tick        =tick
+        self.settle      =settle
+        self._goals_lock =threading.Lock()
+        ## @var goals
+        #  @brief Dictionary {channel: (target, completion function, time it was sent)}
+        self.goals       ={}
+        self._turn       =0
+        ## @var polls
+        #  @brief Number of serial transactions of the monitor
+        self.polls       =0
+        ## @var completed
+        #  @brief Number of targets reached
+        self.completed   =0
+        ## @var interrupted
+        #  @brief Number of targets replaced by another before being reached
+        self.interrupted =0
+
+    #------------------------------------------------------------#
+    ## @brief Follows the targets just sent, the ones they replace are reported as not reached.
+    #  @param targets:    Dictionary {channel: target}.
+    #  @param callbacks:  Dictionary {channel: completion function}, channels without one aren't followed.
+    def track(self,targets,callbacks):
+        now=monotonic()
+        replaced=[]
+        with self._goals_lock:
+            for channel,target in targets.items():
+                if channel in self.goals:
+                    replaced.append((channel,self.goals.pop(channel)[1]))
+                if channel in callbacks:
+                    self.goals[channel]=(target,callbacks[channel],now)
+            self.interrupted+=len(replaced)
+        for channel,callback in replaced:
+            callback(channel,False)
+
+    def _complete(self,channels):
+        done=[]
+        with self._goals_lock:
+            for channel in channels:
+                if channel in self.goals:
+                    done.append((channel,self.goals.pop(channel)[1]))
+            self.completed+=len(done)
+        for channel,callback in done:
+            callback(channel,True)
+
+    #------------------------------------------------------------#
+    ## @brief Checks the goals once.
+    def poll(self):
+        now=monotonic()
+        with self._goals_lock:
+            # The board doesn't report a target as moving until its next servo period
+            active=sorted(channel for channel,goal in self.goals.items() if now-goal[2]>=self.settle)
+        if not active:
+            return
+        if not self.coalescer.mini:
+            positions=self.coalescer.read_positions(active)
+            self.polls+=1
+            with self._goals_lock:
+                arrived=[channel for channel in active if channel in self.goals and positions[channel]==self.goals[channel][0]]
+            self._complete(arrived)
+            return
+        with self.lock:
+            moving=self.controller.getMovingState()
+        self.polls+=1
+        if not moving:
+            self._complete(active)
+            return
+        self._turn=(self._turn+1)%len(active)
+        channel=active[self._turn]
+        with self.lock:
+            position=self.controller.getPosition(channel)
+        self.polls+=1
+        with self._goals_lock:
+            arrived=channel in self.goals and position==self.goals[channel][0]
+        if arrived:
+            self._complete([channel])
+
+    #------------------------------------------------------------#
+    ## @brief Thread loop.
+    def run(self):
+        while True:
+            time.sleep(self.tick)
+            try:
+                self.poll()
+            except Exception as e:
+                rospy.logerr("Maestro motion monitor: %s",str(e))
+
+    #------------------------------------------------------------#
+    ## @brief Counters of the monitor.
+    def stats(self):
+        return {'goals':len(self.goals),
+                'polls':self.polls,
+                'completed':self.completed,
+                'interrupted':self.interrupted}
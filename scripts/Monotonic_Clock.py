@@ -0,0 +1,68 @@
+#!/usr/bin/python
+import os
+import time
+import ctypes
+import ctypes.util
+import warnings
+
+# ===========================================================================
+# Monotonic Clock
+#
+# Time source of the drivers of this directory for timeouts, pulse widths
+# and ages. The wall clock can jump (NTP, a date set at boot on the Pi
+# without RTC), so it must not be used to measure intervals. Python 3 has
+# time.monotonic(); on Python 2 CLOCK_MONOTONIC is read through
+# clock_gettime() of the C library.
+# ===========================================================================
+
+# From linux/time.h
+CLOCK_MONOTONIC = 1
+
+class timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long),
+                ('tv_nsec', ctypes.c_long)]
+
+
+def _clockGettime():
+    "Returns clock_gettime() of libc, or of librt on glibc older than 2.17"
+    for name in ('c', 'rt'):
+        path = ctypes.util.find_library(name)
+        if path is None:
+            continue
+        try:
+            function = ctypes.CDLL(path, use_errno=True).clock_gettime
+        except (OSError, AttributeError):
+            continue
+        function.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        function.restype = ctypes.c_int
+        return function
+    return None
+
+
+def _ctypesMonotonic():
+    clockGettime = _clockGettime()
+    if clockGettime is None:
+        return None
+
+    def monotonic():
+        "Seconds of CLOCK_MONOTONIC, only meaningful as differences"
+        now = timespec()
+        if clockGettime(CLOCK_MONOTONIC, ctypes.byref(now)) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, "clock_gettime: %s" % os.strerror(errno))
+        return now.tv_sec + now.tv_nsec*1e-9
+
+    try:
+        monotonic()
+    except OSError:
+        return None
+    return monotonic
+
+
+if hasattr(time, 'monotonic'):
+    monotonic = time.monotonic
+else:
+    monotonic = _ctypesMonotonic()
+    if monotonic is None:
+        warnings.warn("No monotonic clock available, intervals use the wall clock")
+        monotonic = time.time
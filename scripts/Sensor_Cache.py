@@ -0,0 +1,190 @@
+#!/usr/bin/python
+import threading
+from Monotonic_Clock import monotonic
+
+# ===========================================================================
+# SensorCache Class
+#
+# Latest value of every sensor of the process, so consumers that want the
+# same reading share one hardware read. Each sensor is registered with a
+# read function and a maximum age: get() returns the cached value while it
+# is younger than that, otherwise it reads again. The reads are single
+# flight: while one caller is reading a sensor the others wait for its
+# result instead of starting their own. A group registers several sensors
+# read at once (a DS18B20 sweep), a miss on any of them refreshes all.
+# Sensors on the same device (the channels of an ADS1x15) share a lock so
+# their reads don't interleave on the bus.
+# ===========================================================================
+
+class _Source(object):
+    # A read function and the sensors it returns
+
+    def __init__(self, names, reader, maxAge, lock, group):
+        self.names = names
+        self.reader = reader
+        self.maxAge = maxAge
+        self.lock = lock
+        self.group = group
+        self.condition = threading.Condition()
+        self.reading = False
+        # Incremented at the end of each read, the waiters know theirs is done
+        self.generation = 0
+        self.error = None
+        self.values = {}
+        self.times = {}
+
+
+class _Counters(object):
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.errors = 0
+        self.ageTotal = 0.0
+        self.ageMax = 0.0
+
+
+class SensorCache(object):
+
+    def __init__(self):
+        self.__sources = {}
+        self.__counters = {}
+        self.__deviceLocks = {}
+        self.__lock = threading.Lock()
+        self.started = monotonic()
+
+    def register(self, name, reader, maxAge, lock=None):
+        "Registers a sensor read by calling reader(), its value is reused for \
+        maxAge seconds. lock serializes the reads of sensors on one device."
+        self.__add(_Source([name], reader, maxAge, lock, False))
+
+    def registerGroup(self, names, reader, maxAge, lock=None):
+        "Registers sensors read together, reader() returns a {name: value} \
+        dictionary"
+        self.__add(_Source(list(names), reader, maxAge, lock, True))
+
+    def __add(self, source):
+        with self.__lock:
+            for name in source.names:
+                self.__sources[name] = source
+                self.__counters[name] = _Counters()
+
+    def deviceLock(self, device):
+        "Returns the lock shared by the sensors of a device object"
+        with self.__lock:
+            return self.__deviceLocks.setdefault(id(device), threading.Lock())
+
+    def names(self):
+        return sorted(self.__sources)
+
+    def get(self, name, maxAge=None):
+        "Returns the value of a sensor, read again if the cached one is older \
+        than maxAge (the registered one by default). Raises what the read \
+        raised, to every caller that waited for it."
+        source = self.__sources[name]
+        counters = self.__counters[name]
+        if maxAge is None:
+            maxAge = source.maxAge
+        with source.condition:
+            stamp = source.times.get(name)
+            if stamp is not None:
+                age = monotonic() - stamp
+                if age <= maxAge:
+                    counters.hits += 1
+                    counters.ageTotal += age
+                    counters.ageMax = max(counters.ageMax, age)
+                    return source.values[name]
+            if source.reading:
+                # Someone else is reading it, its result is fresh enough
+                generation = source.generation
+                while source.generation == generation:
+                    source.condition.wait()
+                counters.shared += 1
+                if source.error is not None:
+                    raise source.error
+                return source.values[name]
+            source.reading = True
+            counters.misses += 1
+        error = None
+        try:
+            if source.lock is not None:
+                with source.lock:
+                    result = source.reader()
+            else:
+                result = source.reader()
+        except Exception as e:
+            error = e
+        with source.condition:
+            if error is None:
+                now = monotonic()
+                values = result if source.group else {name: result}
+                for key in source.names:
+                    if key in values:
+                        source.values[key] = values[key]
+                        source.times[key] = now
+            else:
+                counters.errors += 1
+            source.error = error
+            source.reading = False
+            source.generation += 1
+            source.condition.notify_all()
+            if error is not None:
+                raise error
+            return source.values.get(name)
+
+    def invalidate(self, name=None):
+        "Forgets the cached value of a sensor, or of all of them"
+        for key, source in list(self.__sources.items()):
+            if name is None or key == name:
+                with source.condition:
+                    source.times.pop(key, None)
+
+    def stats(self):
+        "Returns the hits, misses (hardware reads), shared waits, errors and the \
+        mean and maximum age of the values served from the cache for each \
+        sensor, plus the hardware reads per second of the process"
+        now = monotonic()
+        sensors = {}
+        for name, counters in self.__counters.items():
+            source = self.__sources[name]
+            stamp = source.times.get(name)
+            sensors[name] = {'hits': counters.hits,
+                             'misses': counters.misses,
+                             'shared': counters.shared,
+                             'errors': counters.errors,
+                             'meanAge': counters.ageTotal/counters.hits if counters.hits else None,
+                             'maxAge': counters.ageMax,
+                             'age': now - stamp if stamp is not None else None}
+        reads = sum(counters.misses for counters in self.__counters.values())
+        elapsed = now - self.started
+        return {'sensors': sensors,
+                'reads': reads,
+                'readRate': reads/elapsed if elapsed > 0 else 0.0}
+
+    # Registration of the drivers of this directory
+
+    def addADC(self, name, adc, channel, pga=6144, sps=250, maxAge=0.1):
+        "Single ended channel of an ADS1x15, pga='auto' auto-ranges it"
+        if pga == 'auto':
+            reader = lambda: adc.readADCAutoRanged(channel, sps)
+        else:
+            reader = lambda: adc.readADCSingleEnded(channel, pga, sps)
+        self.register(name, reader, maxAge, self.deviceLock(adc))
+
+    def addDS18B20(self, reader, maxAge=5.0):
+        "Every thermometer of a DS18B20Reader, named by its device id and \
+        refreshed together by one sweep"
+        self.registerGroup(reader.devices, reader.sweep, maxAge, self.deviceLock(reader))
+
+    def addUltrasonic(self, name, sensor, maxAge=0.2):
+        "Distance in cm of an UltrasonicSensor"
+        self.register(name, sensor.measure, maxAge, self.deviceLock(sensor))
+
+    def addLDR(self, name, ldr, maxAge=1.0):
+        "Light in lux of an LDRSensor"
+        self.register(name, ldr.lux, maxAge, self.deviceLock(ldr))
+
+
+# The cache of the process, shared by all the scripts that import it
+cache = SensorCache()
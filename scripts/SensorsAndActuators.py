@@ -1,4 +1,5 @@
 #!/usr/bin/env python2.7
+# coding=utf-8
 
 
 ## @file SensorsAndActuators.py
@@ -58,6 +59,11 @@ from std_msgs.msg import Float32
 from std_msgs.msg import Int8
 from motor_msgs.srv import *
 from dynamixel_msgs.msg import JointState
+from sensor_msgs.msg import JointState as JointStateArray
+from trajectory_msgs.msg import JointTrajectory
+from Maestro_Coalescer import shared_coalescer
+from Monotonic_Clock import monotonic
+from Servo_Calibration import servo_calibration,calibration_model
 
 
 mutex = threading.Lock()
@@ -85,7 +91,9 @@ class servo_control(threading.Thread):
     #  @param default_acc:         Default acceleration for the scenario where no acceleration values are sent
     #  @param port:                Udev rule SYMLINK for the Pololu Maestro board.
     #  @param num_device:          Pololu Maestro board number, in hexadecimal the default is 0x0C
-    def __init__(self,id,channel,home,min_possible_us,max_possible_us,user_min,user_max,motor_amplitude,default_vel,default_acc,pololu_vel_min,pololu_vel_max,port='/dev/ttyACM0',num_device=0x0c):
+    #  @param calibration_table:   Optional list of measured [radians, quarter-microseconds] points replacing the linear calibration
+    #  @param mini_maestro:        True if the board is a Mini Maestro 12/18/24, False for a Micro Maestro
+    def __init__(self,id,channel,home,min_possible_us,max_possible_us,user_min,user_max,motor_amplitude,default_vel,default_acc,pololu_vel_min,pololu_vel_max,port='/dev/ttyACM0',num_device=0x0c,calibration_table=None,mini_maestro=False):
         threading.Thread.__init__(self)
         ## @var command_pololu_sub
         #  @brief Subscriber object of command topic
@@ -155,15 +163,12 @@ class servo_control(threading.Thread):
         ## @var servo_arrived
         #  @brief  Boolean used to indicate if the arrived was successfull or interrupted
         self.servo_arrived      =True
-        ## @var newcommand_flag
-        #  @brief  Flag used to check multiple commands
-        self.newcommand_flag    =True
-        ## @var togglechecker
-        #  @brief  Flag used to check if new command arrived
-        self.togglechecker      =True
+        ## @var coalescer
+        #  @brief Command coalescer of the board, shared by all the servos connected to it
+        self.coalescer          =shared_coalescer(self._port,self._num_device,mutex,mini=mini_maestro)
         ## @var micro_maestro
-        #  @brief Main object of third parties library to send serial commands
-        self.micro_maestro      =maestro.Controller(self._port,self._num_device)
+        #  @brief Main object of third parties library to send serial commands, the one of the coalescer
+        self.micro_maestro      =self.coalescer.controller
         ## @var checkinterval
         #  @brief Time between checking movement to detect wether it's arrived or not
         self.checkinterval      =0.1
@@ -176,6 +181,9 @@ class servo_control(threading.Thread):
         ## @var halfrangeinradians
         #  @brief Half of that range converted into radians
         self.halfrangeinradians =((self._motor_amplitude*2*math.pi)/360)/2
+        ## @var calibration
+        #  @brief Precomputed unit conversions of the servo
+        self.calibration        =servo_calibration(self._min_possible_us,self._home,self._max_possible_us,self.halfrangeinradians,self._pololu_vel_min,self._pololu_vel_max,calibration_table)
         self._user_min_us = 0
         self._user_max_us = 0
         self.initialize_callback(-1*user_min,user_max)
@@ -188,8 +196,8 @@ class servo_control(threading.Thread):
     #  @param user_min: view description in the constructor method
     #  @param user_max: view description in the constructor method
     def initialize_callback(self,user_min,user_max):
-        self._user_min_us =int(np.interp (    user_min,   (-self.halfrangeinradians,0)    ,(self._min_possible_us,self._home) )   )
-        self._user_max_us =int(np.interp (    user_max,   (0,self.halfrangeinradians)     ,(self._home,self._max_possible_us) )   )
+        self._user_min_us =int(self.calibration.to_us(min(user_min,0)))
+        self._user_max_us =int(self.calibration.to_us(max(user_max,0)))
         self.micro_maestro.setRange(self._channel,self._user_min_us,self._user_max_us)
         rospy.logdebug("##############################################")
         rospy.logdebug("##############       %s       ##############",self._id )
@@ -214,21 +222,11 @@ class servo_control(threading.Thread):
     #  - bool success
     #  - string message
     def calibrate_callback(self,req):
-    	mutex.acquire()
-        self.micro_maestro.setAccel(self._channel,10)
-        self.micro_maestro.setSpeed(self._channel,self.normalize_vel(30))
         self.lastvel=self.normalize_vel(30)
-        self.micro_maestro.setTarget(self._channel,self._user_min_us)
-        while self.micro_maestro.isMoving(self._channel):
-            time.sleep(self.checkinterval)
-        self.micro_maestro.setTarget(self._channel,self._user_max_us)
-        while self.micro_maestro.isMoving(self._channel):
-            time.sleep(self.checkinterval)
-        self.micro_maestro.setTarget(self._channel,self._home)
-        while self.micro_maestro.isMoving(self._channel):
-            time.sleep(self.checkinterval)
-        self.newcommand_flag = not self.newcommand_flag
-        mutex.release()
+        for target in (self._user_min_us,self._user_max_us,self._home):
+            self.coalescer.set_target(self._channel,target,speed=self.normalize_vel(30),accel=10,sync=True)
+            while self.is_moving():
+                time.sleep(self.checkinterval)
         self.last_goal_in_radians=self.usec2radians(self._home)
         resp         =TestStatusResponse()
         resp.success =True
@@ -258,12 +256,8 @@ class servo_control(threading.Thread):
     #  @return response: None
     def enable_callback(self,req):
         self.enabled=True
-        mutex.acquire()
-        self.micro_maestro.setAccel(self._channel,0)
-        self.micro_maestro.setSpeed(self._channel,self.normalize_vel(0))
         self.lastvel=self.normalize_vel(30)
-        self.micro_maestro.setTarget(self._channel,self._home)
-        mutex.release()
+        self.coalescer.set_target(self._channel,self._home,speed=self.normalize_vel(0),accel=0)
         self.last_goal_in_radians=self.usec2radians(self._home)
         resp         =TestStatusResponse()
         resp.success =True
@@ -277,9 +271,7 @@ class servo_control(threading.Thread):
     #  - bool data.
     #  @return response: None
     def disable_callback(self,req):
-    	mutex.acquire()
-        self.micro_maestro.setTarget(self._channel,0)
-        mutex.release()
+        self.coalescer.set_target(self._channel,0)
         self.enabled=False
         resp         =TestStatusResponse()
         resp.success =True
@@ -327,27 +319,20 @@ class servo_control(threading.Thread):
     def command_pololu_callback(self, command_msg):
         rospy.logdebug ('id: '+str(self._id)+ ', channel: '+str(self._channel)+', position: ' + str(command_msg.position)+' ,velocity: '+str(command_msg.velocity) +', acceleration: '+ str(command_msg.acceleration))
         if self.enabled:
-            mutex.acquire()
-            self.micro_maestro.setAccel(self._channel,int(command_msg.acceleration))
             if command_msg.velocity == 0:
-                self.micro_maestro.setSpeed(self._channel,self.normalize_vel(self._default_vel))
+                speed=self.normalize_vel(self._default_vel)
                 self.lastvel=self.normalize_vel(30)
             else:
-                self.micro_maestro.setSpeed(self._channel,self.normalize_vel(command_msg.velocity))
+                speed=self.normalize_vel(command_msg.velocity)
                 self.lastvel=self.normalize_vel(command_msg.velocity)
-            if command_msg.position >0:
-                self.position_converted = np.interp(command_msg.position,(0,self.halfrangeinradians),(self._home,self._max_possible_us))
-            else:
-                self.position_converted = np.interp(command_msg.position,(-self.halfrangeinradians,0),(self._min_possible_us,self._home))
-            if self.micro_maestro.setTarget(self._channel,int(self.position_converted)):
+            self.position_converted = self.calibration.to_us(command_msg.position)
+            # Sent with the targets of the other servos requested in the same tick
+            # its arrival is published by the motion monitor of the board
+            if self.coalescer.set_target(self._channel,int(self.position_converted),speed=speed,accel=int(command_msg.acceleration),on_complete=self.command_completed):
                 rospy.logdebug("Inside the set range")
             else :
                 rospy.logwarn("Angle outside the user set range, going to user limit")
-            mutex.release()
             self.last_goal_in_radians=self.usec2radians(self.position_converted)
-            self.newcommand_flag = not self.newcommand_flag
-            time.sleep(self.checkinterval*2)
-            self.checkservo()
         else:
             rospy.logwarn("Not enabled")
 
@@ -359,78 +344,369 @@ class servo_control(threading.Thread):
     #  @return None
     def default_pololu_callback(self, command_msg):
         rospy.logdebug('Mandando '+str(self._id)+' a home')
-        mutex.acquire()
-        self.micro_maestro.setAccel(self._channel,0)
-        self.micro_maestro.setSpeed(self._channel,self.normalize_vel(0))
         self.lastvel=self.normalize_vel(0)
-        self.micro_maestro.setTarget(self._channel,self._home)
-        mutex.release()
+        self.coalescer.set_target(self._channel,self._home,speed=self.normalize_vel(0),accel=0,on_complete=self.command_completed)
         self.last_goal_in_radians=self.usec2radians(self._home)
-        self.newcommand_flag = not self.newcommand_flag
-        time.sleep(self.checkinterval*2)
-        self.checkservo()
         #1self.micro_maestro.goHome()#self._channel,command_msg.position)
         #1print(self.micro_maestro.getError())
 
 
 
     #------------------------------------------------------------#
-    ## @brief Check servo function
+    ## @brief Command completion function, called from the motion monitor of the board
     #  @param self The object pointer.
+    #  @param channel: Channel of the servo.
+    #  @param arrived: True if the servo reached the target, False if a new command replaced it.
     #  @see command_pololu_callback()
     #  @return None
-    def checkservo(self):
-        self.togglechecker = self.newcommand_flag
+    def command_completed(self,channel,arrived):
+        self.servo_arrived=arrived
+        if not arrived:
+            rospy.logwarn("New command received and didnt finish previus movement")
+        self.arrived_motor_pub.publish(arrived)
+
+    #------------------------------------------------------------#
+    ## @brief Checks if the servo is still moving to its target
+    #  @param self The object pointer.
+    #  @return True while moving
+    def is_moving(self):
         mutex.acquire()
         se_mueve=self.micro_maestro.isMoving(self._channel)
         mutex.release()
-        while se_mueve:
-            time.sleep(self.checkinterval)
-            if self.togglechecker!=self.newcommand_flag:
-                message=False
-                self.arrived_motor_pub.publish(message)
-                rospy.logwarn("New command received and didnt finish previus movement")
-                break
-            mutex.acquire()
-            se_mueve=self.micro_maestro.isMoving(self._channel)
-            mutex.release()
-        if self.togglechecker==self.newcommand_flag:
-            message=True
-            self.arrived_motor_pub.publish(message)
+        return se_mueve
 
     #------------------------------------------------------------#
     ## @brief Normalize velocity from 0-100 to a set range
     #  @param vel_percentage Velocity taken from the message
     #  @return Interpolated velocity based in _pololu_vel_min and _pololu_vel_max
     def normalize_vel(self,vel_percentage):
-        return int(np.interp(vel_percentage,(0,100),(self._pololu_vel_min,self._pololu_vel_max)))
+        return int(self.calibration.vel_to_pololu(vel_percentage))
 
     def usec2radians(self,usec):
-    	if usec>=self._home:
-    		radians=np.interp(usec,(self._home,self._max_possible_us),(0,self.halfrangeinradians))
-    	else:
-    		radians=np.interp(usec,(self._min_possible_us,self._home),(-self.halfrangeinradians,0))
-    	return radians
+        return self.calibration.to_rad(usec)
     #------------------------------------------------------------#
     ## @brief Publish motor status
-    #  @param vel_percentage Velocity taken from the message
-    #  @return Interpolated velocity based in _pololu_vel_min and _pololu_vel_max
-    def publish_state(self):
+    #  @param current_pos: Position in radians converted by state_publisher, None to read it here
+    #  @param is_moving:   Moving flag read with it
+    #  @return None
+    def publish_state(self,current_pos=None,is_moving=None):
         sent_state=JointState()
         sent_state.name=str(self._id)
         sent_state.goal_pos=self.last_goal_in_radians
-        sent_state.velocity=int(np.interp(self.lastvel,(self._pololu_vel_min,self._pololu_vel_max),(0,100)))
-        mutex.acquire()
-        pos=float(self.micro_maestro.getPosition(self._channel))
-        sent_state.is_moving=self.micro_maestro.isMoving(self._channel)
-        mutex.release()
-        sent_state.current_pos=self.usec2radians(pos)
+        sent_state.velocity=int(self.calibration.pololu_to_vel(self.lastvel))
+        if current_pos is None:
+            mutex.acquire()
+            pos=self.micro_maestro.getPosition(self._channel)
+            is_moving=self.micro_maestro.isMoving(self._channel)
+            mutex.release()
+            current_pos=self.usec2radians(float(pos))
+        sent_state.is_moving=is_moving
+        sent_state.current_pos=current_pos
+        self.current_pos_in_radians=sent_state.current_pos
         self.state_motor_pub.publish(sent_state)
         self.pub_plot_goal.publish(self.last_goal_in_radians)
         self.pub_plot_current_pos.publish(sent_state.current_pos)
         self.pub_plot_is_moving.publish(int(sent_state.is_moving))
 
 
+#------------------------------------------------------------#
+## @brief Fixed rate publisher of the state of every servo.
+#  Each tick reads the positions and moving flags of all the servos of a board in one serial round
+#  trip, publishes the state of each one and an aggregated message with all the joints, so the
+#  rate of each servo doesn't drop with the number of servos.
+#
+class state_publisher(object):
+
+    #------------------------------------------------------------#
+    ## @brief Constructor of the class
+    #  @param servos:  List of servo_control objects.
+    #  @param rate:    Publishing frequency in Hz.
+    def __init__(self,servos,rate=20):
+        ## @var servos
+        #  @brief servo_control objects published
+        self.servos         =servos
+        ## @var period
+        #  @brief Time between ticks in seconds
+        self.period         =1.0/rate
+        self.rate           =rospy.Rate(rate)
+        ## @var joint_states_pub
+        #  @brief Publisher object of the state of all the joints
+        self.joint_states_pub=rospy.Publisher('joint_states',JointStateArray,queue_size=10)
+        ## @var boards
+        #  @brief Servos of each coalescer, the ones of a board are read together
+        self.boards         ={}
+        for servo in servos:
+            self.boards.setdefault(servo.coalescer,[]).append(servo)
+        ## @var models
+        #  @brief Calibration of the servos of each board, their positions are converted together
+        self.models         =dict((coalescer,calibration_model([servo.calibration for servo in servos])) for coalescer,servos in self.boards.items())
+        ## @var ticks
+        #  @brief Number of ticks published
+        self.ticks          =0
+        ## @var overruns
+        #  @brief Number of ticks whose work took longer than the period
+        self.overruns       =0
+        ## @var work_max
+        #  @brief Longest tick in seconds
+        self.work_max       =0.0
+        self.work_total     =0.0
+
+    #------------------------------------------------------------#
+    ## @brief Reads and publishes the state of all the servos once.
+    def publish(self):
+        names=[]
+        positions=[]
+        for coalescer,servos in self.boards.items():
+            channels=[servo._channel for servo in servos]
+            try:
+                pos,moving=coalescer.read_state(channels)
+            except (IOError,OSError) as e:
+                rospy.logwarn("Could not read the state of the servos: %s",str(e))
+                continue
+            radians=self.models[coalescer].usec2radians([pos[channel] for channel in channels])
+            for servo,current_pos in zip(servos,radians):
+                servo.publish_state(float(current_pos),moving[servo._channel])
+                names.append(str(servo._id))
+                positions.append(servo.current_pos_in_radians)
+        all_states=JointStateArray()
+        all_states.header.stamp=rospy.Time.now()
+        all_states.name=names
+        all_states.position=positions
+        self.joint_states_pub.publish(all_states)
+
+    #------------------------------------------------------------#
+    ## @brief Publishes at the fixed rate until ROS shuts down.
+    def spin(self):
+        while not rospy.is_shutdown():
+            start=monotonic()
+            self.publish()
+            work=monotonic()-start
+            self.ticks+=1
+            self.work_total+=work
+            self.work_max=max(self.work_max,work)
+            if work>self.period:
+                self.overruns+=1
+                rospy.logwarn_throttle(10,"State publisher overrun: %.1f ms for a %.1f ms period (%d of %d ticks)"%(work*1000,self.period*1000,self.overruns,self.ticks))
+            self.rate.sleep()
+
+    #------------------------------------------------------------#
+    ## @brief Counters of the publishing loop.
+    def stats(self):
+        return {'ticks':self.ticks,
+                'overruns':self.overruns,
+                'work_max':self.work_max,
+                'work_mean':self.work_total/self.ticks if self.ticks else 0.0}
+
+
+#------------------------------------------------------------#
+## @brief Waypoints of one trajectory message for some joints.
+#  The first waypoint, at time 0, is the last goal of each joint so the motion starts where it was.
+#  It isn't modified once built, the streaming thread samples it while the subscriber replaces it.
+#
+class joint_trajectory(object):
+
+    #------------------------------------------------------------#
+    ## @brief Constructor of the class
+    #  @param servos:     servo_control objects of the joints.
+    #  @param start:      ROS time in seconds of the time 0 of the waypoints.
+    #  @param times:      Array of the time of each waypoint from start, in seconds.
+    #  @param positions:  (waypoints, joints) array of positions in radians.
+    #  @param origin:     Trajectory this one was released from, itself if None.
+    def __init__(self,servos,start,times,positions,origin=None):
+        self.servos    =servos
+        self.start     =start
+        self.times     =times
+        self.positions =positions
+        ## @var origin
+        #  @brief Trajectory of the message, shared by the ones released from it
+        self.origin    =origin if origin is not None else self
+        ## @var boards
+        #  @brief Dictionary {coalescer: (columns, channels, calibration_model, {channel: servo})}
+        self.boards    =self.group()
+
+    #------------------------------------------------------------#
+    ## @brief Groups the joints by board: their columns, channels, calibration and servo of each channel.
+    def group(self):
+        columns={}
+        for index,servo in enumerate(self.servos):
+            columns.setdefault(servo.coalescer,[]).append(index)
+        boards={}
+        for coalescer,indices in columns.items():
+            servos=[self.servos[index] for index in indices]
+            boards[coalescer]=(indices,[servo._channel for servo in servos],calibration_model([servo.calibration for servo in servos]),dict((servo._channel,servo) for servo in servos))
+        return boards
+
+    #------------------------------------------------------------#
+    ## @brief Stops following the joints given, taken by a newer trajectory.
+    #  @return The trajectory of the other joints, itself if none was taken, None if all were.
+    def release(self,servos):
+        keep=[index for index,servo in enumerate(self.servos) if servo not in servos]
+        if len(keep)==len(self.servos):
+            return self
+        if not keep:
+            return None
+        return joint_trajectory([self.servos[index] for index in keep],self.start,self.times,self.positions[:,keep],self.origin)
+
+    #------------------------------------------------------------#
+    ## @brief Positions of all the joints at a time, interpolated linearly between the waypoints.
+    #  @param now: ROS time in seconds.
+    #  @return (array of radians, True once past the last waypoint)
+    def sample(self,now):
+        t=now-self.start
+        if t>=self.times[-1]:
+            return self.positions[-1],True
+        segment=min(max(np.searchsorted(self.times,t,side='right')-1,0),len(self.times)-2)
+        span=self.times[segment+1]-self.times[segment]
+        fraction=min(max((t-self.times[segment])/span,0.0),1.0) if span>0 else 1.0
+        return self.positions[segment]+fraction*(self.positions[segment+1]-self.positions[segment]),False
+
+
+#------------------------------------------------------------#
+## @brief Trajectory streamer of all the servos.
+#  Receives time stamped waypoints for many joints in one trajectory_msgs/JointTrajectory on the
+#  "trajectory" topic. A single thread samples every trajectory at a fixed rate, converts the
+#  positions of the joints of each board in one call and sends them to the coalescer of the board,
+#  which writes all of them at once. The ticks follow the clock, not the time the last one took, and
+#  the positions are sampled at the time of the tick, so a late tick doesn't delay the motion.
+#  When a trajectory ends, the arrival of each joint to the last waypoint is published on its
+#  command_completed topic.
+#
+class trajectory_streamer(threading.Thread):
+
+    #------------------------------------------------------------#
+    ## @brief Constructor of the class
+    #  @param servos:  List of servo_control objects.
+    #  @param rate:    Frequency of the targets sent in Hz.
+    def __init__(self,servos,rate=50):
+        threading.Thread.__init__(self)
+        self.daemon         =True
+        ## @var servos
+        #  @brief servo_control object of each joint name
+        self.servos         =dict((str(servo._id),servo) for servo in servos)
+        ## @var period
+        #  @brief Time between ticks in seconds
+        self.period         =1.0/rate
+        ## @var trajectories
+        #  @brief Trajectories being streamed
+        self.trajectories   =[]
+        self.lock           =threading.Lock()
+        self._wakeup        =threading.Event()
+        ## @var trajectory_sub
+        #  @brief Subscriber object of trajectory topic
+        self.trajectory_sub =rospy.Subscriber('trajectory',JointTrajectory,self.trajectory_callback)
+        ## @var ticks
+        #  @brief Number of ticks streamed
+        self.ticks          =0
+        ## @var late
+        #  @brief Number of ticks which started more than half a period late
+        self.late           =0
+        ## @var lateness_max
+        #  @brief Longest delay of a tick in seconds
+        self.lateness_max   =0.0
+
+    #------------------------------------------------------------#
+    ## @brief Trajectory callback, only queues the trajectory.
+    #  @param trajectory_msg: joint_names and points with positions and time_from_start; the
+    #  header stamp is the start time, now if it is 0.
+    #  @return None
+    def trajectory_callback(self,trajectory_msg):
+        for index,point in enumerate(trajectory_msg.points):
+            if len(point.positions)!=len(trajectory_msg.joint_names):
+                rospy.logwarn("Trajectory waypoint %d has %d positions for %d joints, ignored"%(index,len(point.positions),len(trajectory_msg.joint_names)))
+                return
+        columns=[]
+        servos=[]
+        for column,name in enumerate(trajectory_msg.joint_names):
+            servo=self.servos.get(name)
+            if servo is None:
+                rospy.logwarn("Trajectory for unknown joint "+str(name))
+            elif not servo.enabled:
+                rospy.logwarn("Trajectory for "+str(name)+", not enabled")
+            else:
+                columns.append(column)
+                servos.append(servo)
+        if not servos or not trajectory_msg.points:
+            return
+        times=[0.0]+[point.time_from_start.to_sec() for point in trajectory_msg.points]
+        if any(b<a for a,b in zip(times,times[1:])):
+            rospy.logwarn("Trajectory waypoints out of order, ignored")
+            return
+        positions=[[servo.last_goal_in_radians for servo in servos]]+[[point.positions[column] for column in columns] for point in trajectory_msg.points]
+        if trajectory_msg.header.stamp.is_zero():
+            start=rospy.get_time()
+        else:
+            start=trajectory_msg.header.stamp.to_sec()
+        trajectory=joint_trajectory(servos,start,np.array(times),np.array(positions,dtype=np.float64))
+        with self.lock:
+            remaining=[other.release(servos) for other in self.trajectories]
+            self.trajectories=[other for other in remaining if other is not None]+[trajectory]
+        self._wakeup.set()
+
+    #------------------------------------------------------------#
+    ## @brief Samples every trajectory and sends the targets of each board in one write.
+    #  @param now: ROS time in seconds.
+    def stream(self,now):
+        with self.lock:
+            trajectories=list(self.trajectories)
+        boards=set()
+        finished=[]
+        for trajectory in trajectories:
+            radians,done=trajectory.sample(now)
+            for coalescer,(indices,channels,model,by_channel) in trajectory.boards.items():
+                usecs=model.radians2usec(radians[indices])
+                on_complete=(lambda channel,arrived,by_channel=by_channel: by_channel[channel].command_completed(channel,arrived)) if done else None
+                # Speed and acceleration 0 (unlimited): the servo follows the targets streamed
+                coalescer.set_targets(dict(zip(channels,[int(usec) for usec in usecs])),speed=0,accel=0,on_complete=on_complete)
+                boards.add(coalescer)
+            for servo,goal in zip(trajectory.servos,radians):
+                servo.last_goal_in_radians=float(goal)
+            if done:
+                finished.append(trajectory.origin)
+        for coalescer in boards:
+            coalescer.flush()
+        if finished:
+            with self.lock:
+                # A trajectory released meanwhile ended too, its joints were already sent
+                self.trajectories=[trajectory for trajectory in self.trajectories if trajectory.origin not in finished]
+
+    #------------------------------------------------------------#
+    ## @brief Thread loop, sleeps while there is nothing to stream.
+    def run(self):
+        next_tick=rospy.get_time()
+        while not rospy.is_shutdown():
+            if not self.trajectories:
+                self._wakeup.wait(1.0)
+                self._wakeup.clear()
+                next_tick=rospy.get_time()
+                continue
+            now=rospy.get_time()
+            lateness=now-next_tick
+            self.ticks+=1
+            self.lateness_max=max(self.lateness_max,lateness)
+            if lateness>self.period/2:
+                self.late+=1
+            try:
+                self.stream(now)
+            except (IOError,OSError) as e:
+                rospy.logwarn("Could not stream the trajectory: %s",str(e))
+            except Exception as e:
+                # Keep streaming the next trajectories
+                rospy.logerr("Trajectory streamer: %s",str(e))
+            next_tick+=self.period
+            if next_tick<now:
+                # Too late: skip the ticks missed instead of sending them in a burst
+                next_tick=now+self.period
+            time.sleep(max(0.0,next_tick-rospy.get_time()))
+
+    #------------------------------------------------------------#
+    ## @brief Counters of the streaming loop.
+    def stats(self):
+        return {'trajectories':len(self.trajectories),
+                'ticks':self.ticks,
+                'late':self.late,
+                'lateness_max':self.lateness_max}
+
+
 
 if __name__ == '__main__':
     ## @var verbosity_level
@@ -473,15 +749,23 @@ if __name__ == '__main__':
     #  @brief List where each instance of each motor will be stored.
     #  @see servo_control.__init__
     objects_list     =[]
-    ## @var rate
-    #  @brief Variable which stores the frequency sleep rate
-    rate             =rospy.Rate(20)
+    ## @var state_rate
+    #  @brief Frequency of the state of every motor in Hz, default=20
+    state_rate       =rospy.get_param("~state_rate",20)
+    ## @var mini_maestro
+    #  @brief True if the board is a Mini Maestro 12/18/24, default=False (Micro Maestro)
+    mini_maestro     =rospy.get_param("~mini_maestro",False)
     for x in range(0,len(itemlist)) :
         if(itemlist[x].attributes['name'].value)!='':
-            objects_list.append(servo_control(id=str(itemlist[x].attributes['name'].value),channel=x,home=int(itemlist[x].attributes['home'].value),min_possible_us = int(itemlist[x].attributes['min'].value) ,max_possible_us = int(itemlist[x].attributes['max'].value),user_min=float(itemlist2[x].attributes['user_min_radians'].value),user_max=float(itemlist2[x].attributes['user_max_radians'].value), motor_amplitude = float(itemlist2[x].attributes['range_degrees'].value),default_vel=int(itemlist2[x].attributes['default_speed'].value),default_acc=int(itemlist2[x].attributes['default_acceleration'].value),pololu_vel_min=int(itemlist2[x].attributes['pololu_vel_min'].value),pololu_vel_max=int(itemlist2[x].attributes['pololu_vel_max'].value),port=str(port_address),num_device=int(device_id,16)))
+            objects_list.append(servo_control(id=str(itemlist[x].attributes['name'].value),channel=x,home=int(itemlist[x].attributes['home'].value),min_possible_us = int(itemlist[x].attributes['min'].value) ,max_possible_us = int(itemlist[x].attributes['max'].value),user_min=float(itemlist2[x].attributes['user_min_radians'].value),user_max=float(itemlist2[x].attributes['user_max_radians'].value), motor_amplitude = float(itemlist2[x].attributes['range_degrees'].value),default_vel=int(itemlist2[x].attributes['default_speed'].value),default_acc=int(itemlist2[x].attributes['default_acceleration'].value),pololu_vel_min=int(itemlist2[x].attributes['pololu_vel_min'].value),pololu_vel_max=int(itemlist2[x].attributes['pololu_vel_max'].value),port=str(port_address),num_device=int(device_id,16),calibration_table=rospy.get_param("~calibration/"+str(itemlist[x].attributes['name'].value),None),mini_maestro=mini_maestro))
             rospy.logdebug("-----------------------------------------------------------")
-    while not rospy.is_shutdown():
-        for Numero_motor in range(0,len(objects_list)):
-            objects_list[Numero_motor].publish_state()
-            rate.sleep()
-            #rate.sleep()
+    ## @var streamer
+    #  @brief Trajectory streamer of all the motors, at the ~trajectory_rate param in Hz, default=50
+    #  @see trajectory_streamer
+    streamer         =trajectory_streamer(objects_list,rospy.get_param("~trajectory_rate",50))
+    streamer.start()
+    ## @var publisher
+    #  @brief Publisher of the state of all the motors
+    #  @see state_publisher
+    publisher        =state_publisher(objects_list,state_rate)
+    publisher.spin()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python2.7
+
+
+## @file Servo_Calibration.py
+#  @brief Unit conversions of the servos, precomputed once.
+#
+#  @section Calibration_workflow
+#
+# Every conversion of servo_control (radians to quarter-microseconds and back, velocity percentage
+# to Maestro speed and back) is a piecewise linear function. Their segments are turned into slopes
+# and offsets when the servo is created, so a single conversion is a couple of float operations
+# instead of a call to np.interp. By default a joint has two segments, from its minimum to home and
+# from home to its maximum, but a table of (radians, quarter-microseconds) points measured on the
+# robot can replace them.
+#
+# A calibration_model stacks the segments of several servos in arrays, so the targets of a whole
+# pose or the positions of a state sweep are converted with one vectorized call.
+#
+#  @date  November,2019
+
+
+import bisect
+import numpy as np
+
+
+#------------------------------------------------------------#
+## @brief Piecewise linear function, clamped outside its points like np.interp.
+#
+class piecewise_linear(object):
+
+    #------------------------------------------------------------#
+    ## @brief Constructor of the class
+    #  @param xs:  Increasing or decreasing x of the points.
+    #  @param ys:  y of the points.
+    def __init__(self,xs,ys):
+        if len(xs)!=len(ys) or len(xs)<2:
+            raise ValueError("A piecewise linear function needs two or more points")
+        xs,ys=list(xs),list(ys)
+        if xs[-1]<xs[0]:
+            # Decreasing points (the inverse of a reversed servo), the same function from the other end
+            xs.reverse()
+            ys.reverse()
+        if any(b<a for a,b in zip(xs,xs[1:])):
+            raise ValueError("The x of the points must increase or decrease")
+        ## @var xs
+        #  @brief x of the points
+        self.xs      =[float(x) for x in xs]
+        ## @var ys
+        #  @brief y of the points
+        self.ys      =[float(y) for y in ys]
+        ## @var slopes
+        #  @brief Slope of each segment
+        self.slopes  =[]
+        ## @var offsets
+        #  @brief Offset of each segment
+        self.offsets =[]
+        for x0,x1,y0,y1 in zip(self.xs,self.xs[1:],self.ys,self.ys[1:]):
+            slope=(y1-y0)/(x1-x0) if x1>x0 else 0.0
+            self.slopes.append(slope)
+            self.offsets.append(y0-slope*x0)
+
+    #------------------------------------------------------------#
+    ## @brief Evaluates the function on one value.
+    def __call__(self,x):
+        if x<=self.xs[0]:
+            return self.ys[0]
+        if x>=self.xs[-1]:
+            return self.ys[-1]
+        segment=bisect.bisect_right(self.xs,x,1,len(self.xs)-1)-1
+        return self.slopes[segment]*x+self.offsets[segment]
+
+    #------------------------------------------------------------#
+    ## @brief Returns the inverse function (the y of the points must increase or decrease).
+    def inverse(self):
+        return piecewise_linear(self.ys,self.xs)
+
+
+#------------------------------------------------------------#
+## @brief Calibration of one servo.
+#
+class servo_calibration(object):
+
+    #------------------------------------------------------------#
+    ## @brief Constructor of the class
+    #  @param min_possible_us:    Quarter-microseconds of the low position limit.
+    #  @param home:               Quarter-microseconds of the home position (0 radians).
+    #  @param max_possible_us:    Quarter-microseconds of the high position limit.
+    #  @param halfrangeinradians: Half of the movement range of the motor in radians.
+    #  @param pololu_vel_min:     Maestro speed of the 0% velocity.
+    #  @param pololu_vel_max:     Maestro speed of the 100% velocity.
+    #  @param table:              Optional list of measured (radians, quarter-microseconds) points,
+    #                             in increasing or decreasing order, replacing the two default segments.
+    def __init__(self,min_possible_us,home,max_possible_us,halfrangeinradians,pololu_vel_min,pololu_vel_max,table=None):
+        if table:
+            radians,usecs=zip(*table)
+        else:
+            radians=(-halfrangeinradians,0,halfrangeinradians)
+            usecs  =(min_possible_us,home,max_possible_us)
+        ## @var to_us
+        #  @brief Radians to quarter-microseconds
+        self.to_us          =piecewise_linear(radians,usecs)
+        ## @var to_rad
+        #  @brief Quarter-microseconds to radians
+        self.to_rad         =self.to_us.inverse()
+        ## @var vel_to_pololu
+        #  @brief Velocity percentage (0-100) to Maestro speed
+        self.vel_to_pololu  =piecewise_linear((0,100),(pololu_vel_min,pololu_vel_max))
+        ## @var pololu_to_vel
+        #  @brief Maestro speed to velocity percentage
+        self.pololu_to_vel  =self.vel_to_pololu.inverse()
+
+
+#------------------------------------------------------------#
+## @brief Conversions of several servos at once.
+#  The segments of every servo are padded to the same number, repeating the last point, so they
+#  fit in (servos, segments) arrays.
+#
+class calibration_model(object):
+
+    #------------------------------------------------------------#
+    ## @brief Constructor of the class
+    #  @param calibrations:  List of servo_calibration, one per servo in the order of the values.
+    def __init__(self,calibrations):
+        ## @var to_us
+        #  @brief Arrays of the radians to quarter-microseconds conversion
+        self.to_us  =self._stack([calibration.to_us for calibration in calibrations])
+        ## @var to_rad
+        #  @brief Arrays of the quarter-microseconds to radians conversion
+        self.to_rad =self._stack([calibration.to_rad for calibration in calibrations])
+
+    def _stack(self,functions):
+        points=max(len(function.xs) for function in functions)
+        xs=np.empty((len(functions),points))
+        slopes=np.zeros((len(functions),points-1))
+        offsets=np.empty((len(functions),points-1))
+        for row,function in enumerate(functions):
+            count=len(function.xs)
+            xs[row,:count]=function.xs
+            xs[row,count:]=function.xs[-1]
+            slopes[row,:count-1]=function.slopes
+            offsets[row,:count-1]=function.offsets
+            # The padding segments are flat at the last y
+            offsets[row,count-1:]=function.ys[-1]
+        return xs,slopes,offsets
+
+    def _convert(self,arrays,values):
+        xs,slopes,offsets=arrays
+        values=np.clip(np.asarray(values,dtype=np.float64),xs[:,0],xs[:,-1])
+        # Index of the segment of each value: inner points it is past
+        segments=(values[:,None]>xs[:,1:-1]).sum(axis=1)
+        rows=np.arange(len(values))
+        return slopes[rows,segments]*values+offsets[rows,segments]
+
+    #------------------------------------------------------------#
+    ## @brief Converts the radians of every servo to quarter-microseconds.
+    #  @param radians:  Array with a value per servo.
+    #  @return Array of quarter-microseconds.
+    def radians2usec(self,radians):
+        return self._convert(self.to_us,radians)
+
+    #------------------------------------------------------------#
+    ## @brief Converts the quarter-microseconds of every servo to radians.
+    #  @param usecs:  Array with a value per servo.
+    #  @return Array of radians.
+    def usec2radians(self,usecs):
+        return self._convert(self.to_rad,usecs)
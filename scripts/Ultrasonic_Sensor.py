@@ -0,0 +1,506 @@
+#!/usr/bin/python
+# coding=utf-8
+import os
+import time
+import fcntl
+import math
+import errno
+import select
+import threading
+import collections
+import numpy as np
+from Monotonic_Clock import monotonic
+
+# ===========================================================================
+# Echo backends
+#
+# Both drive the trigger pin and deliver the edges of the echo pin as
+# (rising, timestamp) pairs, without polling the pin. fileno() becomes
+# readable when edges arrive, to wait on several sensors with select().
+# GpiodBackend uses the Linux GPIO character device, where the kernel
+# timestamps the edges when they happen (libgpiod v1 and v2 bindings).
+# RPiGPIOBackend uses the edge detection of RPi.GPIO, timestamped in its
+# callback thread.
+# ===========================================================================
+
+class GpiodBackend(object):
+
+    # Edges are stamped in the interrupt handler
+    timestamps = 'kernel'
+
+    def __init__(self, trigger, echo, chip='/dev/gpiochip0', consumer='ultrasonic'):
+        import gpiod
+        self.gpiod = gpiod
+        self.triggerPin = trigger
+        self.echoPin = echo
+        self.__pending = collections.deque()
+        # Edges stamped before the last trigger pulse belong to an older ping
+        self.__pulseTime = 0.0
+        if hasattr(gpiod, 'request_lines'):
+            # libgpiod v2
+            from gpiod.line import Direction, Edge, Value
+            self.__active = Value.ACTIVE
+            self.__inactive = Value.INACTIVE
+            self.__request = gpiod.request_lines(chip, consumer=consumer, config={
+                trigger: gpiod.LineSettings(direction=Direction.OUTPUT, output_value=Value.INACTIVE),
+                echo: gpiod.LineSettings(direction=Direction.INPUT, edge_detection=Edge.BOTH)})
+            self.__v2 = True
+        else:
+            # libgpiod v1
+            self.__chip = gpiod.Chip(chip)
+            self.__trigger = self.__chip.get_line(trigger)
+            self.__trigger.request(consumer=consumer, type=gpiod.LINE_REQ_DIR_OUT, default_vals=[0])
+            self.__echo = self.__chip.get_line(echo)
+            self.__echo.request(consumer=consumer, type=gpiod.LINE_REQ_EV_BOTH_EDGES)
+            self.__v2 = False
+
+    def pulse(self, width=0.00001):
+        "Sends a trigger pulse of at least 'width' seconds"
+        self.__pulseTime = monotonic()
+        if self.__v2:
+            self.__request.set_value(self.triggerPin, self.__active)
+            time.sleep(width)
+            self.__request.set_value(self.triggerPin, self.__inactive)
+        else:
+            self.__trigger.set_value(1)
+            time.sleep(width)
+            self.__trigger.set_value(0)
+
+    def __append(self, rising, timestamp):
+        # The kernel stamps the edges with CLOCK_MONOTONIC, like monotonic()
+        if timestamp >= self.__pulseTime:
+            self.__pending.append((rising, timestamp))
+
+    def __read(self, timeout):
+        # Moves every edge the kernel has queued to the pending list, waiting
+        # up to 'timeout' seconds for the first one
+        if self.__v2:
+            ready = self.__request.wait_edge_events(timeout)
+            rising = self.gpiod.EdgeEvent.Type.RISING_EDGE
+            while ready:
+                for event in self.__request.read_edge_events():
+                    self.__append(event.event_type == rising, event.timestamp_ns*1e-9)
+                ready = self.__request.wait_edge_events(0)
+        else:
+            sec = int(timeout)
+            ready = self.__echo.event_wait(sec=sec, nsec=int((timeout - sec)*1e9))
+            rising = self.gpiod.LineEvent.RISING_EDGE
+            while ready:
+                for event in self.__echo.event_read_multiple():
+                    self.__append(event.type == rising, event.sec + event.nsec*1e-9)
+                ready = self.__echo.event_wait(sec=0, nsec=0)
+
+    def flush(self):
+        "Drops the edges received so far"
+        self.__read(0)
+        self.__pending.clear()
+
+    def waitEdge(self, deadline):
+        "Returns the next (rising, timestamp) edge or None at the deadline \
+        (a monotonic() time)"
+        while not self.__pending:
+            remaining = deadline - monotonic()
+            # A past deadline still reads what is queued, without blocking
+            self.__read(max(remaining, 0))
+            if not self.__pending and remaining <= 0:
+                return None
+        return self.__pending.popleft()
+
+    def fileno(self):
+        if self.__v2:
+            return self.__request.fd
+        return self.__echo.event_get_fd()
+
+    def close(self):
+        if self.__v2:
+            self.__request.release()
+        else:
+            self.__trigger.release()
+            self.__echo.release()
+            self.__chip.close()
+
+
+class RPiGPIOBackend(object):
+
+    # Edges are stamped by the RPi.GPIO callback thread
+    timestamps = 'callback'
+
+    def __init__(self, trigger, echo):
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        self.triggerPin = trigger
+        self.echoPin = echo
+        self.__pending = collections.deque()
+        self.__cond = threading.Condition()
+        # Edges alternate from the trigger on: a short pulse may already be
+        # over when the callback reads the pin, so the level isn't used
+        self.__rising = True
+        # The callback writes a byte to the pipe for fileno()
+        self.__wakeup, self.__notify = os.pipe()
+        fcntl.fcntl(self.__wakeup, fcntl.F_SETFL, os.O_NONBLOCK)
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(trigger, GPIO.OUT)
+        GPIO.output(trigger, False)
+        GPIO.setup(echo, GPIO.IN)
+        GPIO.add_event_detect(echo, GPIO.BOTH, callback=self.__onEdge)
+
+    def __onEdge(self, channel):
+        now = monotonic()
+        with self.__cond:
+            self.__pending.append((self.__rising, now))
+            self.__rising = not self.__rising
+            self.__cond.notify_all()
+        os.write(self.__notify, b'e')
+
+    def __drain(self):
+        try:
+            while os.read(self.__wakeup, 256):
+                pass
+        except OSError as err:
+            if err.errno != errno.EAGAIN:
+                raise
+
+    def pulse(self, width=0.00001):
+        "Sends a trigger pulse of at least 'width' seconds"
+        self.GPIO.output(self.triggerPin, True)
+        time.sleep(width)
+        self.GPIO.output(self.triggerPin, False)
+
+    def flush(self):
+        "Drops the edges received so far"
+        self.__drain()
+        with self.__cond:
+            self.__pending.clear()
+            # A late echo may still be high, then its falling edge comes first
+            self.__rising = not self.GPIO.input(self.echoPin)
+
+    def waitEdge(self, deadline):
+        "Returns the next (rising, timestamp) edge or None at the deadline \
+        (a monotonic() time)"
+        self.__drain()
+        with self.__cond:
+            while not self.__pending:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    return None
+                self.__cond.wait(remaining)
+            return self.__pending.popleft()
+
+    def fileno(self):
+        return self.__wakeup
+
+    def close(self):
+        self.GPIO.remove_event_detect(self.echoPin)
+        os.close(self.__wakeup)
+        os.close(self.__notify)
+
+
+def openBackend(trigger, echo, chip='/dev/gpiochip0'):
+    "Returns the GPIO character device backend when the gpiod bindings and \
+    the chip are available, the RPi.GPIO one otherwise"
+    try:
+        return GpiodBackend(trigger, echo, chip)
+    except (ImportError, AttributeError, IOError, OSError):
+        return RPiGPIOBackend(trigger, echo)
+
+
+# ===========================================================================
+# UltrasonicSensor Class
+#
+# HC-SR04/KY-050 driver: the echo pulse is timed from its two edges, so the
+# thread sleeps during the measurement, and a missing echo times out after
+# the round trip of maxRange. trigger() and collect() can be used apart to
+# run several sensors at once.
+# ===========================================================================
+
+class UltrasonicSensor(object):
+
+    # Speed of sound in cm/s (about 20 degrees C)
+    speedOfSound = 34300.0
+    # The echo pin goes high about 0.5ms after the trigger (8 cycle burst),
+    # allow this much before giving up on a sensor
+    echoStartTimeout = 0.01
+    # Shortest safe time between two pings, so the echoes of the previous
+    # one have died out (60ms in the HC-SR04 datasheet)
+    minInterval = 0.06
+    # Pings further than this many robust standard deviations (1.4826 MAD)
+    # from the median are rejected by burst()
+    outlierThreshold = 3.0
+
+    def __init__(self, trigger, echo, maxRange=400.0, minRange=2.0, backend=None,
+                 history=64):
+        "trigger and echo are BCM pin numbers, the ranges are in cm. backend \
+        defaults to openBackend(). The last 'history' echo durations are kept \
+        for the jitter statistics."
+        self.triggerPin = trigger
+        self.echoPin = echo
+        self.maxRange = maxRange
+        self.minRange = minRange
+        self.backend = backend or openBackend(trigger, echo)
+        # Measurements, missing echoes and out of range results
+        self.measurements = 0
+        self.timeouts = 0
+        self.outOfRange = 0
+        self.durations = collections.deque(maxlen=history)
+        self.triggerTime = None
+        # Time the echo of the current measurement is given up at
+        self.deadline = None
+        # Echo duration in seconds of the last measurement, None if it failed
+        self.lastDuration = None
+        self.__rise = None
+        self.__duration = None
+
+    def maxDuration(self):
+        "Returns the echo duration of maxRange in seconds"
+        return 2.0*self.maxRange/self.speedOfSound
+
+    def toDistance(self, duration):
+        "Converts an echo duration in seconds to cm (there and back)"
+        return duration*self.speedOfSound/2.0
+
+    def trigger(self):
+        "Starts a measurement, collect() or poll() return its result"
+        self.backend.flush()
+        self.__rise = None
+        self.__duration = None
+        self.triggerTime = monotonic()
+        self.deadline = self.triggerTime + self.echoStartTimeout + 1.2*self.maxDuration()
+        self.backend.pulse()
+
+    def __process(self, deadline):
+        # Consumes the echo edges until the falling one (returns True) or
+        # the deadline (returns False)
+        while True:
+            edge = self.backend.waitEdge(deadline)
+            if edge is None:
+                return False
+            rising, timestamp = edge
+            if rising:
+                self.__rise = timestamp
+            elif self.__rise is not None:
+                self.__duration = timestamp - self.__rise
+                return True
+
+    def collect(self, deadline=None):
+        "Waits for the echo of the last trigger() and returns its duration in \
+        seconds, or None if it doesn't come (or end) in time or is out of range. \
+        deadline is a monotonic() time, by default it allows the echo of maxRange."
+        return self.__finish(self.__process(deadline or self.deadline))
+
+    def poll(self):
+        "Non-blocking collect(): returns a (done, duration) tuple, done being \
+        False while the echo can still come. See backend.fileno()."
+        if not self.__process(monotonic()) and (monotonic() < self.deadline):
+            return False, None
+        return True, self.__finish(self.__duration is not None)
+
+    def __finish(self, complete):
+        self.measurements += 1
+        duration = self.__duration if complete else None
+        self.lastDuration = duration
+        if duration is None:
+            self.timeouts += 1
+            return None
+        if not (self.minRange <= self.toDistance(duration) <= self.maxRange):
+            self.outOfRange += 1
+            return None
+        self.durations.append(duration)
+        return duration
+
+    def measure(self):
+        "Returns the distance in cm, or None if there is no valid echo"
+        self.trigger()
+        duration = self.collect()
+        if duration is None:
+            return None
+        return self.toDistance(duration)
+
+    def burst(self, count=5, interval=None):
+        "Fires 'count' pings 'interval' seconds apart (minInterval by default) \
+        and returns a dictionary with the median distance, the mean of the \
+        pings within outlierThreshold robust deviations of the median \
+        ('distance'), that deviation ('spread'), the number of pings kept \
+        and the confidence: the fraction of the pings that gave an echo and \
+        were kept. The distances are in cm, None if no ping got an echo."
+        if interval is None:
+            interval = self.minInterval
+        durations = np.empty(count)
+        start = monotonic()
+        for i in range(count):
+            delay = start + i*interval - monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.trigger()
+            duration = self.collect()
+            durations[i] = np.nan if duration is None else duration
+        result = {'count': count, 'kept': 0, 'confidence': 0.0,
+                  'median': None, 'distance': None, 'spread': None}
+        valid = durations[~np.isnan(durations)]
+        if len(valid) == 0:
+            return result
+        median = np.median(valid)
+        deviation = np.abs(valid - median)
+        # Floor of 1us (0.02cm) so identical pings don't reject everything else
+        sigma = max(1.4826*np.median(deviation), 1e-6)
+        kept = valid[deviation <= self.outlierThreshold*sigma]
+        result.update({'kept': len(kept),
+                       'confidence': float(len(kept))/count,
+                       'median': self.toDistance(median),
+                       'distance': self.toDistance(kept.mean()),
+                       'spread': self.toDistance(sigma)})
+        return result
+
+    def stats(self):
+        "Returns the counters and the mean and jitter (standard deviation) of \
+        the recent echoes, in cm and in microseconds"
+        stats = {'measurements': self.measurements,
+                 'timeouts': self.timeouts,
+                 'outOfRange': self.outOfRange,
+                 'timestamps': self.backend.timestamps}
+        count = len(self.durations)
+        if count:
+            mean = sum(self.durations)/count
+            jitter = math.sqrt(sum([(d - mean)**2 for d in self.durations])/count)
+            stats.update({'distance': self.toDistance(mean),
+                          'jitter': self.toDistance(jitter),
+                          'jitterUs': jitter*1e6})
+        return stats
+
+    def close(self):
+        self.backend.close()
+
+
+# ===========================================================================
+# UltrasonicArray Class
+#
+# Scheduler for several ultrasonic sensors. Sensors of the same geometry
+# group hear each other, so they ping in turn, each one as soon as the
+# previous echo of the group has ended (plus a guard time for reflections),
+# but never sooner than minInterval after its own previous ping.
+# Sensors of different groups ping at the same time. The echoes in flight
+# are followed with select() on the edge events of every sensor.
+# ===========================================================================
+
+class UltrasonicArray(object):
+
+    def __init__(self, sensors, guard=0.01):
+        "sensors is a list of (UltrasonicSensor, group) pairs, group being any \
+        label shared by the sensors that can hear each other. guard is the time \
+        in seconds a group stays quiet after an echo ends or times out."
+        self.sensors = [sensor for sensor, group in sensors]
+        self.guard = guard
+        self.groups = collections.OrderedDict()
+        for sensor, group in sensors:
+            self.groups.setdefault(group, []).append(sensor)
+        # Round robin position and time the group may ping again
+        self.__next = dict((group, 0) for group in self.groups)
+        self.__readyAt = dict((group, 0.0) for group in self.groups)
+        # Last (distance, timestamp) of each sensor, distance None without echo
+        self.latest = dict((sensor, (None, None)) for sensor in self.sensors)
+        # Pings fired, pings without a valid echo and seconds spent in run()
+        self.pings = 0
+        self.failures = 0
+        self.elapsed = 0.0
+
+    def __pick(self, group, counts, rounds):
+        # Index of the next sensor of the group in turn that still has
+        # rounds to do, None if there is none
+        members = self.groups[group]
+        for i in range(len(members)):
+            index = (self.__next[group] + i) % len(members)
+            if (rounds is None) or (counts[members[index]] < rounds):
+                return index
+        return None
+
+    def __readyTime(self, group, sensor):
+        # The group is quiet and the sensor's own previous ping has died out
+        if sensor.triggerTime is None:
+            return self.__readyAt[group]
+        return max(self.__readyAt[group], sensor.triggerTime + sensor.minInterval)
+
+    def run(self, duration=None, rounds=None, callback=None):
+        "Pings the sensors for 'duration' seconds or until every sensor has \
+        pinged 'rounds' times, whichever comes first (at least one of them is \
+        required). callback(sensor, distance, timestamp) is called for each \
+        result, distance in cm or None. Returns self.latest."
+        if duration is None and rounds is None:
+            raise ValueError("run() needs a duration or a number of rounds")
+        start = monotonic()
+        counts = dict((sensor, 0) for sensor in self.sensors)
+        inFlight = {}
+        while True:
+            now = monotonic()
+            finished = (duration is not None) and (now >= start + duration)
+            if rounds is not None:
+                finished = finished or min(counts.values()) >= rounds
+            if finished and not inFlight:
+                break
+            # Fire every idle group that is ready
+            wake = now + 1.0
+            if not finished:
+                for group in self.groups:
+                    if group in inFlight.values():
+                        continue
+                    index = self.__pick(group, counts, rounds)
+                    if index is None:
+                        continue
+                    members = self.groups[group]
+                    sensor = members[index]
+                    ready = self.__readyTime(group, sensor)
+                    if now < ready:
+                        wake = min(wake, ready)
+                        continue
+                    self.__next[group] = (index + 1) % len(members)
+                    sensor.trigger()
+                    inFlight[sensor] = group
+                    self.pings += 1
+            for sensor in inFlight:
+                wake = min(wake, sensor.deadline)
+            timeout = wake - monotonic()
+            if timeout > 0:
+                if inFlight:
+                    select.select([s.backend for s in inFlight], [], [], timeout)
+                else:
+                    time.sleep(timeout)
+            # Echoes that ended or timed out
+            for sensor in list(inFlight):
+                done, echo = sensor.poll()
+                if not done:
+                    continue
+                group = inFlight.pop(sensor)
+                now = monotonic()
+                self.__readyAt[group] = now + self.guard
+                counts[sensor] += 1
+                distance = None if echo is None else sensor.toDistance(echo)
+                if distance is None:
+                    self.failures += 1
+                self.latest[sensor] = (distance, now)
+                if callback is not None:
+                    callback(sensor, distance, now)
+        self.elapsed += monotonic() - start
+        return self.latest
+
+    def sweep(self):
+        "Pings every sensor once and returns their distances in the order of \
+        self.sensors"
+        latest = self.run(rounds=1)
+        return [latest[sensor][0] for sensor in self.sensors]
+
+    def rate(self):
+        "Returns the pings per second of the array"
+        return self.pings/self.elapsed if self.elapsed else 0.0
+
+
+if __name__ == '__main__':
+    sensor = UltrasonicSensor(23, 24)
+    try:
+        while True:
+            dist = sensor.measure()
+            if dist is None:
+                print("No echo in range")
+            else:
+                print("Measured Distance = %.1f cm" % dist)
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print(sensor.stats())
+        sensor.close()
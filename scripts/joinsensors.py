@@ -29,7 +29,8 @@ ADS1015 = 0x00  # 12-bit ADC
 ADS1115 = 0x01  # 16-bit
 
 # choosing the amplifing gain
-gain = 4096  # +/- 4.096V
+gain = 'auto'  # per channel auto-ranging, see ADS1x15.readADCAutoRanged()
+# gain = 4096  # +/- 4.096V
 # gain = 2048  # +/- 2.048V
 # gain = 1024  # +/- 1.024V
 # gain = 512   # +/- 0.512V
@@ -54,6 +55,9 @@ adc_channel_3 = 3    # Channel 3
 # initialise ADC (ADS1115)
 adc = ADS1x15(ic=ADS1115)
 
+# precompiled scan program reading the four channels back to back
+scan = adc.compileScan([adc_channel_0, adc_channel_1, adc_channel_2, adc_channel_3], gain, sps)
+
 #############################################################################################################
 
 # ########
@@ -64,10 +68,7 @@ adc = ADS1x15(ic=ADS1115)
 try:
         while True:
                 #read values
-                adc0 = adc.readADCSingleEnded(adc_channel_0, gain, sps)
-                adc1 = adc.readADCSingleEnded(adc_channel_1, gain, sps)
-                adc2 = adc.readADCSingleEnded(adc_channel_2, gain, sps)
-                adc3 = adc.readADCSingleEnded(adc_channel_3, gain, sps)
+                adc0, adc1, adc2, adc3 = scan.run()[0]
 
                 # print to console
                 print "Channel 0:", adc0, "mV "